@@ -1 +1,28 @@
-from .core import listen_for_events
\ No newline at end of file
+import sys
+
+__version__ = "1.12"
+
+# Loaded on first use, so importing the package (or running `certstream --version`) doesn't pull in websocket-client
+_LAZY = {
+    'listen_for_events': 'certstream.core',
+    'listen_for_events_multi': 'certstream.multi',
+}
+
+__all__ = ['__version__'] + sorted(_LAZY)
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        module = _LAZY.get(name)
+        if module is None:
+            raise AttributeError("module 'certstream' has no attribute '{}'".format(name))
+        import importlib
+        value = getattr(importlib.import_module(module), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY))
+else:
+    # No module __getattr__ (PEP 562) before 3.7
+    from .core import listen_for_events
+    from .multi import listen_for_events_multi
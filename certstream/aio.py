@@ -0,0 +1,83 @@
+import asyncio
+import copy
+import inspect
+import logging
+import time
+
+from .backoff import Backoff
+from .decode import get_decoder, LazyFrame
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+async def listen(url, skip_heartbeats=True, on_open=None, on_error=None, ping_interval=15, decoder=None, lazy=False, compression='deflate',
+                 raw_bytes=True, backoff=None, **kwargs):
+    """
+    Async counterpart of `certstream.listen_for_events`. Yields frames as they arrive and reconnects on errors,
+    so a single event loop can drive any number of feeds:
+
+        async for message in certstream.aio.listen('wss://certstream.calidog.io/'):
+            ...
+
+    Unlike the threaded client, this one can negotiate permessage-deflate (`compression='deflate'`, the default, or
+    None to turn it off), which cuts bandwidth several times over on a stream of JSON if the server supports it.
+    With `raw_bytes` frames are handed to the decoder as bytes without being decoded to str first (websockets 13 or
+    newer, older versions hand them over as str). Reconnects wait as `backoff` says, like `listen_for_events`. Extra
+    kwargs are passed to `websockets.connect`.
+    """
+    if websockets is None:
+        raise ImportError("certstream.aio requires the 'websockets' package (pip install certstream[aio])")
+
+    decoder = get_decoder(decoder)
+    backoff = copy.copy(Backoff.from_value(backoff))
+
+    # Frames with a full chain can be larger than the websockets default 1MiB limit
+    kwargs.setdefault('max_size', None)
+
+    while True:
+        connected_at = None
+        try:
+            async with websockets.connect(url, ping_interval=ping_interval, compression=compression, **kwargs) as ws:
+                certstream_logger.info("Connection established to CertStream! Listening for events...")
+                connected_at = time.time()
+                if on_open:
+                    on_open()
+
+                async for message in _messages(ws, raw_bytes):
+                    if lazy:
+                        frame = LazyFrame(message, decoder)
+                    else:
+                        frame = decoder(message)
+
+                    if frame.get('message_type', None) == "heartbeat" and skip_heartbeats:
+                        continue
+
+                    yield frame
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            if on_error:
+                on_error(ex)
+            certstream_logger.error("Error connecting to CertStream - {} - Sleeping for a few seconds and trying again...".format(ex))
+
+        delay = backoff.next_delay(time.time() - connected_at if connected_at else 0.0)
+        certstream_logger.info("Reconnecting in {:.1f} seconds...".format(delay))
+        await asyncio.sleep(delay)
+
+async def _messages(ws, raw_bytes):
+    # recv(decode=False) only exists since websockets 13
+    if not raw_bytes or 'decode' not in inspect.signature(ws.recv).parameters:
+        async for message in ws:
+            yield message
+        return
+
+    while True:
+        try:
+            message = await ws.recv(decode=False)
+        except websockets.ConnectionClosedOK:
+            return
+        yield message
+
+certstream_logger = logging.getLogger('certstream')
@@ -0,0 +1,75 @@
+import copy
+import random
+import time
+
+class Backoff(object):
+    """
+    Exponential backoff with full jitter for reconnects. The first retry waits somewhere up to `first` seconds, and
+    each retry after that up to `initial * factor ** n` seconds, capped at `maximum`. The randomness spreads a fleet
+    of clients out instead of having them all reconnect at once when a server restarts.
+
+    A connection which stayed up for at least `reset_after` seconds resets the backoff, so the next drop gets a
+    fast retry again. With `jitter=False` the delays are used as is.
+    """
+    def __init__(self, first=1.0, initial=2.0, factor=2.0, maximum=60.0, reset_after=30.0, jitter=True):
+        self.first = first
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+        self.reset_after = reset_after
+        self.jitter = jitter
+        self.attempts = 0
+
+    @classmethod
+    def from_value(cls, value):
+        """
+        Accepts a Backoff, None for the defaults, or a number for a fixed delay (the old behaviour was 5 seconds).
+        """
+        if value is None:
+            return cls()
+        if isinstance(value, Backoff):
+            return value
+        return cls(first=value, initial=value, factor=1.0, maximum=value, reset_after=0, jitter=False)
+
+    def reset(self):
+        self.attempts = 0
+
+    def next_delay(self, uptime=0.0):
+        """
+        Returns how long to wait before the next attempt, given how long the last connection was up for.
+        """
+        if self.reset_after and uptime >= self.reset_after:
+            self.reset()
+
+        if self.attempts == 0:
+            delay = self.first
+        else:
+            # Capping the exponent keeps a long outage from overflowing the float
+            delay = min(self.maximum, self.initial * self.factor ** min(self.attempts - 1, 64))
+
+        self.attempts += 1
+        return random.uniform(0, delay) if self.jitter else delay
+
+# Between retries of a failed request (a sink's batch, a backfill fetch) - quick at first, at most 30 seconds apart
+RETRY_BACKOFF = Backoff(first=0.5, initial=1.0, maximum=30.0, reset_after=0)
+
+def retry(function, retries=5, backoff=None, on_retry=None, give_up=None):
+    """
+    Returns `function()`, calling it again up to `retries` times while it raises, waiting between attempts as a fresh
+    copy of `backoff` says (RETRY_BACKOFF by default). `on_retry(exception, delay)` is called before each wait. The
+    last exception is raised once out of retries, or as soon as `give_up()` returns True.
+    """
+    backoff = copy.copy(Backoff.from_value(backoff if backoff is not None else RETRY_BACKOFF))
+    backoff.reset()
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except Exception as ex:
+            if attempt >= retries or (give_up is not None and give_up()):
+                raise
+            attempt += 1
+            delay = backoff.next_delay()
+            if on_retry is not None:
+                on_retry(ex, delay)
+            time.sleep(delay)
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+
+class Batcher(object):
+    """
+    Collects frames and hands them to `batch_callback(frames, context)` once `batch_size` frames are pending, or once
+    the oldest pending frame is `batch_interval` seconds old. Instances are used as the message callback.
+    """
+    def __init__(self, batch_callback, batch_size=500, batch_interval=1.0):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self.batch_callback = batch_callback
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.frames = []
+        self.context = None
+        self.deadline = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="certstream-batcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __call__(self, frame, context):
+        with self.condition:
+            if not self.frames:
+                self.deadline = time.time() + self.batch_interval
+                self.condition.notify()
+            self.frames.append(frame)
+            self.context = context
+            if len(self.frames) >= self.batch_size:
+                # On the receive thread, where an exception would be taken for a connection error
+                self._deliver()
+
+    def flush(self):
+        with self.condition:
+            self._flush()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+
+    def _flush(self):
+        # Called with the lock held, so batches are delivered one at a time and in order
+        if not self.frames:
+            return
+        frames, self.frames = self.frames, []
+        self.deadline = None
+        self.batch_callback(frames, self.context)
+
+    def _deliver(self):
+        try:
+            self._flush()
+        except Exception as ex:
+            certstream_logger.exception("Error in batch callback - {}".format(ex))
+
+    def _run(self):
+        with self.condition:
+            while not self.closed:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+
+                remaining = self.deadline - time.time()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+
+                self._deliver()
+
+certstream_logger = logging.getLogger('certstream')
@@ -0,0 +1,3 @@
+"""
+Benchmarks for certstream-python. `python -m certstream.bench --help` runs the harness against a local replay server.
+"""
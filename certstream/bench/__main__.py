@@ -0,0 +1,185 @@
+"""
+Benchmark harness. Starts a replay server in its own process, then runs each mode in a fresh client process and
+reports frames/sec, end to end callback latency, CPU time and peak RSS:
+
+    python -m certstream.bench --count 20000 --modes default,lazy,queue,cli-json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+
+import certstream
+from certstream.bench.frames import load_frames, synthetic_frames
+from certstream.bench.replay import ReplayServer
+
+def _seen(frame):
+    return frame.seen if hasattr(frame, 'seen') else frame['data']['seen']
+
+def _plain(record):
+    def _callback(message, context):
+        record(_seen(message))
+    return dict(message_callback=_callback)
+
+def _lazy(record):
+    def _callback(message, context):
+        message['data']['leaf_cert']['all_domains']
+        record(_seen(message))
+    return dict(message_callback=_callback, lazy=True)
+
+def _batch(record):
+    def _callback(messages, context):
+        for message in messages:
+            record(_seen(message))
+    return dict(message_callback=None, batch_callback=_callback, batch_size=500, batch_interval=0.1)
+
+def _queue(record):
+    return dict(message_callback=_plain(record)['message_callback'], queue_size=10000, workers=4)
+
+def _fields(record):
+    return dict(message_callback=_plain(record)['message_callback'], fields=['all_domains', 'seen', 'cert_index', 'source.url', 'fingerprint'])
+
+def _matcher(record):
+    from certstream.bench.frames import WORDS
+    from certstream.match import Matcher
+
+    matcher = Matcher(substrings=["{}{}".format(word, i) for word in WORDS for i in range(100)], suffixes=['.bank', '.xyz'])
+    return dict(message_callback=_plain(record)['message_callback'], matcher=matcher)
+
+def _cli(*argv):
+    def _setup(record):
+        from certstream import cli
+
+        handler = cli.get_message_handler(cli.parser.parse_args(list(argv) + ['--output', os.devnull]))
+
+        def _callback(message, context):
+            handler(message, context)
+            record(_seen(message))
+        return dict(message_callback=_callback, lazy='--raw' in argv)
+    return _setup
+
+MODES = {
+    'default': _plain,
+    'lazy': _lazy,
+    'batch': _batch,
+    'queue': _queue,
+    'fields': _fields,
+    'matcher': _matcher,
+    'cli-json': _cli('--json'),
+    'cli-raw': _cli('--raw'),
+    'cli-fields': _cli('--fields', 'all_domains,seen,source.url'),
+    'cli-human': _cli(),
+    'cli-human-full': _cli('--full'),
+    'cli-human-nocolor': _cli('--disable-colors'),
+}
+
+def _rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except (IOError, OSError):
+        return None
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run_mode(mode, url, decoder, results):
+    latencies = []
+    lock = threading.Lock()
+
+    def record(seen):
+        latency = time.time() - seen
+        with lock:
+            latencies.append(latency)
+
+    options = MODES[mode](record)
+    if decoder:
+        options['decoder'] = decoder
+
+    stop_event = threading.Event()
+    timings = {}
+
+    def on_state_change(state, client):
+        # Replay servers close the connection once they're done, so only ever connect once
+        if state == 'connected':
+            timings['start'] = time.time()
+            stop_event.set()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    certstream.listen_for_events(url=url, stop_event=stop_event, on_state_change=on_state_change, **options)
+    end = time.time()
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    elapsed = end - timings.get('start', end)
+    cpu = (usage_after.ru_utime - usage.ru_utime) + (usage_after.ru_stime - usage.ru_stime)
+    results.put({
+        'mode': mode,
+        'frames': len(latencies),
+        'seconds': elapsed,
+        'frames_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': (percentile(latencies, 0.5) or 0) * 1000,
+        'p99_ms': (percentile(latencies, 0.99) or 0) * 1000,
+        'cpu_seconds': cpu,
+        'cpu_percent': 100.0 * cpu / elapsed if elapsed else 0.0,
+        'max_rss_kb': usage_after.ru_maxrss,
+        'rss_kb': _rss_kb(),
+    })
+
+def _serve(frames, count, rate, ports):
+    server = ReplayServer(frames, count=count, rate=rate, heartbeat_every=1000)
+    ports.put(server.server.port)
+    server.serve_forever()
+
+parser = argparse.ArgumentParser(description='Benchmark certstream-python against a local replay server.')
+parser.add_argument('--count', type=int, default=20000, help='Frames replayed per mode.')
+parser.add_argument('--rate', type=float, default=None, help='Frames per second (as fast as possible by default).')
+parser.add_argument('--frames', default=None, help='JSONL file of recorded frames (synthetic frames are used without one).')
+parser.add_argument('--modes', default='default,lazy,batch,queue,fields,matcher,cli-json,cli-raw,cli-human', help='Comma separated modes, one of {}.'.format(", ".join(sorted(MODES))))
+parser.add_argument('--decoder', default=None, help='Decoder to use (json, orjson, simdjson).')
+parser.add_argument('--json', action='store_true', help='Output results as JSON lines.')
+
+def main():
+    args = parser.parse_args()
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error("Unknown mode '{}'".format(mode))
+
+    frames = load_frames(args.frames) if args.frames else synthetic_frames(1000)
+
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(frames, args.count, args.rate, ports))
+    server.daemon = True
+    server.start()
+    url = "ws://127.0.0.1:{}".format(ports.get())
+
+    if not args.json:
+        print("{:<20} {:>8} {:>10} {:>9} {:>9} {:>7} {:>10}".format('mode', 'frames', 'frames/s', 'p50 ms', 'p99 ms', 'cpu %', 'max rss MB'))
+
+    try:
+        for mode in modes:
+            results = multiprocessing.Queue()
+            client = multiprocessing.Process(target=run_mode, args=(mode, url, args.decoder, results))
+            client.start()
+            result = results.get()
+            client.join()
+
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print("{mode:<20} {frames:>8} {frames_per_sec:>10.0f} {p50_ms:>9.2f} {p99_ms:>9.2f} {cpu_percent:>7.0f} {rss:>10.1f}".format(
+                    rss=result['max_rss_kb'] / 1024.0, **result
+                ))
+            sys.stdout.flush()
+    finally:
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
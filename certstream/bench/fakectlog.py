@@ -0,0 +1,245 @@
+"""
+Fake CT log, serving `get-entries` for synthetic certificates (real DER, MerkleTreeLeaf encoded as in RFC 6962) so
+gap detection and backfill can be tested locally. With `--stream-port` it also streams the same certificates as
+certstream frames, leaving out a fraction of them for the client to notice and backfill:
+
+    python -m certstream.bench.fakectlog --port 4001 --size 100000 --stream-port 4000 --drop 0.01
+"""
+import argparse
+import base64
+import json
+import logging
+import random
+import struct
+import threading
+import time
+
+from certstream.bench.frames import ISSUERS, TLDS, WORDS
+from certstream.bench.replay import ReplayServer
+from certstream.gaps import entry_to_frame
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+
+def _der(tag, content):
+    length = len(content)
+    if length < 0x80:
+        return bytes(bytearray([tag, length])) + content
+    size = (length.bit_length() + 7) // 8
+    return bytes(bytearray([tag, 0x80 | size])) + length.to_bytes(size, 'big') + content
+
+def _sequence(*items):
+    return _der(0x30, b"".join(items))
+
+_SHA256_RSA = _sequence(_der(0x06, b'\x2a\x86\x48\x86\xf7\x0d\x01\x01\x0b'), _der(0x05, b''))
+_RSA = _sequence(_der(0x06, b'\x2a\x86\x48\x86\xf7\x0d\x01\x01\x01'), _der(0x05, b''))
+
+def _name(C=None, CN=None, O=None, **_):
+    attributes = []
+    for oid, value in ((b'\x55\x04\x06', C), (b'\x55\x04\x0a', O), (b'\x55\x04\x03', CN)):
+        if value:
+            tag = 0x13 if oid == b'\x55\x04\x06' else 0x0c
+            attributes.append(_der(0x31, _sequence(_der(0x06, oid), _der(tag, value.encode('utf-8')))))
+    return _sequence(*attributes)
+
+def _utc_time(timestamp):
+    return _der(0x17, time.strftime('%y%m%d%H%M%SZ', time.gmtime(timestamp)).encode('ascii'))
+
+def build_tbs_certificate(subject, issuer, serial, not_before, domains=(), ca=False, rng=None):
+    """
+    Builds a DER encoded TBSCertificate, with a random key.
+    """
+    rng = rng or random
+    extensions = [_sequence(_der(0x06, b'\x55\x1d\x13'), _der(0x01, b'\xff'), _der(0x04, _sequence(_der(0x01, b'\xff') if ca else b'')))]
+    if domains:
+        names = _sequence(*[_der(0x82, domain.encode('ascii')) for domain in domains])
+        extensions.append(_sequence(_der(0x06, b'\x55\x1d\x11'), _der(0x04, names)))
+
+    return _sequence(
+        _der(0xa0, _der(0x02, b'\x02')),
+        _der(0x02, serial.to_bytes(serial.bit_length() // 8 + 1, 'big')),
+        _SHA256_RSA,
+        _name(**issuer),
+        _sequence(_utc_time(not_before), _utc_time(not_before + 90 * 86400)),
+        _name(**subject),
+        _sequence(_RSA, _der(0x03, b'\x00' + bytes(bytearray(rng.getrandbits(8) for _ in range(140))))),
+        _der(0xa3, _sequence(*extensions)),
+    )
+
+def build_certificate(tbs, rng=None):
+    """
+    Wraps a TBSCertificate into a certificate with a random signature, nothing verifies them.
+    """
+    rng = rng or random
+    return _sequence(tbs, _SHA256_RSA, _der(0x03, b'\x00' + bytes(bytearray(rng.getrandbits(8) for _ in range(256)))))
+
+def _u24(value):
+    return struct.pack('>I', value)[1:]
+
+def _certificate_list(certificates):
+    body = b"".join(_u24(len(der)) + der for der in certificates)
+    return _u24(len(body)) + body
+
+class FakeCTLog(object):
+    """
+    HTTP server for a CT log of `size` synthetic certificates at http://<host>:<port>/. Entry `i` is the same on
+    every call. Every other entry is a precertificate. Like real logs it returns at most `max_entries` per request,
+    and with `fail_every` every nth request gets a 503, to exercise retries.
+    """
+    def __init__(self, size=100000, host='127.0.0.1', port=0, max_entries=256, fail_every=None, start_time=1700000000):
+        self.size = size
+        self.max_entries = max_entries
+        self.fail_every = fail_every
+        self.start_time = start_time
+        self.requests = 0
+        self.served = 0
+        self.lock = threading.Lock()
+        self.issuers = [
+            (issuer, build_certificate(build_tbs_certificate(issuer, ISSUERS[0], 1000 + i, 1600000000, ca=True, rng=random.Random(i))))
+            for i, issuer in enumerate(ISSUERS)
+        ]
+
+        log = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status, body = log.handle(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class _Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = _Server((host, port), _Handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}/".format(*self.server.server_address[:2])
+
+    def entry(self, index):
+        """
+        Returns the `get-entries` entry for `index`.
+        """
+        rng = random.Random(index)
+        base = "{}{}-{}.{}".format(rng.choice(WORDS), index, rng.choice(WORDS), rng.choice(TLDS))
+        domains = [base, "www." + base]
+        issuer, issuer_der = self.issuers[index % len(self.issuers)]
+        tbs = build_tbs_certificate({'CN': base}, issuer, index, self.start_time + index, domains=domains, rng=rng)
+        leaf = build_certificate(tbs, rng=rng)
+        timestamp = struct.pack('>Q', (self.start_time + index) * 1000)
+
+        if index % 2:
+            # Precertificate: the leaf carries the TBSCertificate, the extra data the precertificate and chain
+            leaf_input = b'\x00\x00' + timestamp + b'\x00\x01' + b'\x00' * 32 + _u24(len(tbs)) + tbs + b'\x00\x00'
+            extra_data = _u24(len(leaf)) + leaf + _certificate_list([issuer_der])
+        else:
+            leaf_input = b'\x00\x00' + timestamp + b'\x00\x00' + _u24(len(leaf)) + leaf + b'\x00\x00'
+            extra_data = _certificate_list([issuer_der])
+
+        return {
+            'leaf_input': base64.b64encode(leaf_input).decode('ascii'),
+            'extra_data': base64.b64encode(extra_data).decode('ascii'),
+        }
+
+    def handle(self, path):
+        parts = urlsplit(path)
+        with self.lock:
+            self.requests += 1
+            failing = self.fail_every and self.requests % self.fail_every == 0
+        if failing:
+            return 503, b'{"error": "try again"}'
+
+        if parts.path.endswith('/ct/v1/get-sth'):
+            return 200, json.dumps({'tree_size': self.size, 'timestamp': int(time.time() * 1000)}).encode('utf-8')
+        if not parts.path.endswith('/ct/v1/get-entries'):
+            return 404, b'{"error": "not found"}'
+
+        query = parse_qs(parts.query)
+        try:
+            start, end = int(query['start'][0]), int(query['end'][0])
+        except (KeyError, ValueError):
+            return 400, b'{"error": "start and end are required"}'
+        if start < 0 or end < start or start >= self.size:
+            return 400, b'{"error": "bad range"}'
+
+        end = min(end, self.size - 1, start + self.max_entries - 1)
+        entries = [self.entry(index) for index in range(start, end + 1)]
+        with self.lock:
+            self.served += len(entries)
+        return 200, json.dumps({'entries': entries}).encode('utf-8')
+
+    def frames(self, start=0, end=None, drop=0.0, seed=0):
+        """
+        Certstream frames for entries `start` to `end`, leaving out a `drop` fraction of them at random.
+        """
+        rng = random.Random(seed)
+        source = {'url': self.url, 'name': "Fake CT log"}
+        end = self.size - 1 if end is None else end
+        frames = []
+        for index in range(start, end + 1):
+            if drop and rng.random() < drop:
+                continue
+            frame = entry_to_frame(source, index, self.entry(index), self.url)
+            del frame['data']['backfilled']
+            frames.append(frame)
+        return frames
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="certstream-fakectlog")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        if self.thread is not None:
+            self.server.shutdown()
+        self.server.server_close()
+
+parser = argparse.ArgumentParser(description='Serve a fake CT log, and optionally a certstream of it with gaps.')
+parser.add_argument('--host', default='127.0.0.1', help='Address to listen on.')
+parser.add_argument('--port', type=int, default=4001, help='Port to serve the log on.')
+parser.add_argument('--size', type=int, default=100000, help='Number of entries in the log.')
+parser.add_argument('--max-entries', type=int, default=256, help='Most entries returned by one get-entries request.')
+parser.add_argument('--fail-every', type=int, default=None, help='Answer every nth request with a 503.')
+parser.add_argument('--stream-port', type=int, default=None, help='Also stream the log as certstream frames on this port.')
+parser.add_argument('--drop', type=float, default=0.01, help='Fraction of the streamed certificates left out.')
+parser.add_argument('--rate', type=float, default=None, help='Frames streamed per second (as fast as possible by default).')
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(format='[%(levelname)s:%(name)s] %(asctime)s - %(message)s', level=logging.INFO)
+
+    log = FakeCTLog(size=args.size, host=args.host, port=args.port, max_entries=args.max_entries, fail_every=args.fail_every)
+    if args.stream_port is None:
+        certstream_logger.info("Serving a fake CT log of {} entries on {}".format(args.size, log.url))
+        log.serve_forever()
+        return
+
+    log.start()
+    frames = log.frames(drop=args.drop)
+    stream = ReplayServer(frames, count=len(frames), rate=args.rate, host=args.host, port=args.stream_port)
+    certstream_logger.info("Serving a fake CT log of {} entries on {}, streaming {} of them on {}".format(args.size, log.url, len(frames), stream.url))
+    stream.serve_forever()
+
+certstream_logger = logging.getLogger('certstream')
+
+if __name__ == "__main__":
+    main()
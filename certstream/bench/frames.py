@@ -0,0 +1,113 @@
+import base64
+import json
+import os
+import random
+
+LOGS = [
+    ("ct.googleapis.com/logs/argon2024/", "Google 'Argon2024' log"),
+    ("ct.googleapis.com/logs/xenon2024/", "Google 'Xenon2024' log"),
+    ("ct.cloudflare.com/logs/nimbus2024/", "Cloudflare 'Nimbus2024' Log"),
+    ("oak.ct.letsencrypt.org/2024h1/", "Let's Encrypt 'Oak2024H1' log"),
+    ("sabre.ct.comodo.com/", "Comodo 'Sabre' CT log"),
+]
+
+ISSUERS = [
+    {"C": "US", "CN": "R3", "L": None, "O": "Let's Encrypt", "OU": None, "ST": None, "aggregated": "/C=US/CN=R3/O=Let's Encrypt"},
+    {"C": "US", "CN": "E1", "L": None, "O": "Let's Encrypt", "OU": None, "ST": None, "aggregated": "/C=US/CN=E1/O=Let's Encrypt"},
+    {"C": "AT", "CN": "ZeroSSL RSA Domain Secure Site CA", "L": None, "O": "ZeroSSL", "OU": None, "ST": None,
+     "aggregated": "/C=AT/CN=ZeroSSL RSA Domain Secure Site CA/O=ZeroSSL"},
+    {"C": "US", "CN": "GTS CA 1P5", "L": None, "O": "Google Trust Services LLC", "OU": None, "ST": None,
+     "aggregated": "/C=US/CN=GTS CA 1P5/O=Google Trust Services LLC"},
+]
+
+TLDS = ['com', 'net', 'org', 'io', 'de', 'co.uk', 'app', 'dev', 'xyz', 'com.br', 'fr', 'ru']
+
+WORDS = ['shop', 'mail', 'cloud', 'secure', 'login', 'app', 'my', 'api', 'cdn', 'portal', 'dev', 'home', 'pay', 'web']
+
+def _fingerprint(rng):
+    return ":".join("{:02X}".format(rng.randrange(256)) for _ in range(20))
+
+def synthetic_frame(index, rng=None):
+    """
+    Builds a certificate_update frame with the same shape and roughly the same size as the real thing (a leaf with
+    extensions and a DER blob, and a two certificate chain).
+    """
+    rng = rng or random
+    log_url, log_name = LOGS[index % len(LOGS)]
+    issuer = ISSUERS[index % len(ISSUERS)]
+
+    base = "{}{}-{}.{}".format(rng.choice(WORDS), rng.randrange(100000), rng.choice(WORDS), rng.choice(TLDS))
+    domains = [base, "www." + base] + ["{}.{}".format(rng.choice(WORDS), base) for _ in range(rng.randrange(0, 4))]
+    subject = {"C": None, "CN": base, "L": None, "O": None, "OU": None, "ST": None, "aggregated": "/CN=" + base}
+
+    return {
+        "message_type": "certificate_update",
+        "data": {
+            "update_type": "X509LogEntry",
+            "leaf_cert": {
+                "subject": subject,
+                "issuer": issuer,
+                "extensions": {
+                    "keyUsage": "Digital Signature, Key Encipherment",
+                    "extendedKeyUsage": "TLS Web server authentication, TLS Web client authentication",
+                    "basicConstraints": "CA:FALSE",
+                    "subjectKeyIdentifier": _fingerprint(rng),
+                    "authorityKeyIdentifier": "keyid:" + _fingerprint(rng) + "\n",
+                    "authorityInfoAccess": "CA Issuers - URI:http://r3.i.lencr.org/\nOCSP - URI:http://r3.o.lencr.org\n",
+                    "subjectAltName": ", ".join("DNS:" + d for d in domains),
+                    "certificatePolicies": "Policy: 2.23.140.1.2.1",
+                },
+                "not_before": 1700000000.0 + index,
+                "not_after": 1707776000.0 + index,
+                "serial_number": "{:036X}".format(rng.getrandbits(144)),
+                "fingerprint": _fingerprint(rng),
+                "as_der": base64.b64encode(os.urandom(1300)).decode('ascii'),
+                "all_domains": domains,
+            },
+            "chain": [
+                {
+                    "subject": issuer,
+                    "extensions": {"basicConstraints": "CA:TRUE", "keyUsage": "Digital Signature, Certificate Sign, CRL Sign"},
+                    "not_before": 1599177600.0,
+                    "not_after": 1758023999.0,
+                    "serial_number": "912B084ACF0C18A753F6D62E25A75F5A",
+                    "fingerprint": "A0:53:37:5B:FE:84:E8:B7:48:78:2C:7C:EE:15:82:7A:6A:F5:A4:05",
+                    "as_der": base64.b64encode(os.urandom(1290)).decode('ascii'),
+                },
+                {
+                    "subject": {"C": "US", "CN": "ISRG Root X1", "O": "Internet Security Research Group", "aggregated": "/C=US/CN=ISRG Root X1/O=Internet Security Research Group"},
+                    "extensions": {"basicConstraints": "CA:TRUE", "keyUsage": "Certificate Sign, CRL Sign"},
+                    "not_before": 1611360000.0,
+                    "not_after": 1727395199.0,
+                    "serial_number": "4001772137D4E942B8EE76AA3C640AB7",
+                    "fingerprint": "93:3C:6D:DE:C0:1B:0A:FA:94:14:66:7C:D8:19:9B:15:DF:A6:59:5C",
+                    "as_der": base64.b64encode(os.urandom(1380)).decode('ascii'),
+                },
+            ],
+            "cert_index": 100000000 + index // len(LOGS),
+            "cert_link": "https://{}ct/v1/get-entries?start={}&end={}".format(log_url, index, index),
+            "seen": 0.0,
+            "source": {"url": log_url, "name": log_name},
+        },
+    }
+
+def synthetic_frames(count, seed=0):
+    rng = random.Random(seed)
+    return [synthetic_frame(i, rng) for i in range(count)]
+
+def load_frames(path, limit=None):
+    """
+    Loads recorded frames from a JSONL file, one frame per line.
+    """
+    frames = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            frames.append(json.loads(line))
+            if limit and len(frames) >= limit:
+                break
+    return frames
+
+HEARTBEAT = {"message_type": "heartbeat", "timestamp": 0.0}
@@ -0,0 +1,79 @@
+"""
+Import time budget check. Imports each module in a few fresh interpreters, and fails if the median import time is
+over its budget or if it loaded a module it should leave for later (websocket-client for the CLI, optional
+libraries anywhere):
+
+    python -m certstream.bench.imports --runs 7 --scale 2
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+OPTIONAL = ['orjson', 'simdjson', 'ahocorasick', 'tldextract', 'cryptography', 'urwid', 'zstandard', 'websockets']
+
+# (module, budget in ms, modules it mustn't import)
+BUDGETS = [
+    ('certstream', 10, ['websocket', 'logging', 'certstream.core'] + OPTIONAL),
+    ('certstream.cli', 50, ['websocket', 'termcolor', 'logging', 'certstream.core'] + OPTIONAL),
+    ('certstream.decode', 30, OPTIONAL),
+    ('certstream.match', 30, OPTIONAL),
+    ('certstream.core', 200, ['certstream.filters', 'certstream.dispatch'] + OPTIONAL),
+]
+
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+sys.stdout.write(json.dumps([elapsed, sorted(sys.modules)]))
+"""
+
+def measure(module, runs=5):
+    """
+    Returns (median seconds, modules loaded) for importing `module` in `runs` fresh interpreters.
+    """
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', _MEASURE.format(module=module)])
+        elapsed, modules = json.loads(output.decode('utf-8'))
+        timings.append(elapsed)
+    return sorted(timings)[len(timings) // 2], modules
+
+def _loaded(modules, name):
+    return any(loaded == name or loaded.startswith(name + '.') for loaded in modules)
+
+parser = argparse.ArgumentParser(description='Check certstream import times against their budgets.')
+parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per module, the median is used.')
+parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for the budgets, for slow machines.')
+parser.add_argument('--json', action='store_true', help='Output results as JSON lines.')
+
+def main():
+    args = parser.parse_args()
+    failed = False
+
+    if not args.json:
+        print("{:<20} {:>9} {:>9}  {}".format('module', 'ms', 'budget', 'result'))
+
+    for module, budget, forbidden in BUDGETS:
+        elapsed, modules = measure(module, runs=args.runs)
+        budget_ms = budget * args.scale
+        loaded = [name for name in forbidden if _loaded(modules, name)]
+
+        problems = []
+        if elapsed * 1000 > budget_ms:
+            problems.append('over budget')
+        if loaded:
+            problems.append('imported {}'.format(", ".join(loaded)))
+        failed = failed or bool(problems)
+
+        if args.json:
+            print(json.dumps({'module': module, 'ms': elapsed * 1000, 'budget_ms': budget_ms, 'modules': len(modules), 'imported': loaded, 'ok': not problems}))
+        else:
+            print("{:<20} {:>9.1f} {:>9.0f}  {}".format(module, elapsed * 1000, budget_ms, "; ".join(problems) or 'ok'))
+        sys.stdout.flush()
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
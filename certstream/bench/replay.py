@@ -0,0 +1,92 @@
+import argparse
+import json
+import logging
+import threading
+import time
+
+from certstream.bench.frames import HEARTBEAT, load_frames, synthetic_frames
+from certstream.server import WebSocketServer, encode_frame
+
+SEEN_PLACEHOLDER = "__SEEN__"
+
+class ReplayServer(object):
+    """
+    Local websocket server replaying `frames` to every client that connects, at `rate` frames per second (or as fast
+    as possible without one). Each connection gets `count` frames, cycling through `frames` as needed, and is then
+    closed. `seen` is set to the time each frame is sent, so clients can measure their end to end latency from it.
+    """
+    def __init__(self, frames, count=None, rate=None, heartbeat_every=None, host='127.0.0.1', port=0):
+        self.count = count or len(frames)
+        self.rate = rate
+        self.heartbeat_every = heartbeat_every
+        self.templates = [self._template(frame) for frame in frames]
+        self.heartbeat = encode_frame(json.dumps(HEARTBEAT))
+        self.server = WebSocketServer(self._on_connect, host=host, port=port)
+
+    @property
+    def url(self):
+        return self.server.url
+
+    @staticmethod
+    def _template(frame):
+        # Encode the frame once, leaving a hole for the send time
+        frame = json.loads(json.dumps(frame))
+        if frame.get('message_type') == 'certificate_update':
+            frame['data']['seen'] = SEEN_PLACEHOLDER
+        return tuple(json.dumps(frame).split('"{}"'.format(SEEN_PLACEHOLDER)))
+
+    def _on_connect(self, connection):
+        thread = threading.Thread(target=self._replay, args=(connection,), name="certstream-replay")
+        thread.daemon = True
+        thread.start()
+
+    def _replay(self, connection):
+        templates = self.templates
+        start = time.time()
+        try:
+            for i in range(self.count):
+                if self.rate:
+                    delay = start + i / float(self.rate) - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                if self.heartbeat_every and i % self.heartbeat_every == 0:
+                    connection.send_raw(self.heartbeat)
+
+                connection.send_raw(encode_frame(repr(time.time()).join(templates[i % len(templates)])))
+        except Exception as ex:
+            certstream_logger.info("Replay to {} stopped - {}".format(connection.address, ex))
+        finally:
+            connection.close()
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.stop()
+
+parser = argparse.ArgumentParser(description='Replay recorded or synthetic CertStream frames to local clients.')
+parser.add_argument('--host', default='127.0.0.1', help='Address to listen on.')
+parser.add_argument('--port', type=int, default=4000, help='Port to listen on.')
+parser.add_argument('--frames', default=None, help='JSONL file of recorded frames (synthetic frames are used without one).')
+parser.add_argument('--count', type=int, default=100000, help='Number of frames sent to each client.')
+parser.add_argument('--rate', type=float, default=None, help='Frames per second (as fast as possible by default).')
+parser.add_argument('--heartbeat-every', type=int, default=1000, help='Send a heartbeat every N frames.')
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(format='[%(levelname)s:%(name)s] %(asctime)s - %(message)s', level=logging.INFO)
+
+    frames = load_frames(args.frames) if args.frames else synthetic_frames(1000)
+    server = ReplayServer(frames, count=args.count, rate=args.rate, heartbeat_every=args.heartbeat_every, host=args.host, port=args.port)
+    certstream_logger.info("Replaying {} frames per connection on {}".format(args.count, server.url))
+    server.serve_forever()
+
+certstream_logger = logging.getLogger('certstream')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import glob
+import gzip
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .decode import get_decoder, LazyFrame
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ('jsonl', 'lp')
+COMPRESSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+INDEX_FILE = 'index.jsonl'
+
+_LENGTH = struct.Struct('!I')
+
+def encode_frame(frame):
+    """
+    Returns the raw bytes for a frame, reusing the original text for lazy frames.
+    """
+    if isinstance(frame, LazyFrame):
+        raw = frame.raw
+        return raw.encode('utf-8') if isinstance(raw, str) else bytes(raw)
+    if orjson is not None:
+        return orjson.dumps(frame)
+    return json.dumps(frame).encode('utf-8')
+
+class Recorder(object):
+    """
+    Writes frames to rotating segment files in `directory`, either as JSON lines (`format='jsonl'`) or length
+    prefixed (`format='lp'`, a 4 byte big endian length before each frame), optionally compressed with 'gzip' or
+    'zstd'. A segment is closed once it holds `segment_size` bytes of frames or has been open `segment_seconds`, and
+    every closed segment gets a line in `index.jsonl` with its frame count, the range of `seen` times it covers and
+    the range of cert_index per log, which `replay` uses to skip segments.
+
+    Instances are used as the message callback (or batch callback), and pair well with `lazy=True` since lazy frames
+    are written out as received without being re-encoded.
+    """
+    def __init__(self, directory, format='jsonl', compression='gzip', segment_size=256 * 1024 * 1024, segment_seconds=3600):
+        if format not in FORMATS:
+            raise ValueError("format must be one of {}".format(", ".join(FORMATS)))
+        if compression not in COMPRESSIONS:
+            raise ValueError("compression must be one of None, 'gzip' or 'zstd'")
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError("zstd compression requires the 'zstandard' package")
+
+        self.directory = directory
+        self.format = format
+        self.compression = compression
+        self.segment_size = segment_size
+        self.segment_seconds = segment_seconds
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.file = None
+        self.raw_file = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __call__(self, frame, context=None):
+        self.write(frame)
+
+    def write(self, frame):
+        data = encode_frame(frame)
+
+        with self.lock:
+            if self.file is None:
+                self._open()
+
+            if self.format == 'jsonl':
+                self.file.write(data)
+                self.file.write(b"\n")
+            else:
+                self.file.write(_LENGTH.pack(len(data)))
+                self.file.write(data)
+
+            self._track(frame)
+            self.bytes_written += len(data) + (1 if self.format == 'jsonl' else _LENGTH.size)
+
+            if self.bytes_written >= self.segment_size or time.time() - self.opened_at >= self.segment_seconds:
+                self._close_segment()
+
+    def write_batch(self, frames, context=None):
+        for frame in frames:
+            self.write(frame)
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self._close_segment()
+
+    def _open(self):
+        self.opened_at = time.time()
+        # Never clobber a segment left behind by an earlier recorder which started in the same second
+        while True:
+            self.sequence += 1
+            name = "certstream-{}-{:06d}.{}{}".format(
+                time.strftime('%Y%m%dT%H%M%S', time.gmtime(self.opened_at)),
+                self.sequence, self.format, COMPRESSIONS[self.compression],
+            )
+            self.path = os.path.join(self.directory, name)
+            if not os.path.exists(self.path):
+                break
+        self.raw_file = open(self.path, 'wb')
+
+        if self.compression == 'gzip':
+            self.file = gzip.GzipFile(fileobj=self.raw_file, mode='wb', compresslevel=6)
+        elif self.compression == 'zstd':
+            self.file = zstandard.ZstdCompressor().stream_writer(self.raw_file)
+        else:
+            self.file = self.raw_file
+
+        self.bytes_written = 0
+        self.frames = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.logs = {}
+
+    def _track(self, frame):
+        self.frames += 1
+        if frame.get('message_type') != 'certificate_update':
+            return
+
+        if isinstance(frame, LazyFrame):
+            # Recording shouldn't be what decodes every frame
+            seen, url, index = frame.sniff('seen'), frame.sniff('source_url'), frame.sniff('cert_index')
+        else:
+            data = frame['data']
+            seen, url, index = data.get('seen'), data['source']['url'], data.get('cert_index')
+
+        if seen is not None:
+            self.first_seen = seen if self.first_seen is None else min(self.first_seen, seen)
+            self.last_seen = seen if self.last_seen is None else max(self.last_seen, seen)
+
+        if index is not None:
+            bounds = self.logs.get(url)
+            self.logs[url] = [index, index] if bounds is None else [min(bounds[0], index), max(bounds[1], index)]
+
+    def _close_segment(self):
+        if self.file is None:
+            return
+
+        self.file.close()
+        if self.raw_file is not self.file:
+            self.raw_file.close()
+        self.file = self.raw_file = None
+
+        entry = {
+            'file': os.path.basename(self.path),
+            'frames': self.frames,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'logs': self.logs,
+        }
+        with open(os.path.join(self.directory, INDEX_FILE), 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+
+        certstream_logger.debug("Closed segment {} with {} frames".format(self.path, self.frames))
+
+def read_index(directory):
+    entries = []
+    path = os.path.join(directory, INDEX_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    return entries
+
+def find_segments(path, start=None, end=None, log_url=None, cert_index=None):
+    """
+    Returns the segment files under `path` (a directory written by a Recorder, or a single segment) which may hold
+    frames seen between `start` and `end`, or the given `cert_index` of `log_url`. Segments which aren't in the index
+    yet (the one still being written) are always included.
+    """
+    if not os.path.isdir(path):
+        return [path]
+
+    index = dict((entry['file'], entry) for entry in read_index(path))
+    segments = []
+
+    for segment in sorted(glob.glob(os.path.join(path, 'certstream-*'))):
+        entry = index.get(os.path.basename(segment))
+        if entry is not None:
+            if start is not None and entry['last_seen'] is not None and entry['last_seen'] < start:
+                continue
+            if end is not None and entry['first_seen'] is not None and entry['first_seen'] > end:
+                continue
+            if log_url is not None:
+                bounds = entry['logs'].get(log_url)
+                if bounds is None or (cert_index is not None and not bounds[0] <= cert_index <= bounds[1]):
+                    continue
+        segments.append(segment)
+
+    return segments
+
+def _open_segment(path, mapped):
+    if path.endswith('.gz'):
+        return gzip.GzipFile(fileobj=mapped, mode='rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("Reading zstd segments requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().stream_reader(mapped)
+    return None
+
+def read_segment(path):
+    """
+    Yields the raw bytes of every frame in a segment, reading through a memory map.
+    """
+    length_prefixed = '.lp' in os.path.basename(path)
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            stream = _open_segment(path, mapped)
+
+            if stream is None:
+                # Uncompressed segments are sliced straight out of the map
+                view = memoryview(mapped)
+                try:
+                    position, size = 0, len(mapped)
+                    while position < size:
+                        if length_prefixed:
+                            length = _LENGTH.unpack_from(mapped, position)[0]
+                            position += _LENGTH.size
+                            yield bytes(view[position:position + length])
+                            position += length
+                        else:
+                            newline = mapped.find(b"\n", position)
+                            newline = size if newline == -1 else newline
+                            if newline > position:
+                                yield bytes(view[position:newline])
+                            position = newline + 1
+                finally:
+                    view.release()
+                return
+
+            try:
+                if length_prefixed:
+                    while True:
+                        header = stream.read(_LENGTH.size)
+                        if len(header) < _LENGTH.size:
+                            break
+                        yield stream.read(_LENGTH.unpack(header)[0])
+                else:
+                    # zstandard's reader can't iterate lines itself
+                    lines = _LineReader(stream) if path.endswith('.zst') else stream
+                    for line in lines:
+                        line = line.rstrip(b"\n")
+                        if line:
+                            yield line
+            except EOFError:
+                # A segment which wasn't closed cleanly is read up to where it stops
+                certstream_logger.warning("Segment {} is truncated".format(path))
+            finally:
+                stream.close()
+        finally:
+            mapped.close()
+
+class _LineReader(object):
+    def __init__(self, stream, chunk_size=1024 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        pending = b""
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+
+def replay(message_callback, path, speed=None, start=None, end=None, skip_heartbeats=True, decoder=None, lazy=False, context=None, **kwargs):
+    """
+    Feeds recorded frames from `path` (a Recorder directory or a single segment) to `message_callback(frame, context)`
+    exactly like `listen_for_events` would, pipeline options (batch_callback, queue_size, matcher, fields...) included.
+
+    By default frames are replayed as fast as they can be read, `speed=1.0` replays them at the pace they were seen
+    (2.0 twice as fast, and so on). `start` and `end` limit the replay to frames seen in that time range.
+    """
+    from .core import Context, _build_pipeline, _close_stages, _context_stages
+
+    if context is None:
+        context = Context()
+    callback, stages = _build_pipeline(message_callback, context=context, **kwargs)
+    stages.extend(_context_stages(context))
+    decoder = get_decoder(decoder)
+    first_seen = started = None
+
+    try:
+        for segment in find_segments(path, start=start, end=end):
+            for raw in read_segment(segment):
+                frame = LazyFrame(raw, decoder) if lazy else decoder(raw)
+                message_type = frame.get('message_type')
+
+                if message_type == 'heartbeat' and skip_heartbeats:
+                    continue
+
+                if message_type == 'certificate_update' and (speed or start is not None or end is not None):
+                    seen = frame.sniff('seen') if lazy else frame['data'].get('seen')
+                    if seen is not None:
+                        if (start is not None and seen < start) or (end is not None and seen > end):
+                            continue
+                        if speed:
+                            if first_seen is None:
+                                first_seen, started = seen, time.time()
+                            delay = (seen - first_seen) / speed - (time.time() - started)
+                            if delay > 0:
+                                time.sleep(delay)
+
+                callback(frame, context)
+    finally:
+        _close_stages(stages)
+
+certstream_logger = logging.getLogger('certstream')
@@ -1,25 +1,264 @@
 import argparse
-import datetime
-import json
-import logging
 import sys
-import termcolor
-
-from signal import signal, SIGPIPE, SIG_DFL
+import threading
 
 import certstream
 
+# Everything else (websocket-client, termcolor, the JSON libraries...) is imported by the output mode which needs it,
+# so `certstream --version` and short lived runs don't pay for what they don't use.
+
 parser = argparse.ArgumentParser(description='Connect to the CertStream and process CTL list updates.')
 
+parser.add_argument('--version', action='version', version='certstream {}'.format(certstream.__version__))
+parser.add_argument('--check', action='store_true', help='Check which dependencies are installed, without connecting.')
 parser.add_argument('--json', action='store_true', help='Output raw JSON to the console.')
 parser.add_argument('--full', action='store_true', help='Output all SAN addresses as well')
 parser.add_argument('--disable-colors', action='store_true', help='Disable colors when writing a human readable ')
 parser.add_argument('--verbose', action='store_true', default=False, dest='verbose', help='Display debug logging.')
 parser.add_argument('--url', default="wss://certstream.calidog.io", dest='url', help='Connect to a certstream server.')
+parser.add_argument('--raw', action='store_true', help='Output each message exactly as received, one per line, without decoding it.')
+parser.add_argument('--fields', default=None, help='Output only these comma separated fields as JSON (e.g. all_domains,seen,source.url).')
+parser.add_argument('--output', '-o', default=None, help='Write to a file instead of the console, compressed if it ends in .gz or .zst.')
+parser.add_argument('--tui', action='store_true', help='Browse the stream in a full screen terminal viewer (needs urwid).')
+parser.add_argument('--tui-size', type=int, default=1000, help='Certificates the terminal viewer keeps for scrolling back.')
+parser.add_argument('--tui-fps', type=float, default=10, help='Maximum redraws per second of the terminal viewer.')
+parser.add_argument('--flush-interval', type=float, default=None, help='Seconds between flushes of the output buffer, 0 flushes every message (the default on a terminal, 0.5 otherwise).')
+
+class BufferedOutput(object):
+    """
+    Large write buffer in front of a binary stream, flushed every `flush_interval` seconds from a background thread
+    (or after every write with an interval of 0) instead of once or twice per message.
+    """
+    def __init__(self, stream, flush_interval=0.5, buffer_size=1024 * 1024):
+        self.stream = stream
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+        if flush_interval > 0:
+            thread = threading.Thread(target=self._flush_periodically, name="certstream-output")
+            thread.daemon = True
+            thread.start()
+
+    def write(self, data):
+        with self.lock:
+            self.buffer.append(data)
+            self.buffered += len(data)
+            if self.buffered >= self.buffer_size or self.flush_interval <= 0:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.closed.set()
+        self.flush()
+        if self.stream is not _stdout():
+            self.stream.close()
+
+    def _flush(self):
+        if self.buffer:
+            self.stream.write(b"".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        self.stream.flush()
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+def _stdout():
+    return getattr(sys.stdout, 'buffer', sys.stdout)
+
+def open_output(args):
+    path = args.output
+    if not path or path == '-':
+        stream = _stdout()
+    elif path.endswith('.gz'):
+        import gzip
+        stream = gzip.open(path, 'ab')
+    elif path.endswith('.zst'):
+        import zstandard
+        stream = zstandard.ZstdCompressor().stream_writer(open(path, 'ab'))
+    else:
+        stream = open(path, 'ab')
+    return BufferedOutput(stream, flush_interval=0.5 if args.flush_interval is None else args.flush_interval)
+
+def _json_encoder():
+    """
+    Returns a function encoding a value as a line of JSON, with orjson if it's installed.
+    """
+    try:
+        import orjson
+    except ImportError:
+        import json
+        return lambda value: (json.dumps(value) + "\n").encode('utf-8')
+    return lambda value: orjson.dumps(value) + b"\n"
+
+def _ansi(color, attrs=None):
+    """
+    Returns the (start, end) escape sequences termcolor would wrap text in, so they can be baked into templates.
+    """
+    import termcolor
+    start, _, end = termcolor.colored("\0", color, attrs=attrs).partition("\0")
+    return start, end
+
+class HumanFormatter(object):
+    """
+    Renders certificate updates as the human readable console lines. Colors are baked into templates once, and the
+    timestamp is only formatted once per second, so a line costs a handful of string operations.
+    """
+    def __init__(self, full=False, colors=True):
+        import datetime
+
+        self.full = full
+        self._fromtimestamp = datetime.datetime.fromtimestamp
+
+        if colors:
+            seen, url, cn, bracket, domain = (
+                _ansi('cyan', ["bold"]), _ansi('blue', ["bold"]), _ansi('green', ["bold"]), _ansi('blue'), _ansi('white', ["bold"]),
+            )
+        else:
+            seen = url = cn = bracket = domain = ("", "")
+
+        self.template = "{}[{{}}]{} {}{{}}{} - {}{{}}{} {{}}\n".format(seen[0], seen[1], url[0], url[1], cn[0], cn[1])
+        self.domains_start = bracket[0] + "[" + bracket[1] + domain[0]
+        self.domains_separator = domain[1] + bracket[0] + ", " + bracket[1] + domain[0]
+        self.domains_end = domain[1] + bracket[0] + "]" + bracket[1]
+        # No domain colors between the brackets when there's no domain, like the termcolor calls this replaces
+        self.domains_empty = bracket[0] + "[" + bracket[1] + bracket[0] + "]" + bracket[1]
+
+        self._second = None
+        self._second_text = None
+
+    def timestamp(self, seen):
+        second = int(seen)
+        if second != self._second:
+            self._second = second
+            self._second_text = self._fromtimestamp(second).isoformat()
+
+        microseconds = int(round((seen - second) * 1000000))
+        if microseconds == 0:
+            return self._second_text
+        if microseconds >= 1000000:
+            return self._fromtimestamp(seen).isoformat()
+        return "{}.{:06d}".format(self._second_text, microseconds)
+
+    def render(self, message):
+        data = message['data']
+        leaf_cert = data['leaf_cert']
+
+        if self.full:
+            all_domains = leaf_cert['all_domains']
+            if all_domains:
+                domains = self.domains_start + self.domains_separator.join(all_domains) + self.domains_end
+            else:
+                domains = self.domains_empty
+        else:
+            domains = ""
+
+        return self.template.format(self.timestamp(data['seen']), data['source']['url'], leaf_cert['subject']['CN'], domains)
+
+    def render_batch(self, messages):
+        return "".join([self.render(message) for message in messages])
+
+def get_message_handler(args, output=None):
+    output = output or open_output(args)
+    write = output.write
+
+    if args.raw:
+        def _handle_raw(message, context):
+            # Lazy frames, so the raw text goes straight through without ever being decoded
+            raw = message.raw
+            write(raw.encode('utf-8') if isinstance(raw, str) else raw)
+            write(b"\n")
+        return _handle_raw
+
+    if args.fields:
+        from certstream.records import Projection
+
+        projection = Projection(args.fields)
+        dumps = _json_encoder()
+
+        def _handle_fields(message, context):
+            record = projection(message)
+            if record is not None:
+                write(dumps(dict(zip(projection.fields, record))))
+        return _handle_fields
+
+    if args.json:
+        dumps = _json_encoder()
+
+        def _handle_json(message, context):
+            write(dumps(message))
+        return _handle_json
+
+    formatter = HumanFormatter(full=args.full, colors=not args.disable_colors)
+
+    def _handle_messages(message, context):
+        write(formatter.render(message).encode('utf-8'))
+
+    return _handle_messages
+
+def get_batch_handler(args, output):
+    """
+    Batch callback for the human readable output, rendering a whole batch into a single write.
+    """
+    formatter = HumanFormatter(full=args.full, colors=not args.disable_colors)
+
+    def _handle_batch(messages, context):
+        output.write(formatter.render_batch(messages).encode('utf-8'))
+
+    return _handle_batch
+
+# (module, what it's for, required)
+DEPENDENCIES = [
+    ('websocket', 'websocket-client, connecting to the stream', True),
+    ('termcolor', 'termcolor, colored output', True),
+    ('orjson', 'orjson, fast decoding and JSON output (certstream[fast])', False),
+    ('simdjson', 'pysimdjson, fast decoding', False),
+    ('ahocorasick', 'pyahocorasick, fast substring matching', False),
+    ('tldextract', 'tldextract, public suffix list for registered domains', False),
+    ('cryptography', 'cryptography, parsing certificates (certstream[x509])', False),
+    ('websockets', 'websockets, asyncio client (certstream[aio])', False),
+    ('urwid', 'urwid, the terminal viewer (certstream[tui])', False),
+    ('zstandard', 'zstandard, .zst output', False),
+]
+
+def check(stream=None):
+    """
+    Reports which dependencies are installed, without importing any of them. Returns 1 if a required one is missing.
+    """
+    import importlib.util
+
+    stream = stream or sys.stdout
+    status = 0
+    stream.write("certstream {} on Python {}\n".format(certstream.__version__, sys.version.split()[0]))
+    for module, description, required in DEPENDENCIES:
+        installed = importlib.util.find_spec(module) is not None
+        if required and not installed:
+            status = 1
+        stream.write("{:<13} {:<9} {}\n".format(module, 'ok' if installed else ('MISSING' if required else '-'), description))
+    return status
 
 def main():
     args = parser.parse_args()
 
+    if args.check:
+        sys.exit(check())
+
+    if args.tui:
+        from certstream.tui import run
+        run(args.url, size=args.tui_size, fps=args.tui_fps)
+        return
+
+    import logging
+    from signal import signal, SIGPIPE, SIG_DFL
+
     # Ignore broken pipes
     signal(SIGPIPE, SIG_DFL)
 
@@ -29,39 +268,19 @@ def main():
 
     logging.basicConfig(format='[%(levelname)s:%(name)s] %(asctime)s - %(message)s', level=log_level)
 
-    def _handle_messages(message, context):
-        if args.json:
-            sys.stdout.flush()
-            sys.stdout.write(json.dumps(message) + "\n")
-            sys.stdout.flush()
+    # On a terminal every certificate is shown as it arrives, batching and buffering are for pipes and files
+    interactive = (not args.output or args.output == '-') and sys.stdout.isatty()
+    if args.flush_interval is None:
+        args.flush_interval = 0 if interactive else 0.5
+
+    output = open_output(args)
+    try:
+        if args.raw or args.json or args.fields or interactive:
+            certstream.listen_for_events(get_message_handler(args, output), args.url, skip_heartbeats=True, lazy=args.raw)
         else:
-            if args.disable_colors:
-                logging.debug("Starting normal output.")
-                payload = "{} {} - {} {}\n".format(
-                    "[{}]".format(datetime.datetime.fromtimestamp(message['data']['seen']).isoformat()),
-                    message['data']['source']['url'],
-                    message['data']['leaf_cert']['subject']['CN'],
-                    "[{}]".format(", ".join(message['data']['leaf_cert']['all_domains'])) if args.full else ""
-                )
-
-                sys.stdout.write(payload)
-            else:
-                logging.debug("Starting colored output.")
-                payload = "{} {} - {} {}\n".format(
-                    termcolor.colored("[{}]".format(datetime.datetime.fromtimestamp(message['data']['seen']).isoformat()), 'cyan', attrs=["bold", ]),
-                    termcolor.colored(message['data']['source']['url'], 'blue', attrs=["bold",]),
-                    termcolor.colored(message['data']['leaf_cert']['subject']['CN'], 'green', attrs=["bold",]),
-                    termcolor.colored("[", 'blue') + "{}".format(
-                        termcolor.colored(", ", 'blue').join(
-                            [termcolor.colored(x, 'white', attrs=["bold",]) for x in message['data']['leaf_cert']['all_domains']]
-                        )
-                    ) + termcolor.colored("]", 'blue') if args.full else "",
-                )
-                sys.stdout.write(payload)
-
-            sys.stdout.flush()
-
-    certstream.listen_for_events(_handle_messages, args.url, skip_heartbeats=True)
+            certstream.listen_for_events(None, args.url, skip_heartbeats=True, batch_callback=get_batch_handler(args, output), batch_interval=0.1)
+    finally:
+        output.close()
 
 if __name__ == "__main__":
     main()
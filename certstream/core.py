@@ -1,11 +1,22 @@
 from __future__ import print_function
 
-import json
+import copy
 import logging
-
+import socket
+import threading
 import time
 from websocket import WebSocketApp
 
+try:
+    from urllib.parse import urlsplit, urlunsplit
+except ImportError:
+    from urlparse import urlsplit, urlunsplit
+
+from .backoff import Backoff
+from .batch import Batcher
+from .decode import get_decoder, LazyFrame
+from .records import Projection
+
 class Context(dict):
     """dot.notation access to dictionary attributes"""
     __getattr__ = dict.get
@@ -13,13 +24,39 @@ class Context(dict):
     __delattr__ = dict.__delitem__
 
 class CertStreamClient(WebSocketApp):
-    _context = Context()
+    """
+    Connection to a certstream server. Besides the callbacks, it takes the connection's tuning options, which are
+    applied whenever `run_forever` is called:
 
-    def __init__(self, message_callback, url, skip_heartbeats=True, on_open=None, on_error=None):
+    - `ping_interval`: seconds between keepalive pings (15 by default, 0 to disable them).
+    - `receive_buffer`: size in bytes of the socket's receive buffer (SO_RCVBUF), so bursts queue up in the kernel
+      rather than stall the server while a callback runs. The OS default when None.
+    - `raw_bytes`: frames are handed to the decoder as the bytes received (the default), instead of being decoded to
+      str after websocket-client validates their UTF-8 in pure Python, which costs more than the JSON parsing
+      itself. Every decoder validates UTF-8 as it parses anyway, and lazy frames keep the bytes as their `raw`.
+    """
+    def __init__(self, message_callback, url, skip_heartbeats=True, on_open=None, on_error=None, decoder=None, lazy=False,
+                 positions=None, on_state_change=None, metrics=None, ping_interval=15, receive_buffer=None, raw_bytes=True, context=None, gaps=None):
         self.message_callback = message_callback
         self.skip_heartbeats = skip_heartbeats
+        self.decoder = get_decoder(decoder)
+        self.lazy = lazy
         self.on_open_handler = on_open
         self.on_error_handler = on_error
+        self.on_state_change = on_state_change
+        self.metrics = metrics
+        self.connected_at = None
+        self.ping_interval = ping_interval
+        self.receive_buffer = receive_buffer
+        self.raw_bytes = raw_bytes
+        # listen_for_events passes the Context its reconnects share, a client on its own gets a fresh one
+        self._context = Context() if context is None else context
+        # Last cert_index seen per CT log url, shared across reconnects so gaps can be spotted and backfilled
+        self.positions = {} if positions is None else positions
+        # A certstream.gaps.SequenceTracker, which then keeps the positions
+        self.gaps = gaps
+        if gaps is not None:
+            self.positions = gaps.positions
         super(CertStreamClient, self).__init__(
             url=url,
             on_open=self._on_open,
@@ -27,34 +64,356 @@ class CertStreamClient(WebSocketApp):
             on_error=self._on_error,
         )
 
+    def run_forever(self, **kwargs):
+        kwargs.setdefault('ping_interval', self.ping_interval)
+        kwargs.setdefault('skip_utf8_validation', self.raw_bytes)
+        if self.receive_buffer:
+            kwargs['sockopt'] = list(kwargs.get('sockopt') or ()) + [(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)]
+        return super(CertStreamClient, self).run_forever(**kwargs)
+
     def _on_open(self, _):
         certstream_logger.info("Connection established to CertStream! Listening for events...")
+        self.connected_at = time.time()
+        if self.metrics is not None:
+            self.metrics.inc('connects')
+        self.notify_state('connected')
         if self.on_open_handler:
             self.on_open_handler()
 
     def _on_message(self, _, message):
-        frame = json.loads(message)
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+
+        if self.lazy:
+            frame = LazyFrame(message, self.decoder)
+        else:
+            frame = self.decoder(message)
+
+        message_type = frame.get('message_type', None)
+
+        if metrics is not None:
+            decoded = time.perf_counter()
+            metrics.observe('decode', decoded - started)
+            metrics.inc('frames')
+            metrics.inc('bytes', len(message))
+            if message_type == "heartbeat":
+                metrics.inc('heartbeats')
 
-        if frame.get('message_type', None) == "heartbeat" and self.skip_heartbeats:
+        if message_type == "heartbeat" and self.skip_heartbeats:
             return
 
+        if message_type == "certificate_update":
+            if self.lazy:
+                # Sniffed from the raw frame, which keeps frames which get filtered out from being decoded here
+                url, index = frame.sniff('source_url'), frame.sniff('cert_index')
+            else:
+                data = frame['data']
+                url, index = data['source']['url'], data['cert_index']
+            if self.gaps is None:
+                self.positions[url] = index
+            elif not self.gaps.observe(url, index):
+                # Already delivered - by another connection, before a reconnect, or by the backfill
+                return
+
         self.message_callback(frame, self._context)
 
+        if metrics is not None:
+            metrics.observe('dispatch', time.perf_counter() - decoded)
+
+    def notify_state(self, state):
+        """
+        Calls the on_state_change handler with `state` ('connecting', 'connected' or 'disconnected') and this client.
+        """
+        if self.on_state_change:
+            try:
+                self.on_state_change(state, self)
+            except Exception as ex:
+                certstream_logger.exception("Error in on_state_change handler - {}".format(ex))
+
+    @property
+    def uptime(self):
+        return time.time() - self.connected_at if self.connected_at else 0.0
+
     def _on_error(self, _, ex):
         if type(ex) == KeyboardInterrupt:
             raise
+        if self.metrics is not None:
+            self.metrics.inc('errors')
         if self.on_error_handler:
             self.on_error_handler(ex)
         certstream_logger.error("Error connecting to CertStream - {} - Sleeping for a few seconds and trying again...".format(ex))
 
-def listen_for_events(message_callback, url, skip_heartbeats=True, setup_logger=True, on_open=None, on_error=None, **kwargs):
+# Options of listen_for_events which are handled by _build_pipeline rather than the connection
+PIPELINE_OPTIONS = ('batch_callback', 'batch_size', 'batch_interval', 'queue_size', 'workers', 'worker_type', 'overflow', 'matcher', 'fields', 'novelty', 'enrich', 'filter', 'sink')
+
+def _build_pipeline(message_callback, batch_callback=None, batch_size=500, batch_interval=1.0,
+                    queue_size=None, workers=4, worker_type='thread', overflow='block', matcher=None, fields=None, novelty=None, enrich=None, filter=None, sink=None, dedup=None,
+                    metrics=None, context=None):
+    """
+    Wraps the user's callback(s) into the single callback handed to CertStreamClient. Returns it along with the
+    stages which need to be flushed on disconnect and closed on shutdown, outermost first.
+    """
+    stages = []
+    process_workers = queue_size is not None and worker_type == 'process'
+
+    # Callbacks which are stages themselves (a Batcher or Dispatcher built by the caller) get managed as well
+    if hasattr(message_callback, 'flush') and hasattr(message_callback, 'close'):
+        stages.append(message_callback)
+
+    # Sinks get everything the callback gets, and are closed last so they see whatever the queue/batcher flush out
+    parent_sinks = None
+    if sink is not None:
+        sinks = list(sink) if isinstance(sink, (list, tuple)) else [sink]
+        stages.extend(sinks)
+        if batch_callback is not None:
+            batch_callback = _with_sinks(batch_callback, [s.write_batch for s in sinks])
+        elif process_workers:
+            # Process workers are forked without the sinks' writer threads, so the sinks are fed on this side of the queue
+            parent_sinks = sinks
+        else:
+            message_callback = _with_sinks(message_callback, sinks)
+
+    if metrics is not None:
+        if batch_callback is not None:
+            batch_callback = _delivered(batch_callback, metrics, 'batch_callback')
+        elif message_callback is not None and not process_workers:
+            message_callback = _delivered(message_callback, metrics, 'callback')
+
+    if batch_callback is not None:
+        if message_callback is not None:
+            raise ValueError("Pass either a message_callback or a batch_callback, not both")
+        message_callback = Batcher(batch_callback, batch_size=batch_size, batch_interval=batch_interval)
+        stages.append(message_callback)
+    elif message_callback is None and parent_sinks is None:
+        raise ValueError("A message_callback or batch_callback is required")
+
+    if queue_size is not None and message_callback is not None:
+        if worker_type == 'process' and batch_callback is not None:
+            raise ValueError("Batching isn't supported with process workers, batch inside your message_callback instead")
+        from .dispatch import Dispatcher
+        message_callback = Dispatcher(message_callback, queue_size=queue_size, workers=workers, worker_type=worker_type, overflow=overflow, context=context)
+        stages.append(message_callback)
+        if metrics is not None:
+            dispatcher = message_callback
+            metrics.add_gauge('queue_depth', lambda: len(dispatcher.queue))
+            metrics.add_gauge('queue_dropped', lambda: dispatcher.dropped)
+            if process_workers:
+                # Only the callback itself is sent to the workers, whose metrics would never make it back, so frames
+                # count as delivered once they're queued and 'queue' times the hand over
+                message_callback = _delivered(message_callback, metrics, 'queue')
+
+    if parent_sinks is not None:
+        message_callback = _with_sinks(message_callback, parent_sinks)
+
+    if fields is not None:
+        message_callback = _projected(Projection(fields), message_callback, metrics)
+
+    # Inside the filters, so only frames which get through are parsed
+    if enrich is not None:
+        if enrich is True:
+            # Imported here so cryptography is only loaded by those who use it
+            from .enrich import Enricher
+            enrich = Enricher()
+        message_callback = _projected(enrich, message_callback, metrics, 'enrich')
+
+    # Inside the matcher, so only matching domains are remembered
+    if novelty is not None:
+        message_callback = _filtered(novelty, message_callback, metrics, 'novelty')
+        if hasattr(novelty, 'flush') and hasattr(novelty, 'close'):
+            stages.append(novelty)
+
+    if matcher is not None:
+        message_callback = _filtered(matcher, message_callback, metrics, 'match')
+
+    if dedup is not None:
+        message_callback = _filtered(dedup, message_callback, metrics, 'dedup')
+
+    # Outermost, it's the cheapest way to throw a frame away
+    if filter is not None:
+        from .filters import compile_filter
+        message_callback = _filtered(compile_filter(filter), message_callback, metrics, 'filter')
+
+    return message_callback, stages[::-1]
+
+def _with_sinks(callback, sinks):
+    def _callback(frame, context):
+        if callback is not None:
+            callback(frame, context)
+        for sink in sinks:
+            sink(frame, context)
+    return _callback
+
+def _filtered(predicate, message_callback, metrics=None, stage='filter'):
+    if metrics is not None:
+        predicate = metrics.timed(stage, predicate)
+
+    def _callback(frame, context):
+        if predicate(frame):
+            message_callback(frame, context)
+        elif metrics is not None:
+            metrics.inc('filtered')
+    return _callback
+
+def _projected(projection, message_callback, metrics=None, stage='projection'):
+    if metrics is not None:
+        projection = metrics.timed(stage, projection)
+
+    def _callback(frame, context):
+        record = projection(frame)
+        if record is not None:
+            message_callback(record, context)
+    return _callback
+
+def _delivered(callback, metrics, stage):
+    callback = metrics.timed(stage, callback)
+
+    def _callback(frames, context):
+        metrics.inc('delivered', len(frames) if stage == 'batch_callback' else 1)
+        callback(frames, context)
+    return _callback
+
+def _context_stages(context):
+    # Contexts which persist themselves (certstream.state.SQLiteContext) are checkpointed on disconnect and closed on
+    # shutdown like a stage. Looked up on the type, as Context answers None for any attribute
+    if context is not None and callable(getattr(type(context), 'flush', None)) and callable(getattr(type(context), 'close', None)):
+        return [context]
+    return []
+
+def _flush_stages(stages):
+    for stage in stages:
+        try:
+            stage.flush()
+        except Exception as ex:
+            certstream_logger.exception("Error flushing {} - {}".format(type(stage).__name__, ex))
+
+def _close_stages(stages):
+    for stage in stages:
+        try:
+            stage.close()
+        except Exception as ex:
+            certstream_logger.exception("Error closing {} - {}".format(type(stage).__name__, ex))
+
+def _attach_gaps(gaps, callback, stages, positions=None, context=None, lazy=False, metrics=None):
+    """
+    Sets up gap tracking (a certstream.gaps.SequenceTracker, or True for one without backfill) in front of the
+    pipeline. Returns the tracker and the callback for the connections, and puts the tracker first in `stages`, so
+    its backfill stops before the rest of the pipeline is flushed. Its totals are reported as gauges in `metrics`.
+    """
+    if gaps is None:
+        return None, callback
+    if gaps is True:
+        from .gaps import SequenceTracker
+        gaps = SequenceTracker(positions=positions)
+
+    callback = gaps.attach(callback, context if context is not None else Context(), lazy=lazy)
+    stages.insert(0, gaps)
+    if metrics is not None:
+        tracker = gaps
+        metrics.add_gauge('gaps', lambda: tracker.gaps)
+        metrics.add_gauge('gaps_missed', lambda: tracker.missed)
+        metrics.add_gauge('gaps_recovered', lambda: tracker.recovered)
+        metrics.add_gauge('gaps_outstanding', lambda: tracker.outstanding)
+        metrics.add_gauge('duplicates', lambda: tracker.duplicates)
+    return gaps, callback
+
+def _domains_only_url(url):
+    """
+    The domains-only endpoint of the server at `url`, keeping any query string (relay filters) as it is.
+    """
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=parts.path.rstrip('/') + '/domains-only'))
+
+def _run_forever(callback, url, stages, stop_event=None, on_client=None, skip_heartbeats=True, on_open=None, on_error=None, decoder=None, lazy=False,
+                 backoff=None, positions=None, on_state_change=None, metrics=None, ping_interval=15, receive_buffer=None, raw_bytes=True, context=None, gaps=None,
+                 **kwargs):
+    """
+    Connects to `url` and reconnects whenever the connection drops, until `stop_event` is set (or forever without one),
+    which also closes the current connection. `on_client` is called with every new CertStreamClient so the caller can
+    close it from another thread.
+    """
+    # Copied so connections sharing a Backoff passed in by the caller each keep their own attempt count
+    backoff = copy.copy(Backoff.from_value(backoff))
+    positions = {} if positions is None else positions
+    reconnecting = False
+
+    current = [None]
+    done = threading.Event()
+    if stop_event is not None:
+        def _close_on_stop():
+            # Polled, so the thread goes away with the loop even if the event is never set. Closing again until the loop
+            # ends covers a client which was only starting to connect
+            while not done.wait(0.2):
+                if stop_event.is_set() and current[0] is not None:
+                    current[0].close()
+
+        watcher = threading.Thread(target=_close_on_stop, name="certstream-stop")
+        watcher.daemon = True
+        watcher.start()
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            c = current[0] = CertStreamClient(
+                callback, url, skip_heartbeats=skip_heartbeats, on_open=on_open, on_error=on_error, decoder=decoder, lazy=lazy,
+                positions=positions, on_state_change=on_state_change, metrics=metrics,
+                ping_interval=ping_interval, receive_buffer=receive_buffer, raw_bytes=raw_bytes, context=context, gaps=gaps,
+            )
+            if on_client:
+                on_client(c)
+            if stop_event is not None and stop_event.is_set():
+                break
+
+            if metrics is not None and reconnecting:
+                metrics.inc('reconnects')
+            reconnecting = True
+
+            c.notify_state('connecting')
+            c.run_forever(**kwargs)
+            _flush_stages(stages)
+            c.notify_state('disconnected')
+            if stop_event is not None and stop_event.is_set():
+                break
+
+            delay = backoff.next_delay(c.uptime)
+            certstream_logger.info("Reconnecting in {:.1f} seconds...".format(delay))
+            if stop_event is None:
+                time.sleep(delay)
+            else:
+                stop_event.wait(delay)
+    finally:
+        done.set()
+
+def listen_for_events(message_callback, url, skip_heartbeats=True, setup_logger=True, on_open=None, on_error=None, decoder=None, lazy=False,
+                      batch_callback=None, batch_size=500, batch_interval=1.0, queue_size=None, workers=4, worker_type='thread', overflow='block', matcher=None, fields=None, novelty=None, enrich=None,
+                      filter=None, sink=None, domains_only=False, backoff=None, positions=None, on_state_change=None, stop_event=None, metrics=None, ping_interval=15,
+                      receive_buffer=None, raw_bytes=True, context=None, gaps=None, **kwargs):
+    # A fresh one for every call, kept across its reconnects
+    if context is None:
+        context = Context()
+
+    callback, stages = _build_pipeline(
+        message_callback,
+        batch_callback=batch_callback, batch_size=batch_size, batch_interval=batch_interval,
+        queue_size=queue_size, workers=workers, worker_type=worker_type, overflow=overflow,
+        matcher=matcher, fields=fields, novelty=novelty, enrich=enrich, filter=filter, sink=sink, metrics=metrics,
+        context=context,
+    )
+    stages.extend(_context_stages(context))
+    gaps, callback = _attach_gaps(gaps, callback, stages, positions, context, lazy, metrics)
+
+    if domains_only:
+        url = _domains_only_url(url)
+
     try:
-        while True:
-            c = CertStreamClient(message_callback, url, skip_heartbeats=skip_heartbeats, on_open=on_open, on_error=on_error)
-            c.run_forever(ping_interval=15, **kwargs)
-            time.sleep(5)
+        _run_forever(
+            callback, url, stages, skip_heartbeats=skip_heartbeats, on_open=on_open, on_error=on_error, decoder=decoder, lazy=lazy,
+            backoff=backoff, positions=positions, on_state_change=on_state_change, stop_event=stop_event, metrics=metrics,
+            ping_interval=ping_interval, receive_buffer=receive_buffer, raw_bytes=raw_bytes, context=context, gaps=gaps, **kwargs
+        )
     except KeyboardInterrupt:
         certstream_logger.info("Kill command received, exiting!!")
+    finally:
+        _close_stages(stages)
 
 certstream_logger = logging.getLogger('certstream')
 certstream_logger.setLevel(logging.INFO)
@@ -0,0 +1,191 @@
+import importlib
+import json
+import re
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+DECODERS = {
+    'json': json.loads,
+}
+
+# Optional decoders, in order of preference. They're only imported when a decoder is first picked.
+OPTIONAL_DECODERS = ('orjson', 'simdjson')
+
+_missing = set()
+_default = None
+
+def _load_decoder(name):
+    if name not in DECODERS and name in OPTIONAL_DECODERS and name not in _missing:
+        try:
+            DECODERS[name] = importlib.import_module(name).loads
+        except ImportError:
+            _missing.add(name)
+    return DECODERS.get(name)
+
+def get_decoder(decoder=None):
+    """
+    Returns a callable turning a raw frame (str or bytes) into a dict. `decoder` can be a callable, the name of one
+    of the DECODERS, or None to pick the fastest one installed (orjson, then simdjson, then the stdlib).
+    """
+    global _default
+
+    if callable(decoder):
+        return decoder
+
+    if decoder is None:
+        if _default is None:
+            loads = DECODERS['json']
+            for name in OPTIONAL_DECODERS:
+                if _load_decoder(name) is not None:
+                    loads = DECODERS[name]
+                    break
+            _default = loads
+        return _default
+
+    loads = _load_decoder(decoder)
+    if loads is None:
+        available = [name for name in ('json',) + OPTIONAL_DECODERS if _load_decoder(name) is not None]
+        raise ValueError("Unknown decoder '{}', available decoders are {}".format(decoder, available))
+    return loads
+
+_MESSAGE_TYPE_RE = re.compile(r'"message_type"\s*:\s*"([^"]*)"')
+_MESSAGE_TYPE_RE_BYTES = re.compile(br'"message_type"\s*:\s*"([^"]*)"')
+
+def sniff_message_type(raw):
+    """
+    Pulls `message_type` out of a raw frame without decoding it. The server may put the key before or after `data`,
+    so we look for the last occurrence, which is always the top level one.
+    """
+    if isinstance(raw, str):
+        index = raw.rfind('"message_type"')
+        match = _MESSAGE_TYPE_RE.match(raw, index) if index != -1 else None
+        return match.group(1) if match else None
+
+    raw = bytes(raw)
+    index = raw.rfind(b'"message_type"')
+    match = _MESSAGE_TYPE_RE_BYTES.match(raw, index) if index != -1 else None
+    return match.group(1).decode('utf-8') if match else None
+
+_JSON_STRING = br'"([^"\\]*(?:\\.[^"\\]*)*)"'
+_CERT_INDEX_RE = re.compile(br'"cert_index"\s*:\s*(\d+)')
+# The source object holds nothing but strings, so the first url after it opens is its own
+_SOURCE_URL_RE = re.compile(br'"source"\s*:\s*\{[^{}]*?"url"\s*:\s*' + _JSON_STRING)
+_FIRST_DOMAIN_RE = re.compile(br'"all_domains"\s*:\s*\[\s*(?:' + _JSON_STRING + br'|\])')
+_FINGERPRINT_RE = re.compile(br'"fingerprint"\s*:\s*' + _JSON_STRING)
+_SEEN_RE = re.compile(br'"seen"\s*:\s*(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)')
+
+def _json_string(value):
+    if b'\\' in value:
+        return json.loads(b'"' + value + b'"')
+    return value.decode('utf-8')
+
+def _sniff(raw, key, pattern, start=0, last=False):
+    # Finding the key is a plain substring search, much faster than having the regex scan a few kB for it
+    index = raw.rfind(key) if last else raw.find(key, start)
+    return pattern.match(raw, index) if index != -1 else None
+
+def sniff_field(raw, field):
+    """
+    Pulls one of the SNIFFED_FIELDS out of a raw certificate update without decoding it, returning None when it isn't
+    there or the frame is laid out differently, so the caller can decode it instead.
+    """
+    if not isinstance(raw, bytes):
+        raw = raw.encode('utf-8') if isinstance(raw, str) else bytes(raw)
+
+    # cert_index, seen and source come after the certificates, the way the servers send them
+    if field == 'cert_index':
+        match = _sniff(raw, b'"cert_index"', _CERT_INDEX_RE, last=True)
+        return int(match.group(1)) if match else None
+
+    if field == 'source_url':
+        match = _sniff(raw, b'"source"', _SOURCE_URL_RE, last=True)
+        return _json_string(match.group(1)) if match else None
+
+    if field == 'domain':
+        # Only the leaf certificate has all_domains
+        match = _sniff(raw, b'"all_domains"', _FIRST_DOMAIN_RE)
+        if match is None:
+            return None
+        return _json_string(match.group(1)) if match.group(1) is not None else ''
+
+    if field == 'fingerprint':
+        # The chain's certificates have fingerprints as well, the leaf's is the first one inside leaf_cert
+        start = raw.find(b'"leaf_cert"')
+        match = _sniff(raw, b'"fingerprint"', _FINGERPRINT_RE, start) if start != -1 else None
+        return _json_string(match.group(1)) if match else None
+
+    if field == 'seen':
+        match = _sniff(raw, b'"seen"', _SEEN_RE, last=True)
+        return float(match.group(1)) if match else None
+
+    raise ValueError("Unknown field '{}', the fields which can be sniffed are {}".format(field, sorted(SNIFFED_FIELDS)))
+
+# Where sniff_field's fields are in a decoded frame
+SNIFFED_FIELDS = {
+    'cert_index': lambda frame: frame['data'].get('cert_index'),
+    'source_url': lambda frame: frame['data']['source']['url'],
+    'domain': lambda frame: (frame['data']['leaf_cert']['all_domains'] or [''])[0],
+    'fingerprint': lambda frame: frame['data']['leaf_cert'].get('fingerprint') or '',
+    'seen': lambda frame: frame['data'].get('seen'),
+}
+
+class LazyFrame(Mapping):
+    """
+    Read-only mapping over a raw frame. `message_type` is sniffed from the raw text, and the frame is only decoded
+    the first time anything else is read from it, so frames which get dropped are never parsed at all.
+    """
+    __slots__ = ('raw', 'message_type', '_decoder', '_frame')
+
+    def __init__(self, raw, decoder=None):
+        self.raw = raw
+        self.message_type = sniff_message_type(raw)
+        self._decoder = get_decoder(decoder)
+        self._frame = None
+
+    @property
+    def decoded(self):
+        return self._frame is not None
+
+    def sniff(self, field):
+        """
+        Returns one of the SNIFFED_FIELDS of a certificate update, pulled from the raw frame unless it was already
+        decoded, or if it can't be found there.
+        """
+        if self._frame is None:
+            value = sniff_field(self.raw, field)
+            if value is not None:
+                return value
+        return SNIFFED_FIELDS[field](self.to_dict())
+
+    def to_dict(self):
+        if self._frame is None:
+            self._frame = self._decoder(self.raw)
+        return self._frame
+
+    def get(self, key, default=None):
+        if key == 'message_type' and self.message_type is not None:
+            return self.message_type
+        return self.to_dict().get(key, default)
+
+    def __getitem__(self, key):
+        if key == 'message_type' and self.message_type is not None:
+            return self.message_type
+        return self.to_dict()[key]
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __reduce__(self):
+        # Pickle the raw frame rather than the decoded one, it's smaller and cheaper to send to worker processes
+        return LazyFrame, (self.raw, self._decoder)
+
+    def __repr__(self):
+        if self._frame is None:
+            return "<LazyFrame message_type={!r} ({} bytes, not decoded)>".format(self.message_type, len(self.raw))
+        return "<LazyFrame {!r}>".format(self._frame)
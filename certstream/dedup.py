@@ -0,0 +1,111 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+class SeenSet(object):
+    """
+    Thread safe set of recently seen keys, bounded both in size and in age. `add` returns True the first time a key
+    is seen within `ttl` seconds, and the oldest keys are evicted once there are more than `max_size` of them.
+    With `refresh`, seeing a key again restarts its `ttl`, so it's only forgotten after `ttl` seconds of silence.
+    """
+    def __init__(self, max_size=100000, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.keys = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, key, now=None, refresh=False):
+        now = time.time() if now is None else now
+
+        with self.lock:
+            self._evict(now)
+
+            if key in self.keys:
+                if refresh:
+                    self.keys[key] = now + self.ttl
+                    self.keys.move_to_end(key)
+                return False
+
+            self.keys[key] = now + self.ttl
+            if len(self.keys) > self.max_size:
+                self.keys.popitem(last=False)
+            return True
+
+    def __contains__(self, key):
+        with self.lock:
+            expires = self.keys.get(key)
+            return expires is not None and expires > time.time()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def items(self):
+        """
+        Returns (key, expires) pairs, oldest first.
+        """
+        with self.lock:
+            return list(self.keys.items())
+
+    def update(self, items, now=None):
+        """
+        Adds (key, expires) pairs as returned by `items`, skipping any which have already expired.
+        """
+        now = time.time() if now is None else now
+
+        with self.lock:
+            merged = dict(self.keys)
+            for key, expires in items:
+                if expires > max(now, merged.get(key, 0)):
+                    merged[key] = expires
+
+            # Rebuilt in expiry order, which _evict relies on
+            self.keys = OrderedDict(sorted(merged.items(), key=lambda item: item[1]))
+            while len(self.keys) > self.max_size:
+                self.keys.popitem(last=False)
+
+    def _evict(self, now):
+        # Keys are inserted in expiry order, so expired ones are always at the front
+        keys = self.keys
+        while keys:
+            key, expires = next(iter(keys.items()))
+            if expires > now:
+                break
+            del keys[key]
+
+def fingerprint_key(frame):
+    leaf_cert = frame['data']['leaf_cert']
+    fingerprint = leaf_cert.get('fingerprint')
+    if fingerprint is None:
+        return index_key(frame)
+    return fingerprint
+
+def index_key(frame):
+    data = frame['data']
+    return data['source']['url'], data['cert_index']
+
+DEDUP_KEYS = {
+    'fingerprint': fingerprint_key,
+    'index': index_key,
+}
+
+class Deduplicator(object):
+    """
+    Filter passing on the first copy of each certificate update seen within `ttl` seconds. `key` is 'fingerprint'
+    (the leaf certificate's fingerprint), 'index' (the log url and cert_index) or a callable taking the frame.
+    Other messages are passed through untouched.
+    """
+    def __init__(self, key='fingerprint', max_size=100000, ttl=600):
+        self.key = DEDUP_KEYS[key] if not callable(key) else key
+        self.seen = SeenSet(max_size=max_size, ttl=ttl)
+        self.duplicates = 0
+
+    def __call__(self, frame):
+        if frame.get('message_type') != 'certificate_update':
+            return True
+
+        if self.seen.add(self.key(frame)):
+            return True
+
+        self.duplicates += 1
+        return False
@@ -0,0 +1,195 @@
+import logging
+import multiprocessing
+import pickle
+import threading
+
+from collections import deque
+
+OVERFLOW_POLICIES = ('block', 'drop-oldest', 'drop-newest')
+
+class Dispatcher(object):
+    """
+    Puts frames on a bounded queue which is drained by a pool of `workers` threads (or processes, with
+    `worker_type='process'`) calling `message_callback(frame, context)`, so a slow callback never stalls the socket.
+
+    When the queue is full `overflow` decides what happens - 'block' waits for room (pushing back on the socket),
+    'drop-oldest' discards the oldest queued frame and 'drop-newest' discards the incoming one.
+
+    Process workers each get their own Context unless a (picklable) `context` such as a SharedContext is passed,
+    and the frames need to be picklable. Only `message_callback` itself is sent to the workers - anything wrapped
+    around it stays in this process - and unless processes are forked it has to be picklable too, i.e. a module
+    level function rather than a lambda or closure.
+    """
+    def __init__(self, message_callback, queue_size=10000, workers=4, worker_type='thread', overflow='block', context=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(", ".join(OVERFLOW_POLICIES)))
+        if worker_type not in ('thread', 'process'):
+            raise ValueError("worker_type must be either 'thread' or 'process'")
+        if queue_size < 1 or workers < 1:
+            raise ValueError("queue_size and workers must be at least 1")
+
+        self.message_callback = message_callback
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.worker_type = worker_type
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.context = None
+
+        self.enqueued = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.max_depth = 0
+        # Frames handled (or handed over to the processes), and evicted by 'drop-oldest'
+        self.settled = 0
+
+        self.processes = []
+        self.threads = []
+
+        if worker_type == 'process':
+            _check_picklable(message_callback)
+            self.handoff = multiprocessing.Queue(maxsize=workers * 2)
+            for i in range(workers):
+                process = multiprocessing.Process(target=_process_worker, args=(message_callback, self.handoff, context), name="certstream-worker-{}".format(i))
+                process.daemon = True
+                process.start()
+                self.processes.append(process)
+            self._start_thread(self._feed_processes, "certstream-feeder")
+        else:
+            for i in range(workers):
+                self._start_thread(self._run_callbacks, "certstream-worker-{}".format(i))
+
+    def __call__(self, frame, context):
+        with self.condition:
+            if self.closed:
+                return
+
+            self.context = context
+
+            if len(self.queue) >= self.queue_size:
+                if self.overflow == 'drop-newest':
+                    self.dropped += 1
+                    return
+                elif self.overflow == 'drop-oldest':
+                    self.queue.popleft()
+                    self.dropped += 1
+                    self.settled += 1
+                else:
+                    while len(self.queue) >= self.queue_size and not self.closed:
+                        self.condition.wait()
+                    # close() wakes blocked producers too, their frames don't make it on the queue anymore
+                    if self.closed:
+                        self.dropped += 1
+                        return
+
+            self.queue.append(frame)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self.queue))
+            self.condition.notify_all()
+
+    def counters(self):
+        with self.condition:
+            return {
+                'depth': len(self.queue),
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'dispatched': self.dispatched,
+                'dropped': self.dropped,
+            }
+
+    def flush(self):
+        """
+        Waits for the workers to handle the frames queued so far, so the stages after it (a Batcher, sinks) flush
+        them on disconnect. Process workers only get them handed over, their callbacks may still be running.
+        """
+        with self.condition:
+            queued = self.enqueued
+            while self.settled < queued:
+                self.condition.wait()
+
+    def close(self):
+        """
+        Stops accepting frames, waits for the workers to drain the queue and shuts them down.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        for thread in self.threads:
+            thread.join()
+
+        if self.processes:
+            for _ in self.processes:
+                self.handoff.put(None)
+            for process in self.processes:
+                process.join()
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def _next(self):
+        with self.condition:
+            while not self.queue:
+                if self.closed:
+                    return None, None
+                self.condition.wait()
+
+            frame = self.queue.popleft()
+            self.dispatched += 1
+            self.condition.notify_all()
+            return frame, self.context
+
+    def _run_callbacks(self):
+        while True:
+            frame, context = self._next()
+            if frame is None:
+                return
+            try:
+                self.message_callback(frame, context)
+            except Exception as ex:
+                certstream_logger.exception("Error in message callback - {}".format(ex))
+            self._settle()
+
+    def _feed_processes(self):
+        while True:
+            frame, _ = self._next()
+            if frame is None:
+                return
+            self.handoff.put(frame)
+            self._settle()
+
+    def _settle(self):
+        with self.condition:
+            self.settled += 1
+            self.condition.notify_all()
+
+def _check_picklable(message_callback):
+    # Forked workers inherit the callback, spawned ones (the default on macOS and Windows) unpickle it, which fails
+    # in the child with a far less helpful error
+    get_start_method = getattr(multiprocessing, 'get_start_method', None)
+    if get_start_method is None or get_start_method() == 'fork':
+        return
+    try:
+        pickle.dumps(message_callback)
+    except Exception as ex:
+        raise ValueError("Process workers started with {!r} need a picklable message_callback, such as a module level function - {}".format(get_start_method(), ex))
+
+def _process_worker(message_callback, handoff, context=None):
+    from .core import Context
+
+    if context is None:
+        context = Context()
+    while True:
+        frame = handoff.get()
+        if frame is None:
+            return
+        try:
+            message_callback(frame, context)
+        except Exception as ex:
+            certstream_logger.exception("Error in message callback - {}".format(ex))
+
+certstream_logger = logging.getLogger('certstream')
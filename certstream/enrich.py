@@ -0,0 +1,112 @@
+import base64
+import logging
+import threading
+
+from collections import OrderedDict
+
+try:
+    from cryptography import x509
+except ImportError:
+    x509 = None
+
+def parse_der(as_der):
+    """
+    Parses a certificate's base64 `as_der` field into a `cryptography.x509.Certificate`.
+    """
+    return x509.load_der_x509_certificate(base64.b64decode(as_der))
+
+_MISSING = object()
+
+class CertificateCache(object):
+    """
+    Thread safe LRU cache of parsed certificates keyed by fingerprint, holding at most `max_size` of them.
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.certificates = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, parse, *args):
+        """
+        Returns the certificate cached under `key`, calling `parse(*args)` and caching the result when it's missing.
+        A None result (a certificate which failed to parse) is cached too, so it isn't parsed again.
+        """
+        with self.lock:
+            certificate = self.certificates.get(key, _MISSING)
+            if certificate is not _MISSING:
+                self.certificates.move_to_end(key)
+                self.hits += 1
+                return certificate
+            self.misses += 1
+
+        # Parsed outside the lock, two threads missing on the same key at once just both parse it
+        certificate = parse(*args)
+
+        with self.lock:
+            self.certificates[key] = certificate
+            if len(self.certificates) > self.max_size:
+                self.certificates.popitem(last=False)
+        return certificate
+
+    def __len__(self):
+        return len(self.certificates)
+
+class Enricher(object):
+    """
+    Parses the certificates in each certificate update into typed objects (`cryptography.x509.Certificate` by
+    default, or whatever `parser(as_der)` returns), stored under an 'x509' key next to the 'as_der' they came from -
+    `frame['data']['leaf_cert']['x509']`, and `['x509']` on every entry of `frame['data']['chain']`.
+
+    The same handful of intermediates and roots turn up in almost every chain, so chain certificates are cached by
+    fingerprint in a `CertificateCache` of `cache_size` and a repeated issuer costs a dictionary lookup. Leaf
+    certificates are mostly unique and are parsed every time unless `cache_leaf` is set. Certificates which fail to
+    parse get None, and other messages are passed through untouched.
+    """
+    def __init__(self, leaf=True, chain=True, cache_size=10000, cache_leaf=False, parser=None):
+        if parser is None:
+            if x509 is None:
+                raise ImportError("certstream.enrich requires the 'cryptography' package (pip install certstream[x509])")
+            parser = parse_der
+
+        self.leaf = leaf
+        self.chain = chain
+        self.cache_leaf = cache_leaf
+        self.parser = parser
+        self.cache = CertificateCache(max_size=cache_size)
+        self.errors = 0
+
+    def _parse(self, as_der):
+        try:
+            return self.parser(as_der)
+        except Exception as ex:
+            self.errors += 1
+            certstream_logger.debug("Couldn't parse certificate - {}".format(ex))
+            return None
+
+    def _cached(self, certificate):
+        as_der = certificate.get('as_der')
+        if as_der is None:
+            return None
+        return self.cache.get(certificate.get('fingerprint') or as_der, self._parse, as_der)
+
+    def __call__(self, frame):
+        if frame.get('message_type') != 'certificate_update':
+            return frame
+
+        data = frame['data']
+        if self.leaf:
+            leaf_cert = data['leaf_cert']
+            if self.cache_leaf:
+                leaf_cert['x509'] = self._cached(leaf_cert)
+            elif 'as_der' in leaf_cert:
+                leaf_cert['x509'] = self._parse(leaf_cert['as_der'])
+
+        if self.chain:
+            for certificate in data.get('chain') or ():
+                certificate['x509'] = self._cached(certificate)
+
+        return frame
+
+certstream_logger = logging.getLogger('certstream')
@@ -0,0 +1,153 @@
+import re
+
+from .match import Matcher
+
+class Operator(object):
+    """
+    A test on a single (string) value, used as a condition in `compile_filter`.
+    """
+    def __call__(self, value):
+        raise NotImplementedError()
+
+class suffix(Operator):
+    """
+    Values ending with any of `suffixes`, e.g. suffix('.bank', '.xyz').
+    """
+    def __init__(self, *suffixes):
+        self.suffixes = tuple(suffixes)
+
+    def __call__(self, value):
+        return isinstance(value, str) and value.endswith(self.suffixes)
+
+class prefix(Operator):
+    """
+    Values starting with any of `prefixes`.
+    """
+    def __init__(self, *prefixes):
+        self.prefixes = tuple(prefixes)
+
+    def __call__(self, value):
+        return isinstance(value, str) and value.startswith(self.prefixes)
+
+class contains(Operator):
+    """
+    Values containing any of `substrings`.
+    """
+    def __init__(self, *substrings):
+        self.substrings = tuple(substrings)
+
+    def __call__(self, value):
+        if not isinstance(value, str):
+            return False
+        for substring in self.substrings:
+            if substring in value:
+                return True
+        return False
+
+class regex(Operator):
+    """
+    Values matching any of `patterns` (searched, so anchor them yourself), compiled into a single alternation.
+    """
+    def __init__(self, *patterns, **kwargs):
+        self.regex = re.compile("|".join("(?:{})".format(pattern) for pattern in patterns), kwargs.get('flags', 0))
+
+    def __call__(self, value):
+        return isinstance(value, str) and self.regex.search(value) is not None
+
+class not_(Operator):
+    """
+    Inverts a condition, e.g. not_(suffix('.cloudflaressl.com')). On lists it holds when none of the values match.
+    """
+    def __init__(self, condition):
+        self.condition = _compile_condition(condition)
+
+    def __call__(self, value):
+        return not self.condition(value)
+
+def _compile_condition(condition):
+    if isinstance(condition, not_):
+        inverted = condition.condition
+        return lambda value: not inverted(value)
+
+    if isinstance(condition, Matcher):
+        def _matches(value):
+            if isinstance(value, str):
+                value = [value]
+            return bool(condition.match_domains(value, first=True))
+        return _matches
+
+    if isinstance(condition, Operator) or callable(condition):
+        test = condition
+    elif isinstance(condition, (list, tuple, set, frozenset)):
+        values = frozenset(condition)
+
+        def test(value):
+            try:
+                return value in values
+            except TypeError:
+                return False
+    else:
+        test = lambda value: value == condition
+
+    def _any(value):
+        # Conditions on lists (all_domains, chain...) hold if they hold for any of the values
+        if isinstance(value, list):
+            for item in value:
+                if test(item):
+                    return True
+            return False
+        return test(value)
+    return _any
+
+_MISSING = object()
+
+def _compile_path(path):
+    keys = [int(key) if key.isdigit() else key for key in path.split('.')]
+    if keys[0] not in ('message_type', 'data'):
+        keys = ['data'] + keys
+
+    if keys == ['message_type']:
+        # Lazy frames answer this one from the sniffed type, without decoding
+        return lambda frame: frame.get('message_type', _MISSING)
+
+    def _get(frame):
+        value = frame
+        for key in keys:
+            try:
+                value = value[key]
+            except (KeyError, IndexError, TypeError):
+                return _MISSING
+        return value
+    return _get
+
+def compile_filter(spec):
+    """
+    Compiles a declarative filter into a predicate taking a frame. `spec` maps paths to conditions, and a frame
+    passes when every condition holds:
+
+        {
+            "message_type": "certificate_update",
+            "source.url": ["ct.googleapis.com/logs/argon2024/", "ct.googleapis.com/logs/xenon2024/"],
+            "leaf_cert.all_domains": suffix(".bank"),
+        }
+
+    Paths are dotted keys (numbers index into lists, e.g. 'chain.0.subject.O'), looked up under `data` unless they start with 'message_type' or 'data'. A condition is a
+    value to compare against, a list/set of accepted values, an operator (`suffix`, `prefix`, `contains`, `regex`,
+    `not_`), a `certstream.match.Matcher`, or any callable taking the value. On list values such as
+    `leaf_cert.all_domains` a condition holds if it holds for any item. Frames missing a path don't pass.
+    A callable `spec` is returned as it is.
+    """
+    if callable(spec):
+        return spec
+
+    # message_type first, so lazy frames of the wrong type are rejected before they're decoded
+    paths = sorted(spec, key=lambda path: path != 'message_type')
+    checks = [(_compile_path(path), _compile_condition(spec[path])) for path in paths]
+
+    def _predicate(frame):
+        for get, test in checks:
+            value = get(frame)
+            if value is _MISSING or not test(value):
+                return False
+        return True
+    return _predicate
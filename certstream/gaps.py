@@ -0,0 +1,547 @@
+"""
+Gap detection and backfill. Every CT log numbers its entries, and certificate updates carry that number as
+`cert_index` along with the log's url, so a `SequenceTracker` following the indices of every log can tell which
+certificates never arrived - dropped while reconnecting, or by a server shedding a slow client - and a `Backfiller`
+can fetch them from the log itself and feed them through the pipeline:
+
+    certstream.listen_for_events(callback, url, gaps=SequenceTracker(backfill=Backfiller(workers=8)))
+"""
+import base64
+import bisect
+import calendar
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from collections import deque
+
+from .backoff import Backoff, RETRY_BACKOFF, retry
+from .httppool import HTTPConnectionPool
+
+class SequenceTracker(object):
+    """
+    Follows `cert_index` for every CT log, keeping the ranges which were skipped in `missing` (log url -> sorted list
+    of (start, end) ranges, both inclusive) until they turn up - late, or from the backfill. Each new gap is logged
+    and passed to `on_gap(url, start, end)`, and to the `backfill` (a `Backfiller`, or True for a default one).
+
+    `positions` is the last index seen per log (a dict you can persist and pass back in, so a restart picks up what
+    was missed while it was down). Frames which were already seen are reported as duplicates and dropped by the client,
+    which also makes the stream exactly once per log entry across reconnects, mirrors and the backfill. At most
+    `max_ranges` ranges are kept per log, the oldest being given up on beyond that.
+    """
+    def __init__(self, on_gap=None, backfill=None, positions=None, max_ranges=10000):
+        if backfill is True:
+            backfill = Backfiller()
+
+        self.on_gap = on_gap
+        self.backfill = backfill
+        self.positions = {} if positions is None else positions
+        self.max_ranges = max_ranges
+        self.missing = {}
+        self.lock = threading.Lock()
+        self.gaps = 0
+        self.missed = 0
+        self.recovered = 0
+        self.duplicates = 0
+        self.abandoned = 0
+
+    def observe(self, url, index):
+        """
+        Records `index` for the log at `url`, returning False if it was already seen.
+        """
+        with self.lock:
+            last = self.positions.get(url)
+            if last is None or index == last + 1:
+                self.positions[url] = index
+                return True
+
+            if index <= last:
+                if self._fill(url, index):
+                    return True
+                self.duplicates += 1
+                return False
+
+            start, end = last + 1, index - 1
+            self.positions[url] = index
+            self._add_range(url, start, end)
+
+        # Lossy feeds have gaps all the time, the totals are in `gaps`, `missed` and `recovered` (and in metrics)
+        certstream_logger.debug("Missed {} certificates from {} ({}-{})".format(end - start + 1, url, start, end))
+        # Outside the lock, the backfill calls back into fill()
+        if self.on_gap is not None:
+            try:
+                self.on_gap(url, start, end)
+            except Exception as ex:
+                certstream_logger.exception("Error in on_gap handler - {}".format(ex))
+        if self.backfill is not None:
+            self.backfill.submit(url, start, end)
+        return True
+
+    def fill(self, url, index):
+        """
+        Marks a missing index as received, returning False if it wasn't missing.
+        """
+        with self.lock:
+            return self._fill(url, index)
+
+    def is_missing(self, url, start, end):
+        """
+        Returns True if any index between `start` and `end` is still missing.
+        """
+        with self.lock:
+            ranges = self.missing.get(url)
+            if not ranges:
+                return False
+            i = bisect.bisect_right(ranges, (end, float('inf')))
+            return i > 0 and ranges[i - 1][1] >= start
+
+    @property
+    def outstanding(self):
+        """
+        Number of certificates still missing across all logs.
+        """
+        with self.lock:
+            return sum(end - start + 1 for ranges in self.missing.values() for start, end in ranges)
+
+    def _add_range(self, url, start, end):
+        ranges = self.missing.setdefault(url, [])
+        ranges.append((start, end))
+        self.gaps += 1
+        self.missed += end - start + 1
+        if len(ranges) > self.max_ranges:
+            start, end = ranges.pop(0)
+            self.abandoned += end - start + 1
+            certstream_logger.warning("Giving up on certificates {}-{} from {}, too many gaps".format(start, end, url))
+
+    def _fill(self, url, index):
+        ranges = self.missing.get(url)
+        if not ranges:
+            return False
+
+        i = bisect.bisect_right(ranges, (index, float('inf'))) - 1
+        if i < 0:
+            return False
+        start, end = ranges[i]
+        if index > end:
+            return False
+
+        replacement = []
+        if start < index:
+            replacement.append((start, index - 1))
+        if index < end:
+            replacement.append((index + 1, end))
+        ranges[i:i + 1] = replacement
+        if not ranges:
+            del self.missing[url]
+        self.recovered += 1
+        return True
+
+    def attach(self, callback, context, lazy=False):
+        """
+        Called by `listen_for_events` with the pipeline's callback, returns the callback the connections should use.
+        With a backfill, deliveries from the connections and the backfill are serialized, so the pipeline never sees
+        two frames at once.
+        """
+        if self.backfill is None:
+            return callback
+
+        lock = threading.Lock()
+
+        def _locked(frame, context):
+            with lock:
+                callback(frame, context)
+
+        self.backfill.start(self, _locked, context, lazy=lazy)
+        return _locked
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.backfill is not None:
+            self.backfill.close()
+        if self.missing:
+            certstream_logger.warning("{} certificates were never received".format(self.outstanding))
+
+def _read_length(data, offset):
+    length = data[offset]
+    offset += 1
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    return length, offset
+
+def _children(data, start, end):
+    """
+    Yields (tag, content start, content end) for every DER element between `start` and `end`.
+    """
+    while start < end:
+        tag = data[start]
+        length, content = _read_length(data, start + 1)
+        yield tag, content, content + length
+        start = content + length
+
+# Attribute type OIDs (DER encoded) of the name fields certstream frames carry
+_NAME_FIELDS = {
+    b'\x55\x04\x03': 'CN',
+    b'\x55\x04\x06': 'C',
+    b'\x55\x04\x07': 'L',
+    b'\x55\x04\x08': 'ST',
+    b'\x55\x04\x0a': 'O',
+    b'\x55\x04\x0b': 'OU',
+}
+
+_SUBJECT_ALT_NAME = b'\x55\x1d\x11'
+_BASIC_CONSTRAINTS = b'\x55\x1d\x13'
+
+def _string(data, tag, start, end):
+    if tag == 0x1e:
+        return data[start:end].decode('utf-16-be', 'replace')
+    return data[start:end].decode('utf-8', 'replace')
+
+def _name(data, start, end):
+    name = {'C': None, 'CN': None, 'L': None, 'O': None, 'OU': None, 'ST': None}
+    for _, set_start, set_end in _children(data, start, end):
+        for _, attribute_start, attribute_end in _children(data, set_start, set_end):
+            (_, oid_start, oid_end), (tag, value_start, value_end) = list(_children(data, attribute_start, attribute_end))[:2]
+            field = _NAME_FIELDS.get(bytes(data[oid_start:oid_end]))
+            if field is not None:
+                name[field] = _string(data, tag, value_start, value_end)
+    name['aggregated'] = "".join("/{}={}".format(field, name[field]) for field in sorted(_NAME_FIELDS.values()) if name[field])
+    return name
+
+def _time(data, tag, start, end):
+    text = data[start:end].decode('ascii').rstrip('Z')
+    if tag == 0x17:
+        # UTCTime has a two digit year, 50-99 being the 1900s
+        text = ('19' if int(text[:2]) >= 50 else '20') + text
+    return float(calendar.timegm(time.strptime(text[:14], '%Y%m%d%H%M%S')))
+
+def _extensions(data, start, end):
+    extensions, domains = {}, []
+    for _, extension_start, extension_end in _children(data, start, end):
+        fields = list(_children(data, extension_start, extension_end))
+        oid = bytes(data[fields[0][1]:fields[0][2]])
+        _, value_start, value_end = fields[-1]
+
+        if oid == _SUBJECT_ALT_NAME:
+            for _, names_start, names_end in _children(data, value_start, value_end):
+                for tag, name_start, name_end in _children(data, names_start, names_end):
+                    if tag == 0x82:
+                        domains.append(data[name_start:name_end].decode('ascii', 'replace'))
+            extensions['subjectAltName'] = ", ".join("DNS:" + domain for domain in domains)
+        elif oid == _BASIC_CONSTRAINTS:
+            is_ca = False
+            for _, sequence_start, sequence_end in _children(data, value_start, value_end):
+                for tag, field_start, field_end in _children(data, sequence_start, sequence_end):
+                    if tag == 0x01:
+                        is_ca = data[field_start:field_end] != b'\x00'
+            extensions['basicConstraints'] = "CA:TRUE" if is_ca else "CA:FALSE"
+    return extensions, domains
+
+def certificate_fields(der):
+    """
+    Describes a DER certificate the way certstream frames do (subject, issuer, validity, serial number, fingerprint,
+    SANs...). Only the handful of fields frames carry are read, with a minimal DER reader rather than a full X.509
+    parser, so backfill works without any extra dependency.
+    """
+    certificate = {
+        'fingerprint': ":".join("{:02X}".format(byte) for byte in hashlib.sha1(der).digest()),
+        'as_der': base64.b64encode(der).decode('ascii'),
+    }
+
+    data = bytes(der)
+    _, certificate_start, certificate_end = next(_children(data, 0, len(data)))
+    _, tbs_start, tbs_end = next(_children(data, certificate_start, certificate_end))
+    fields = list(_children(data, tbs_start, tbs_end))
+    if fields[0][0] == 0xa0:
+        # Explicit version
+        fields = fields[1:]
+
+    _, serial_start, serial_end = fields[0]
+    certificate['serial_number'] = "{:X}".format(int.from_bytes(data[serial_start:serial_end], 'big'))
+    certificate['issuer'] = _name(data, fields[2][1], fields[2][2])
+    (not_before_tag, not_before_start, not_before_end), (not_after_tag, not_after_start, not_after_end) = list(_children(data, fields[3][1], fields[3][2]))
+    certificate['not_before'] = _time(data, not_before_tag, not_before_start, not_before_end)
+    certificate['not_after'] = _time(data, not_after_tag, not_after_start, not_after_end)
+    certificate['subject'] = _name(data, fields[4][1], fields[4][2])
+
+    extensions, domains = {}, []
+    for tag, start, end in fields[6:]:
+        if tag == 0xa3:
+            _, sequence_start, sequence_end = next(_children(data, start, end))
+            extensions, domains = _extensions(data, sequence_start, sequence_end)
+    certificate['extensions'] = extensions
+
+    all_domains = []
+    common_name = certificate['subject']['CN']
+    for domain in ([common_name] if common_name else []) + domains:
+        if domain not in all_domains:
+            all_domains.append(domain)
+    certificate['all_domains'] = all_domains
+    return certificate
+
+def _u24(data, offset):
+    return int.from_bytes(data[offset:offset + 3], 'big')
+
+def _certificate_list(data, offset):
+    certificates = []
+    end = offset + 3 + _u24(data, offset)
+    offset += 3
+    while offset < end:
+        length = _u24(data, offset)
+        certificates.append(data[offset + 3:offset + 3 + length])
+        offset += 3 + length
+    return certificates
+
+def parse_entry(entry):
+    """
+    Parses a `get-entries` entry (a MerkleTreeLeaf and its extra data, RFC 6962) into (update type, leaf certificate
+    DER, [chain DERs], timestamp). For precertificates the leaf is the precertificate itself, as certstream does.
+    """
+    leaf = base64.b64decode(entry['leaf_input'])
+    extra = base64.b64decode(entry['extra_data'])
+
+    # version (1), leaf type (1), timestamp (8), entry type (2)
+    timestamp = int.from_bytes(leaf[2:10], 'big') / 1000.0
+    entry_type = int.from_bytes(leaf[10:12], 'big')
+
+    if entry_type == 0:
+        length = _u24(leaf, 12)
+        return 'X509LogEntry', leaf[15:15 + length], _certificate_list(extra, 0), timestamp
+    if entry_type == 1:
+        length = _u24(extra, 0)
+        return 'PrecertLogEntry', extra[3:3 + length], _certificate_list(extra, 3 + length), timestamp
+    raise ValueError("Unknown log entry type {}".format(entry_type))
+
+def entry_to_frame(source, index, entry, log_url):
+    """
+    Builds a certificate_update frame, shaped like the ones the server sends, for entry `index` of the log whose
+    `source` is {'url': ..., 'name': ...}. Backfilled frames are marked with `backfilled: True`.
+    """
+    update_type, leaf, chain, _ = parse_entry(entry)
+    chain_fields = []
+    for der in chain:
+        try:
+            certificate = certificate_fields(der)
+        except Exception:
+            certificate = {'as_der': base64.b64encode(der).decode('ascii')}
+        certificate.pop('all_domains', None)
+        chain_fields.append(certificate)
+
+    return {
+        'message_type': 'certificate_update',
+        'data': {
+            'update_type': update_type,
+            'leaf_cert': certificate_fields(leaf),
+            'chain': chain_fields,
+            'cert_index': index,
+            'cert_link': "{}ct/v1/get-entries?start={}&end={}".format(log_url, index, index),
+            'seen': time.time(),
+            'source': source,
+            'backfilled': True,
+        },
+    }
+
+class _LogQueue(object):
+    """
+    Backfill state of one log: the chunks in the order they have to be delivered, and those already fetched.
+    """
+    def __init__(self):
+        self.order = deque()
+        self.fetched = {}
+        self.lock = threading.Lock()
+
+class Backfiller(object):
+    """
+    Fetches missing certificates from the CT logs themselves, with `get-entries` requests of up to `batch_size`
+    entries from `workers` threads, over keep-alive connections pooled per log server. Gaps are only fetched after
+    `delay` seconds, so certificates which are merely late get a chance to arrive on their own first, and gaps of more
+    than `max_gap` certificates (a log being replaced, a client left off for weeks) are logged and not fetched.
+
+    Certificates are delivered in order for each log, marked with `backfilled: True`, and only if they're still
+    missing by then. Failed requests are retried `retries` times with `backoff` (a `certstream.backoff.Backoff`, or
+    a number of seconds), after which the certificates stay in the tracker's `missing`. On shutdown whatever is still
+    queued is fetched straight away, for up to `drain_timeout` seconds.
+
+    Logs are reached at https://<source url>/ unless `log_url(source)` says otherwise.
+    """
+    def __init__(self, workers=4, batch_size=256, delay=5.0, max_gap=1000000, retries=5, backoff=None, timeout=30, log_url=None,
+                 drain_timeout=60):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.delay = delay
+        self.max_gap = max_gap
+        self.retries = retries
+        self.backoff = Backoff.from_value(backoff if backoff is not None else RETRY_BACKOFF)
+        self.timeout = timeout
+        self.log_url = log_url or _https_url
+        self.drain_timeout = drain_timeout
+        self.tasks = deque()
+        self.active = 0
+        self.draining = False
+        self.logs = {}
+        self.pool = HTTPConnectionPool(timeout=timeout)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.threads = []
+        self.tracker = None
+        self.callback = None
+        self.context = None
+        self.lazy = False
+        self.requests = 0
+        self.fetched = 0
+        self.delivered = 0
+        self.skipped = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self, tracker, callback, context, lazy=False):
+        self.tracker, self.callback, self.context, self.lazy = tracker, callback, context, lazy
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name="certstream-backfill-{}".format(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, url, start, end):
+        """
+        Queues the certificates `start` to `end` of the log at `url` for fetching.
+        """
+        if end - start + 1 > self.max_gap:
+            certstream_logger.warning("Not backfilling {} certificates from {}, over max_gap".format(end - start + 1, url))
+            return
+
+        ready_at = time.time() + self.delay
+        with self.condition:
+            log = self.logs.get(url)
+            if log is None:
+                log = self.logs[url] = _LogQueue()
+            for chunk_start in range(start, end + 1, self.batch_size):
+                chunk = (url, chunk_start, min(chunk_start + self.batch_size - 1, end))
+                with log.lock:
+                    log.order.append(chunk)
+                self.tasks.append((ready_at, chunk))
+            self.condition.notify_all()
+
+    @property
+    def pending(self):
+        """
+        Number of chunks waiting to be fetched.
+        """
+        return len(self.tasks)
+
+    def _next_task(self):
+        with self.condition:
+            while not self.closed:
+                if self.tasks:
+                    wait = 0 if self.draining else self.tasks[0][0] - time.time()
+                    if wait <= 0:
+                        self.active += 1
+                        return self.tasks.popleft()[1]
+                else:
+                    wait = None
+                self.condition.wait(wait)
+            return None
+
+    def _work(self):
+        while True:
+            chunk = self._next_task()
+            if chunk is None:
+                return
+
+            url, start, end = chunk
+            frames = []
+            if self.tracker.is_missing(url, start, end):
+                try:
+                    frames = self._fetch_with_retries(url, start, end)
+                except Exception as ex:
+                    self.failed += end - start + 1
+                    certstream_logger.error("Couldn't backfill certificates {}-{} from {} - {}".format(start, end, url, ex))
+            self._deliver(chunk, frames)
+
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+    def _fetch_with_retries(self, url, start, end):
+        def _on_retry(ex, delay):
+            self.retried += 1
+            certstream_logger.info("Retrying certificates {}-{} from {} in {:.1f} seconds - {}".format(start, end, url, delay, ex))
+
+        return retry(lambda: self.fetch(url, start, end), self.retries, self.backoff, on_retry=_on_retry, give_up=lambda: self.closed)
+
+    def fetch(self, url, start, end):
+        """
+        Fetches and converts the certificates `start` to `end` of the log at `url`. Logs cap how many entries they
+        return at once, so it takes as many requests as needed.
+        """
+        source = {'url': url, 'name': url}
+        log_url = self.log_url(url)
+        frames = []
+        while start <= end:
+            entries = self._get_entries(log_url, start, end)
+            if not entries:
+                raise IOError("No entries returned")
+            for entry in entries:
+                frames.append(entry_to_frame(source, start, entry, log_url))
+                start += 1
+            self.fetched += len(entries)
+        return frames
+
+    def _get_entries(self, log_url, start, end):
+        url = "{}ct/v1/get-entries?start={}&end={}".format(log_url, start, end)
+        self.requests += 1
+        status, content = self.pool.get(url, headers={'Accept': 'application/json'})
+        if status != 200:
+            raise IOError("HTTP {} from {} - {}".format(status, url, content[:200]))
+        return json.loads(content.decode('utf-8'))['entries']
+
+    def _deliver(self, chunk, frames):
+        url = chunk[0]
+        log = self.logs[url]
+        with log.lock:
+            log.fetched[chunk] = frames
+            # Whoever completes the chunk at the head of the line delivers it and everything fetched behind it
+            while log.order and log.order[0] in log.fetched:
+                for frame in log.fetched.pop(log.order.popleft()):
+                    self._emit(url, frame)
+
+    def _emit(self, url, frame):
+        if not self.tracker.fill(url, frame['data']['cert_index']):
+            # Turned up on its own in the meantime
+            self.skipped += 1
+            return
+        if self.lazy:
+            from .decode import LazyFrame
+            frame = LazyFrame(json.dumps(frame).encode('utf-8'))
+        try:
+            self.callback(frame, self.context)
+            self.delivered += 1
+        except Exception as ex:
+            certstream_logger.exception("Error delivering backfilled certificate - {}".format(ex))
+
+    def close(self):
+        deadline = time.time() + self.drain_timeout
+        with self.condition:
+            self.draining = True
+            self.condition.notify_all()
+            while (self.tasks or self.active) and self.threads and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            self.closed = True
+            remaining = len(self.tasks)
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(self.timeout)
+        if remaining:
+            certstream_logger.warning("Stopped with {} backfill requests outstanding".format(remaining))
+        self.pool.close()
+
+def _https_url(source_url):
+    url = source_url if '://' in source_url else 'https://' + source_url
+    return url if url.endswith('/') else url + '/'
+
+certstream_logger = logging.getLogger('certstream')
@@ -0,0 +1,85 @@
+import threading
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlsplit
+except ImportError:
+    import httplib
+    from urlparse import urlsplit
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class HTTPConnectionPool(object):
+    """
+    Keep-alive HTTP(S) connections, pooled per server and shared by any number of threads. Used by the HTTP sink to
+    post batches and by the backfill to fetch entries from the CT logs. A connection is only put back once its
+    response was read in full, and dropped on any error.
+    """
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def _pool(self, scheme, netloc):
+        with self.lock:
+            pool = self.pools.get((scheme, netloc))
+            if pool is None:
+                pool = self.pools[(scheme, netloc)] = queue.LifoQueue()
+            return pool
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Sends a request to `url` over a pooled connection, returning the response's (status, body).
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError("Only http:// and https:// urls are supported, not {}".format(url))
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+        pool = self._pool(parts.scheme, parts.netloc)
+        try:
+            connection = pool.get_nowait()
+        except queue.Empty:
+            if parts.scheme == 'https':
+                connection = httplib.HTTPSConnection(parts.netloc, timeout=self.timeout)
+            else:
+                connection = httplib.HTTPConnection(parts.netloc, timeout=self.timeout)
+
+        self.requests += 1
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            # The body has to be read before the connection can be reused
+            content = response.read()
+        except Exception:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            pool.put(connection)
+        return response.status, content
+
+    def get(self, url, headers=None):
+        return self.request('GET', url, headers=headers)
+
+    def post(self, url, body, headers=None):
+        return self.request('POST', url, body=body, headers=headers)
+
+    def close(self):
+        """
+        Closes the idle connections. The pool can still be used afterwards.
+        """
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
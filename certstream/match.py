@@ -0,0 +1,283 @@
+import bisect
+import re
+
+from collections import deque, namedtuple
+
+# pyahocorasick and tldextract are optional, and only imported when first needed
+_UNLOADED = object()
+ahocorasick = _UNLOADED
+_tld_extract = _UNLOADED
+
+def _load_ahocorasick():
+    global ahocorasick
+    try:
+        import ahocorasick
+    except ImportError:
+        ahocorasick = None
+    return ahocorasick
+
+def _load_tld_extract():
+    global _tld_extract
+    try:
+        import tldextract
+        _tld_extract = tldextract.TLDExtract(suffix_list_urls=())
+    except ImportError:
+        _tld_extract = None
+    return _tld_extract
+
+# Used when tldextract isn't installed, covers the multi-label public suffixes that show up most in the stream
+_COMMON_PUBLIC_SUFFIXES = frozenset([
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk', 'ltd.uk', 'plc.uk', 'net.uk',
+    'com.au', 'net.au', 'org.au', 'edu.au', 'gov.au', 'co.nz', 'org.nz', 'net.nz',
+    'co.jp', 'ne.jp', 'or.jp', 'ac.jp', 'co.kr', 'or.kr', 'co.in', 'net.in', 'org.in',
+    'com.br', 'net.br', 'org.br', 'com.cn', 'net.cn', 'org.cn', 'com.tw', 'com.hk',
+    'com.mx', 'com.ar', 'com.tr', 'com.sg', 'com.my', 'com.ua', 'co.za', 'co.il',
+    'com.pl', 'com.ru', 'com.es', 'co.id', 'or.id', 'com.vn', 'com.co', 'com.pe',
+])
+
+def split_domain(domain):
+    """
+    Splits a domain into its subdomain, registrable name and public suffix, e.g. 'login.example.co.uk' becomes
+    ('login', 'example', 'co.uk'). Uses the public suffix list through tldextract when it's installed.
+    """
+    domain = normalize_domain(domain)
+
+    extract = _tld_extract if _tld_extract is not _UNLOADED else _load_tld_extract()
+    if extract is not None:
+        result = extract(domain)
+        return result.subdomain, result.domain, result.suffix
+
+    labels = domain.split('.')
+    if len(labels) < 2:
+        return '', domain, ''
+
+    suffix_labels = 2 if len(labels) > 2 and '.'.join(labels[-2:]) in _COMMON_PUBLIC_SUFFIXES else 1
+    return '.'.join(labels[:-suffix_labels - 1]), labels[-suffix_labels - 1], '.'.join(labels[-suffix_labels:])
+
+def registered_domain(domain):
+    """
+    Returns the registrable part of a domain, e.g. 'example.co.uk' for 'login.example.co.uk'.
+    """
+    _, name, suffix = split_domain(domain)
+    return "{}.{}".format(name, suffix) if suffix else name
+
+def normalize_domain(domain):
+    domain = domain.lower().rstrip('.')
+    if domain.startswith('*.'):
+        domain = domain[2:]
+    return domain
+
+Match = namedtuple('Match', ['domain', 'kind', 'pattern'])
+
+_DEFAULT_FLAGS = re.compile('').flags
+_UNCOMBINABLE_RE = re.compile(r'\\[AZ1-9]|\(\?P=|\(\?\(')
+
+def _combinable(regex):
+    """
+    Whether `regex` can go into the joined prefilter and still match wherever it matches a domain on its own: no flags
+    (they'd be lost, or apply to every pattern), no named groups (which can't repeat), no backreferences (the groups
+    get renumbered), and no \\A or \\Z (which MULTILINE doesn't make per domain).
+    """
+    return regex.flags == _DEFAULT_FLAGS and not regex.groupindex and not _UNCOMBINABLE_RE.search(regex.pattern)
+
+class _AhoCorasick(object):
+    """
+    Pure python Aho-Corasick automaton, only used when pyahocorasick isn't installed.
+    """
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+
+        for word in words:
+            state = 0
+            for char in word:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next_state
+            self.output[state] += (word,)
+
+        # Root's children fail back to the root, everything below is filled in breadth first
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def iter(self, text):
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for word in output[state]:
+                yield index, word
+
+class Matcher(object):
+    """
+    Compiles any number of watchlist patterns into a single index, and matches every domain in a frame against it
+    in one pass. Patterns can be
+
+        - exact domains ('paypal.com')
+        - suffixes, matched on label boundaries ('paypal.com' matches 'www.paypal.com', '.bank' matches 'a.b.bank')
+        - registrable names, matched against the domain less its public suffix ('paypal' matches 'paypal.co.uk')
+        - substrings, matched with Aho-Corasick ('paypal' matches 'paypal-login.example.com')
+        - regular expressions, matched per domain
+
+    Domains are lowercased and stripped of any wildcard before matching.
+    """
+    def __init__(self, exact=(), suffixes=(), registrable=(), substrings=(), regexes=()):
+        self.exact = set()
+        self.suffixes = set()
+        self.registrable = set()
+        self.substrings = set()
+        self.regexes = []
+        self._automaton = None
+        self._regex = None
+        self._unfiltered = []
+        self._compiled = False
+
+        self.add_exact(exact)
+        self.add_suffixes(suffixes)
+        self.add_registrable(registrable)
+        self.add_substrings(substrings)
+        self.add_regexes(regexes)
+
+    def add_exact(self, patterns):
+        self.exact.update(normalize_domain(p) for p in patterns)
+        self._compiled = False
+
+    def add_suffixes(self, patterns):
+        self.suffixes.update(normalize_domain(p).lstrip('.') for p in patterns)
+        self._compiled = False
+
+    def add_registrable(self, patterns):
+        self.registrable.update(p.lower() for p in patterns)
+        self._compiled = False
+
+    def add_substrings(self, patterns):
+        self.substrings.update(p.lower() for p in patterns if p)
+        self._compiled = False
+
+    def add_regexes(self, patterns):
+        self.regexes.extend(re.compile(p) if not hasattr(p, 'pattern') else p for p in patterns)
+        self._compiled = False
+
+    def __len__(self):
+        return len(self.exact) + len(self.suffixes) + len(self.registrable) + len(self.substrings) + len(self.regexes)
+
+    def compile(self):
+        if self.substrings:
+            module = ahocorasick if ahocorasick is not _UNLOADED else _load_ahocorasick()
+            if module is not None:
+                self._automaton = module.Automaton()
+                for word in self.substrings:
+                    self._automaton.add_word(word, word)
+                self._automaton.make_automaton()
+            else:
+                self._automaton = _AhoCorasick(self.substrings)
+        else:
+            self._automaton = None
+
+        # A single alternation rejects non-matching domains in one scan, MULTILINE keeps ^ and $ per domain. Patterns
+        # which can't be joined into it are always run on their own
+        combinable = [r for r in self.regexes if _combinable(r)]
+        self._unfiltered = [r for r in self.regexes if not _combinable(r)]
+        if combinable:
+            self._regex = re.compile("|".join("(?:{})".format(r.pattern) for r in combinable), re.MULTILINE)
+        else:
+            self._regex = None
+
+        self._compiled = True
+
+    def match_domains(self, domains, first=False):
+        """
+        Returns a list of Match(domain, kind, pattern) for every pattern hit by `domains`. With `first=True` it stops
+        at the first hit, which is all a pre-filter needs.
+        """
+        if not self._compiled:
+            self.compile()
+
+        domains = [normalize_domain(d) for d in domains]
+        matches = []
+
+        for domain in domains:
+            if domain in self.exact:
+                matches.append(Match(domain, 'exact', domain))
+                if first:
+                    return matches
+
+            if self.suffixes:
+                candidate = domain
+                while True:
+                    if candidate in self.suffixes:
+                        matches.append(Match(domain, 'suffix', candidate))
+                        if first:
+                            return matches
+                    index = candidate.find('.')
+                    if index == -1:
+                        break
+                    candidate = candidate[index + 1:]
+
+            if self.registrable:
+                name = split_domain(domain)[1]
+                if name in self.registrable:
+                    matches.append(Match(domain, 'registrable', name))
+                    if first:
+                        return matches
+
+        if self._automaton is None and not self.regexes:
+            return matches
+
+        # Substrings and regexes run over all the domains joined together, so it's a single scan per frame
+        text = "\n".join(domains)
+        offsets = []
+        position = 0
+        for domain in domains:
+            offsets.append(position)
+            position += len(domain) + 1
+
+        if self._automaton is not None:
+            for end, word in self._automaton.iter(text):
+                matches.append(Match(domains[bisect.bisect_right(offsets, end) - 1], 'substring', word))
+                if first:
+                    return matches
+
+        regexes = self.regexes if self._regex is None or self._regex.search(text) else self._unfiltered
+        if regexes:
+            for domain in domains:
+                for regex in regexes:
+                    if regex.search(domain):
+                        matches.append(Match(domain, 'regex', regex.pattern))
+                        if first:
+                            return matches
+
+        return matches
+
+    def match(self, domain):
+        return self.match_domains([domain])
+
+    def match_frame(self, frame, first=False):
+        if frame.get('message_type') != 'certificate_update':
+            return []
+        return self.match_domains(frame['data']['leaf_cert']['all_domains'], first=first)
+
+    def __call__(self, frame):
+        """
+        Pre-filter hook for `listen_for_events(matcher=...)`. Frames other than certificate updates are passed
+        through untouched.
+        """
+        if frame.get('message_type') != 'certificate_update':
+            return True
+        return bool(self.match_frame(frame, first=True))
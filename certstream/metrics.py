@@ -0,0 +1,193 @@
+import bisect
+import logging
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+# Upper bounds in seconds, from 10us to 10s
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+COUNTERS = ('frames', 'heartbeats', 'bytes', 'delivered', 'filtered', 'connects', 'reconnects', 'errors')
+
+class Histogram(object):
+    """
+    Fixed bucket latency histogram, cheap enough to observe on every frame.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in.
+        """
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+class Metrics(object):
+    """
+    Counters and per stage latency histograms for a listener. Pass an instance as `metrics` to `listen_for_events`
+    and it counts frames, heartbeats, bytes, deliveries, filtered frames, connects, reconnects and errors, and times
+    decoding plus every pipeline stage ('decode', 'filter', 'projection', 'callback'...).
+
+    Updates aren't locked - they're made from the receive thread, and a lost increment under contention is an
+    acceptable price for staying off the hot path. `add_hook(fn)` registers a profiling hook which is called with
+    `(stage, seconds)` for every timing.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = dict((name, 0) for name in COUNTERS)
+        self.histograms = {}
+        self.gauges = {}
+        self.hooks = []
+        self.started_at = time.time()
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        for hook in self.hooks:
+            hook(stage, seconds)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def add_gauge(self, name, getter):
+        """
+        Registers a value read at snapshot time, e.g. a queue depth.
+        """
+        self.gauges[name] = getter
+
+    def timed(self, stage, func):
+        """
+        Wraps `func` so every call is observed under `stage`.
+        """
+        def _timed(*args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.observe(stage, time.perf_counter() - start)
+        return _timed
+
+    def snapshot(self):
+        gauges = {}
+        for name, getter in list(self.gauges.items()):
+            try:
+                gauges[name] = getter()
+            except Exception as ex:
+                certstream_logger.debug("Error reading gauge {} - {}".format(name, ex))
+
+        return {
+            'uptime': time.time() - self.started_at,
+            'counters': dict(self.counters),
+            'gauges': gauges,
+            'latency': dict((stage, histogram.snapshot()) for stage, histogram in list(self.histograms.items())),
+        }
+
+    def render(self):
+        """
+        Renders everything in the Prometheus/OpenMetrics text format.
+        """
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append("# TYPE certstream_{} counter".format(name))
+            lines.append("certstream_{}_total {}".format(name, value))
+
+        for name, value in sorted(self.snapshot()['gauges'].items()):
+            lines.append("# TYPE certstream_{} gauge".format(name))
+            lines.append("certstream_{} {}".format(name, value))
+
+        if self.histograms:
+            lines.append("# TYPE certstream_stage_seconds histogram")
+        for stage, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append('certstream_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(stage, bound, cumulative))
+            lines.append('certstream_stage_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(stage, histogram.count))
+            lines.append('certstream_stage_seconds_sum{{stage="{}"}} {}'.format(stage, histogram.sum))
+            lines.append('certstream_stage_seconds_count{{stage="{}"}} {}'.format(stage, histogram.count))
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        """
+        Serves `render()` over HTTP from a background thread, for Prometheus to scrape. Returns the HTTPServer.
+        """
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), _Handler)
+        thread = threading.Thread(target=server.serve_forever, name="certstream-metrics")
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def report_every(self, interval, callback):
+        """
+        Calls `callback(snapshot)` every `interval` seconds from a background thread. Returns an Event which stops
+        the reports once set.
+        """
+        stop_event = threading.Event()
+
+        def _report():
+            while not stop_event.wait(interval):
+                try:
+                    callback(self.snapshot())
+                except Exception as ex:
+                    certstream_logger.exception("Error in metrics report callback - {}".format(ex))
+
+        thread = threading.Thread(target=_report, name="certstream-metrics-report")
+        thread.daemon = True
+        thread.start()
+        return stop_event
+
+certstream_logger = logging.getLogger('certstream')
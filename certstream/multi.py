@@ -0,0 +1,70 @@
+import logging
+import threading
+
+from .core import PIPELINE_OPTIONS, Context, _attach_gaps, _build_pipeline, _close_stages, _context_stages, _domains_only_url, _run_forever
+from .dedup import Deduplicator
+
+def listen_for_events_multi(message_callback, urls, dedup_key='fingerprint', dedup_size=100000, dedup_ttl=600, skip_heartbeats=True,
+                            setup_logger=True, on_open=None, on_error=None, decoder=None, lazy=False, domains_only=False, **kwargs):
+    """
+    Like `listen_for_events`, but keeps a connection open to every server in `urls` and merges them into a single
+    stream. Certificates seen on more than one connection are only delivered once, see `certstream.dedup.Deduplicator`
+    for `dedup_key`. Pipeline options (batching, queueing, matcher, fields...) are the same as `listen_for_events`,
+    anything else is passed to `run_forever`.
+    """
+    pipeline_options = dict((name, kwargs.pop(name)) for name in PIPELINE_OPTIONS if name in kwargs)
+    # One for the call, shared by every connection
+    if kwargs.get('context') is None:
+        kwargs['context'] = Context()
+    callback, stages = _build_pipeline(
+        message_callback,
+        dedup=Deduplicator(key=dedup_key, max_size=dedup_size, ttl=dedup_ttl),
+        metrics=kwargs.get('metrics'),
+        context=kwargs.get('context'),
+        **pipeline_options
+    )
+    stages.extend(_context_stages(kwargs.get('context')))
+    # One tracker for all the connections, so a certificate seen on any of them counts
+    kwargs['gaps'], callback = _attach_gaps(kwargs.get('gaps'), callback, stages, kwargs.get('positions'), kwargs.get('context'), lazy, kwargs.get('metrics'))
+
+    # Shared by every connection, so setting the caller's event stops them all
+    stop_event = kwargs.pop('stop_event', None) or threading.Event()
+    if domains_only:
+        urls = [_domains_only_url(url) for url in urls]
+    clients = {}
+
+    def _track_client(url):
+        def _on_client(client):
+            clients[url] = client
+        return _on_client
+
+    threads = []
+    for url in urls:
+        thread = threading.Thread(
+            target=_run_forever,
+            args=(callback, url, stages),
+            kwargs=dict(
+                stop_event=stop_event, on_client=_track_client(url), skip_heartbeats=skip_heartbeats,
+                on_open=on_open, on_error=on_error, decoder=decoder, lazy=lazy, **kwargs
+            ),
+            name="certstream-{}".format(url),
+        )
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(1)
+    except KeyboardInterrupt:
+        certstream_logger.info("Kill command received, exiting!!")
+    finally:
+        stop_event.set()
+        for client in list(clients.values()):
+            client.close()
+        for thread in threads:
+            thread.join(5)
+        _close_stages(stages)
+
+certstream_logger = logging.getLogger('certstream')
@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import math
+import os
+import pickle
+import struct
+import threading
+import time
+
+from .dedup import SeenSet, fingerprint_key
+from .match import normalize_domain, registered_domain
+
+def _domains(frame):
+    seen = set()
+    domains = []
+    for domain in frame['data']['leaf_cert']['all_domains']:
+        domain = normalize_domain(domain)
+        if domain not in seen:
+            seen.add(domain)
+            domains.append(domain)
+    return domains
+
+def _registered_domains(frame):
+    seen = set()
+    domains = []
+    for domain in _domains(frame):
+        domain = registered_domain(domain)
+        if domain not in seen:
+            seen.add(domain)
+            domains.append(domain)
+    return domains
+
+# Each returns the list of keys a certificate update is tracked under
+NOVELTY_KEYS = {
+    'domain': _domains,
+    'registered_domain': _registered_domains,
+    'fingerprint': lambda frame: [fingerprint_key(frame)],
+}
+
+class RotatingBloomFilter(object):
+    """
+    Time sliced Bloom filter remembering keys for at least `window` seconds in a fixed `memory` budget (bytes).
+    Memory is split over `slices` filters; new keys go into the newest one and the oldest is cleared every
+    `window / (slices - 1)` seconds. It never forgets a key early, but answers "seen" for about `error_rate` of
+    keys it hasn't seen. A slice which fills up past its capacity is rotated early rather than let the error rate
+    climb, which shortens the window instead.
+    """
+    def __init__(self, memory=16 * 1024 * 1024, window=86400, error_rate=0.001, slices=4):
+        if slices < 2:
+            raise ValueError("A rotating Bloom filter needs at least two slices")
+
+        self.window = window
+        self.error_rate = error_rate
+        self.slice_count = slices
+        self.slice_bytes = max(1, memory // slices)
+        self.bits = self.slice_bytes * 8
+        self.hashes = max(1, int(math.ceil(-math.log(error_rate, 2))))
+        # Items a slice holds at `error_rate` with the optimal number of hashes
+        self.capacity = max(1, int(self.bits * (math.log(2) ** 2) / -math.log(error_rate)))
+        self.rotate_every = float(window) / (slices - 1)
+        self.early_rotations = 0
+        self.lock = threading.Lock()
+        self._reset(time.time())
+
+    def _reset(self, now):
+        self.slices = [bytearray(self.slice_bytes) for _ in range(self.slice_count)]
+        self.counts = [0] * self.slice_count
+        self.current = 0
+        self.rotated_at = now
+
+    def _positions(self, key):
+        if not isinstance(key, bytes):
+            key = repr(key).encode('utf-8') if not isinstance(key, str) else key.encode('utf-8')
+        first, second = struct.unpack('<QQ', hashlib.blake2b(key, digest_size=16).digest())
+        bits = self.bits
+        return [(first + i * second) % bits for i in range(self.hashes)]
+
+    @staticmethod
+    def _test(bits, positions):
+        for position in positions:
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def _rotate(self, now):
+        while now - self.rotated_at >= self.rotate_every:
+            self._advance()
+            self.rotated_at += self.rotate_every
+            # Idle for longer than the whole window, everything is forgotten anyway
+            if now - self.rotated_at >= self.window:
+                self._reset(now)
+                return
+
+    def _advance(self):
+        self.current = (self.current + 1) % self.slice_count
+        self.slices[self.current] = bytearray(self.slice_bytes)
+        self.counts[self.current] = 0
+
+    def add(self, key, now=None, refresh=True):
+        """
+        Returns True if `key` wasn't seen within the window. Keys seen again are copied into the newest slice (unless
+        `refresh` is False) so they're remembered for another full window.
+        """
+        now = time.time() if now is None else now
+        positions = self._positions(key)
+
+        with self.lock:
+            self._rotate(now)
+
+            current = self.slices[self.current]
+            if self._test(current, positions):
+                return False
+
+            seen = any(self._test(bits, positions) for bits in self.slices if bits is not current)
+            if seen and not refresh:
+                return False
+
+            if self.counts[self.current] >= self.capacity:
+                self._advance()
+                self.rotated_at = now
+                self.early_rotations += 1
+                certstream_logger.warning("Novelty filter slice is full after {} keys, rotating early - raise the memory budget to keep the full window".format(self.capacity))
+                current = self.slices[self.current]
+
+            for position in positions:
+                current[position >> 3] |= 1 << (position & 7)
+            self.counts[self.current] += 1
+            return not seen
+
+    def __contains__(self, key):
+        positions = self._positions(key)
+        with self.lock:
+            return any(self._test(bits, positions) for bits in self.slices)
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def state(self):
+        with self.lock:
+            return {
+                'slices': [bytes(bits) for bits in self.slices],
+                'counts': list(self.counts),
+                'current': self.current,
+                'rotated_at': self.rotated_at,
+                'slice_bytes': self.slice_bytes,
+                'hashes': self.hashes,
+            }
+
+    def restore(self, state, now=None):
+        if state['slice_bytes'] != self.slice_bytes or state['hashes'] != self.hashes or len(state['slices']) != self.slice_count:
+            raise ValueError("Saved Bloom filter was built with a different memory budget, error rate or slice count")
+
+        with self.lock:
+            self.slices = [bytearray(bits) for bits in state['slices']]
+            self.counts = list(state['counts'])
+            self.current = state['current']
+            self.rotated_at = state['rotated_at']
+            self._rotate(time.time() if now is None else now)
+
+class NoveltyFilter(object):
+    """
+    Filter passing on certificate updates with something new in them - a domain (`key='domain'`, the default), a
+    registered domain ('registered_domain'), a certificate ('fingerprint') or whatever keys a callable taking the
+    frame returns - which hasn't been seen for `window` seconds. Renewals and the same certificate turning up in
+    several logs are dropped. Every key is remembered for `window` seconds after it was *last* seen.
+
+    With `mode='lru'` keys are held exactly, up to `max_size` of them (the least recently seen are evicted first).
+    With `mode='bloom'` they go into a `RotatingBloomFilter` of `memory` bytes, which holds far more keys in the
+    same space at the cost of dropping about `error_rate` of the new ones.
+
+    Pass a `path` and the keys are loaded from it on start and saved to it on close (and every `save_interval`
+    seconds from a background thread if set), so a restart doesn't flood downstream with "new" domains. Other
+    messages are passed through.
+    """
+    def __init__(self, key='domain', window=86400, mode='lru', max_size=1000000, memory=16 * 1024 * 1024, error_rate=0.001,
+                 path=None, save_interval=None):
+        if mode not in ('lru', 'bloom'):
+            raise ValueError("Unknown novelty mode '{}', expected 'lru' or 'bloom'".format(mode))
+
+        self.keys = NOVELTY_KEYS[key] if not callable(key) else key
+        self.window = window
+        self.mode = mode
+        self.path = path
+        self.save_interval = save_interval
+        self.repeats = 0
+
+        if mode == 'lru':
+            self.seen = SeenSet(max_size=max_size, ttl=window)
+        else:
+            self.seen = RotatingBloomFilter(memory=memory, window=window, error_rate=error_rate)
+
+        self.saved_at = time.time()
+        self.save_lock = threading.Lock()
+        self._stopped = threading.Event()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+        if save_interval and path is not None:
+            thread = threading.Thread(target=self._save_every, args=(save_interval,), name="certstream-novelty-save")
+            thread.daemon = True
+            thread.start()
+
+    def new_keys(self, frame, now=None):
+        """
+        Records the frame's keys, returning those which are new.
+        """
+        now = time.time() if now is None else now
+        add = self.seen.add
+        return [key for key in self.keys(frame) if add(key, now, refresh=True)]
+
+    def __call__(self, frame):
+        if frame.get('message_type') != 'certificate_update':
+            return True
+
+        if self.new_keys(frame):
+            return True
+
+        self.repeats += 1
+        return False
+
+    def save(self, path=None):
+        """
+        Writes the remembered keys to `path`, replacing it atomically.
+        """
+        path = path or self.path
+        # The snapshot is taken under the key store's own lock, so the receive thread can keep adding to it
+        if self.mode == 'lru':
+            state = {'mode': 'lru', 'items': self.seen.items()}
+        else:
+            state = {'mode': 'bloom', 'bloom': self.seen.state()}
+
+        with self.save_lock:
+            temporary = "{}.tmp".format(path)
+            with open(temporary, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+            self.saved_at = time.time()
+
+    def _save_every(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.save()
+            except Exception as ex:
+                certstream_logger.exception("Error saving novelty state to {} - {}".format(self.path, ex))
+
+    def load(self, path=None):
+        path = path or self.path
+        try:
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+            if state['mode'] != self.mode:
+                raise ValueError("saved in '{}' mode".format(state['mode']))
+            if self.mode == 'lru':
+                self.seen.update(state['items'])
+            else:
+                self.seen.restore(state['bloom'])
+        except Exception as ex:
+            certstream_logger.warning("Couldn't load novelty state from {}, starting empty - {}".format(path, ex))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self.path is not None:
+            self.save()
+
+certstream_logger = logging.getLogger('certstream')
@@ -0,0 +1,68 @@
+from collections import namedtuple
+
+# Short names for the fields people ask for the most, anything else is a dotted path under `data`
+FIELD_ALIASES = {
+    'all_domains': 'leaf_cert.all_domains',
+    'fingerprint': 'leaf_cert.fingerprint',
+    'serial_number': 'leaf_cert.serial_number',
+    'not_before': 'leaf_cert.not_before',
+    'not_after': 'leaf_cert.not_after',
+    'subject': 'leaf_cert.subject.aggregated',
+    'issuer': 'leaf_cert.issuer.aggregated',
+}
+
+_record_types = {}
+
+def record_type(names):
+    """
+    Returns the (cached) namedtuple class used for records with the given field names.
+    """
+    names = tuple(names)
+    if names not in _record_types:
+        cls = namedtuple('CertRecord', names)
+        cls.__reduce__ = lambda self: (_make_record, (self._fields, tuple(self)))
+        _record_types[names] = cls
+    return _record_types[names]
+
+def _make_record(names, values):
+    return record_type(names)(*values)
+
+class Projection(object):
+    """
+    Turns frames into compact namedtuple records holding only the requested `fields`, e.g.
+
+        Projection(['all_domains', 'seen', 'cert_index', 'source.url', 'fingerprint'])
+
+    produces records with `all_domains`, `seen`, `cert_index`, `source_url` and `fingerprint` attributes. Fields are
+    either one of the FIELD_ALIASES or a dotted path under the frame's `data`, and missing values come out as None.
+
+    Only certificate updates (and the `dns_entries` frames sent by the domains-only endpoint, which only fill in
+    `all_domains`) are projected, everything else is dropped.
+    """
+    def __init__(self, fields):
+        if isinstance(fields, str):
+            fields = [f.strip() for f in fields.split(',') if f.strip()]
+        if not fields:
+            raise ValueError("At least one field is required")
+
+        self.fields = list(fields)
+        self.paths = [tuple(FIELD_ALIASES.get(f, f).split('.')) for f in self.fields]
+        self.record = record_type(f.replace('.', '_') for f in self.fields)
+
+    def __call__(self, frame):
+        message_type = frame.get('message_type')
+
+        if message_type == 'certificate_update':
+            data = frame['data']
+            return self.record(*[_lookup(data, path) for path in self.paths])
+        elif message_type == 'dns_entries':
+            return self.record(*[frame['data'] if path == ('leaf_cert', 'all_domains') else None for path in self.paths])
+
+        return None
+
+def _lookup(data, path):
+    for key in path:
+        if data is None:
+            return None
+        data = data.get(key)
+    return data
@@ -0,0 +1,213 @@
+"""
+Local fan-out server. Holds a single connection to an upstream certstream server and re-broadcasts its frames to any
+number of local websocket subscribers, so a site needs one upstream connection rather than one per service:
+
+    certstream-relay --url wss://certstream.calidog.io/ --port 4000
+
+Subscribers connect to ws://<host>:4000/ for the full stream or ws://<host>:4000/domains-only for just the domains,
+and can narrow either down with query string filters, e.g. /?suffix=.bank&suffix=.xyz&log=ct.googleapis.com/logs/argon2024/
+"""
+import argparse
+import json
+import logging
+import threading
+
+from collections import deque
+
+import certstream
+from certstream.filters import compile_filter
+from certstream.match import Matcher
+from certstream.server import WebSocketServer, encode_frame
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def subscriber_filter(query):
+    """
+    Builds a predicate for certificate updates from a subscriber's query string, or returns None if it asks for
+    everything. `domain`, `suffix` and `contains` (each repeatable) match any of the certificate's domains exactly,
+    by label-aware suffix or by substring, and `log` limits it to the given CT log urls.
+    """
+    spec = {}
+
+    domains = Matcher(exact=query.get('domain', ()), suffixes=query.get('suffix', ()), substrings=query.get('contains', ()))
+    if domains.exact or domains.suffixes or domains.substrings:
+        spec['leaf_cert.all_domains'] = domains
+
+    if query.get('log'):
+        spec['source.url'] = query['log']
+
+    return compile_filter(spec) if spec else None
+
+class Subscriber(object):
+    """
+    A local subscriber, with a bounded buffer of encoded frames drained by its own sender thread. A subscriber whose
+    buffer fills up is too slow to keep up with the stream, and its connection is dropped rather than let it hold up
+    the others or grow without bound.
+    """
+    def __init__(self, connection, buffer_size=1000, predicate=None, domains_only=False):
+        self.connection = connection
+        self.buffer_size = buffer_size
+        self.predicate = predicate
+        self.domains_only = domains_only
+        self.buffer = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.evicted = False
+        self.sent = 0
+
+        self.thread = threading.Thread(target=self._send_forever, name="certstream-relay-{}:{}".format(*connection.address[:2]))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def push(self, frame):
+        """
+        Queues an encoded frame, returning False if the subscriber had to be evicted.
+        """
+        with self.condition:
+            if self.closed:
+                return False
+            if len(self.buffer) >= self.buffer_size:
+                self.evicted = True
+                self.closed = True
+                self.condition.notify()
+                # The sender is most likely stuck writing to a full socket, so there's no closing handshake
+                self.connection.abort()
+                return False
+            self.buffer.append(frame)
+            self.condition.notify()
+            return True
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def _send_forever(self):
+        connection = self.connection
+        try:
+            while True:
+                with self.condition:
+                    while not self.buffer and not self.closed:
+                        self.condition.wait()
+                    if self.closed:
+                        break
+                    frames, self.buffer = self.buffer, deque()
+
+                for frame in frames:
+                    connection.send_raw(frame)
+                self.sent += len(frames)
+        except Exception as ex:
+            certstream_logger.info("Stopped sending to {} - {}".format(connection.address, ex))
+        finally:
+            if self.evicted:
+                certstream_logger.warning("Disconnected slow subscriber {} after {} frames".format(connection.address, self.sent))
+            connection.close()
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode('utf-8')
+
+class Relay(object):
+    """
+    Fan-out server behind `certstream-relay`. `run()` serves subscribers on `host`:`port` and relays frames from
+    `url` until interrupted. Every subscriber gets a buffer of `buffer_size` frames, and is disconnected once it's
+    full. Other keyword arguments are passed on to `listen_for_events` for the upstream connection.
+    """
+    def __init__(self, url, host='127.0.0.1', port=4000, buffer_size=1000, **kwargs):
+        self.url = url
+        self.buffer_size = buffer_size
+        self.listen_options = kwargs
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.server = WebSocketServer(self._on_connect, host=host, port=port)
+
+    def _on_connect(self, connection):
+        route = connection.route.rstrip('/')
+        if route not in ('', '/domains-only'):
+            connection.close(1008)
+            return
+
+        subscriber = Subscriber(
+            connection,
+            buffer_size=self.buffer_size,
+            predicate=subscriber_filter(connection.query),
+            domains_only=route == '/domains-only',
+        )
+        connection.on_close = lambda _: self._remove(subscriber)
+
+        with self.lock:
+            self.subscribers.add(subscriber)
+        certstream_logger.info("Subscriber {} connected to {} ({} subscribers)".format(connection.address, connection.path, len(self.subscribers)))
+
+    def _remove(self, subscriber):
+        subscriber.close()
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def broadcast(self, frame, context=None):
+        """
+        Sends a (lazy) frame to every subscriber which wants it. Frames are only decoded if some subscriber needs to
+        look inside them, and each form (full or domains only) is encoded once for all the subscribers getting it.
+        """
+        with self.lock:
+            subscribers = list(self.subscribers)
+        if not subscribers:
+            return
+
+        is_certificate = frame.get('message_type') == 'certificate_update'
+        encoded = {}
+
+        for subscriber in subscribers:
+            if is_certificate and subscriber.predicate is not None and not subscriber.predicate(frame):
+                continue
+
+            domains_only = subscriber.domains_only and is_certificate
+            message = encoded.get(domains_only)
+            if message is None:
+                if domains_only:
+                    message = encode_frame(_dumps({'message_type': 'dns_entries', 'data': frame['data']['leaf_cert']['all_domains']}))
+                else:
+                    message = encode_frame(frame.raw)
+                encoded[domains_only] = message
+
+            if not subscriber.push(message):
+                if subscriber.evicted:
+                    self.evictions += 1
+                self._remove(subscriber)
+
+    def run(self):
+        self.server.start()
+        certstream_logger.info("Relaying {} to {}".format(self.url, self.server.url))
+        try:
+            certstream.listen_for_events(self.broadcast, self.url, skip_heartbeats=False, lazy=True, **self.listen_options)
+        finally:
+            self.stop()
+
+    def stop(self):
+        with self.lock:
+            subscribers, self.subscribers = list(self.subscribers), set()
+        for subscriber in subscribers:
+            subscriber.close()
+        self.server.stop()
+
+parser = argparse.ArgumentParser(description='Relay a certstream server to local subscribers over a single upstream connection.')
+parser.add_argument('--url', default="wss://certstream.calidog.io", help='Upstream certstream server.')
+parser.add_argument('--host', default='127.0.0.1', help='Address to serve subscribers on.')
+parser.add_argument('--port', type=int, default=4000, help='Port to serve subscribers on.')
+parser.add_argument('--buffer-size', type=int, default=1000, help='Frames buffered per subscriber before it is disconnected as too slow.')
+parser.add_argument('--verbose', action='store_true', default=False, help='Display debug logging.')
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(format='[%(levelname)s:%(name)s] %(asctime)s - %(message)s', level=logging.DEBUG if args.verbose else logging.INFO)
+    Relay(args.url, host=args.host, port=args.port, buffer_size=args.buffer_size).run()
+
+certstream_logger = logging.getLogger('certstream')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+A small, dependency free websocket server (RFC 6455, text and binary frames, no extensions). It's what the benchmark
+replay server and the relay are built on, and is meant for serving a handful of local subscribers rather than the
+open internet.
+"""
+import base64
+import hashlib
+import logging
+import socket
+import struct
+import threading
+
+try:
+    import socketserver
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    import SocketServer as socketserver
+    from urlparse import urlsplit, parse_qs
+
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONT = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+def encode_frame(payload, opcode=OPCODE_TEXT):
+    """
+    Builds a single unmasked (server to client) frame around `payload`.
+    """
+    if not isinstance(payload, bytes):
+        payload = payload.encode('utf-8') if isinstance(payload, str) else bytes(payload)
+
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+class WebSocketConnection(object):
+    """
+    A single client connection. `send` is safe to call from any thread, and `on_message(connection, data)` is called
+    from the connection's own thread for every message the client sends.
+    """
+    def __init__(self, sock, address, path, headers):
+        self.sock = sock
+        self.address = address
+        self.path = path
+        self.headers = headers
+        self.closed = False
+        self.on_message = None
+        self.on_close = None
+        self.send_lock = threading.Lock()
+
+    @property
+    def route(self):
+        return urlsplit(self.path).path
+
+    @property
+    def query(self):
+        return parse_qs(urlsplit(self.path).query)
+
+    def send(self, payload, opcode=OPCODE_TEXT):
+        self.send_raw(encode_frame(payload, opcode))
+
+    def send_raw(self, frame):
+        """
+        Sends an already encoded frame, which lets a broadcaster encode each message once for all its subscribers.
+        """
+        with self.send_lock:
+            if self.closed:
+                raise socket.error("Connection closed")
+            self.sock.sendall(frame)
+
+    def close(self, code=1000):
+        with self.send_lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.sock.sendall(encode_frame(struct.pack('!H', code), OPCODE_CLOSE))
+            except socket.error:
+                pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def abort(self):
+        """
+        Drops the connection without a closing handshake, which also unblocks a thread stuck sending to it.
+        """
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def _read_exactly(self, count):
+        chunks = []
+        while count:
+            chunk = self.sock.recv(count)
+            if not chunk:
+                raise EOFError()
+            chunks.append(chunk)
+            count -= len(chunk)
+        return b"".join(chunks)
+
+    def _read_frame(self):
+        first, second = struct.unpack('!BB', self._read_exactly(2))
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self._read_exactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._read_exactly(8))[0]
+
+        mask = self._read_exactly(4) if second & 0x80 else None
+        payload = self._read_exactly(length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return bool(first & 0x80), opcode, payload
+
+    def serve(self):
+        message = []
+        try:
+            while not self.closed:
+                fin, opcode, payload = self._read_frame()
+                if opcode == OPCODE_PING:
+                    self.send(payload, OPCODE_PONG)
+                elif opcode == OPCODE_CLOSE:
+                    break
+                elif opcode in (OPCODE_TEXT, OPCODE_BINARY, OPCODE_CONT):
+                    message.append(payload)
+                    if fin:
+                        data, message = b"".join(message), []
+                        if self.on_message:
+                            self.on_message(self, data)
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.close()
+            if self.on_close:
+                self.on_close(self)
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            request += chunk
+            if len(request) > 65536:
+                return
+
+        lines = request.split(b"\r\n\r\n", 1)[0].decode('latin-1').split("\r\n")
+        try:
+            _, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return
+        headers = dict((k.strip().lower(), v.strip()) for k, _, v in (line.partition(":") for line in lines[1:]))
+
+        key = headers.get('sec-websocket-key')
+        if not key:
+            self.request.sendall(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return
+
+        accept = base64.b64encode(hashlib.sha1(key.encode('latin-1') + GUID).digest())
+        self.request.sendall(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+        )
+
+        connection = WebSocketConnection(self.request, self.client_address, path, headers)
+        try:
+            self.server.websocket_server.on_connect(connection)
+        except Exception as ex:
+            certstream_logger.exception("Error accepting websocket connection - {}".format(ex))
+            connection.close(1011)
+            return
+        connection.serve()
+
+class _ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class WebSocketServer(object):
+    """
+    Threaded websocket server calling `on_connect(connection)` for every new client. Use port 0 to pick a free port,
+    the one picked is available as `port` once the server is created.
+    """
+    def __init__(self, on_connect, host='127.0.0.1', port=0):
+        self.on_connect = on_connect
+        self.server = _ThreadingServer((host, port), _Handler)
+        self.server.websocket_server = self
+        self.thread = None
+        self.serving = False
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def url(self):
+        return "ws://{}:{}".format(self.host, self.port)
+
+    def start(self):
+        self.serving = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="certstream-server")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.serving = True
+        self.server.serve_forever()
+
+    def stop(self):
+        # shutdown() waits for serve_forever to notice, forever if it was never started
+        if self.serving:
+            self.server.shutdown()
+        self.server.server_close()
+
+certstream_logger = logging.getLogger('certstream')
@@ -0,0 +1,131 @@
+import logging
+import multiprocessing
+import zlib
+
+from .core import PIPELINE_OPTIONS, Context, _attach_gaps, _build_pipeline, _close_stages, _context_stages, _run_forever
+from .decode import get_decoder
+from .match import registered_domain
+
+# Sniffed from the raw frames, so the receive side doesn't spend its time decoding what the workers decode again
+SHARD_KEYS = {
+    'registered_domain': lambda frame: registered_domain(frame.sniff('domain')),
+    'domain': lambda frame: frame.sniff('domain'),
+    'log': lambda frame: frame.sniff('source_url'),
+    'fingerprint': lambda frame: frame.sniff('fingerprint'),
+}
+
+class ShardRouter(object):
+    """
+    Receive side of `listen_sharded`. Routes each raw frame to the worker owning its shard key, over a pipe per
+    worker. Heartbeats (when they aren't skipped) go to every worker.
+    """
+    def __init__(self, connections, shard_key='registered_domain'):
+        self.connections = connections
+        self.shard_key = SHARD_KEYS[shard_key] if not callable(shard_key) else shard_key
+        self.routed = [0] * len(connections)
+
+    def shard_for(self, frame):
+        key = self.shard_key(frame)
+        if not isinstance(key, bytes):
+            key = str(key).encode('utf-8')
+        # crc32 rather than hash() so a key lands on the same worker in every process and run
+        return zlib.crc32(key) % len(self.connections)
+
+    def __call__(self, frame, context):
+        raw = frame.raw
+        if not isinstance(raw, bytes):
+            raw = raw.encode('utf-8') if isinstance(raw, str) else bytes(raw)
+
+        if frame.get('message_type') != 'certificate_update':
+            for connection in self.connections:
+                connection.send_bytes(raw)
+            return
+
+        shard = self.shard_for(frame)
+        self.routed[shard] += 1
+        self.connections[shard].send_bytes(raw)
+
+def _shard_worker(shard, connection, message_callback, decoder, pipeline_options, context=None):
+    decoder = get_decoder(decoder)
+    if context is None:
+        context = Context(shard=shard)
+    callback, stages = _build_pipeline(message_callback, context=context, **pipeline_options)
+    stages.extend(_context_stages(context))
+
+    try:
+        while True:
+            try:
+                raw = connection.recv_bytes()
+            except EOFError:
+                break
+            if not raw:
+                break
+            try:
+                callback(decoder(raw), context)
+            except Exception as ex:
+                certstream_logger.exception("Error in shard {} callback - {}".format(shard, ex))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _close_stages(stages)
+
+def listen_sharded(message_callback, url, shards=None, shard_key='registered_domain', skip_heartbeats=True, decoder=None, **kwargs):
+    """
+    Receives on a single connection and spreads the work over `shards` worker processes (one per core by default),
+    so CPU heavy callbacks aren't held back by the GIL. Frames are passed to the workers as the raw bytes received
+    and decoded there, and each one goes to the worker owning its `shard_key` - 'registered_domain' (the default),
+    'domain', 'log', 'fingerprint' or a callable taking the frame - so per key state always stays in one process.
+    The named keys are pulled out of the raw frame without decoding it, a callable gets a `LazyFrame` which is only
+    decoded if it reads more than `frame.sniff()` offers.
+
+    Each worker calls `message_callback(frame, context)` with its own Context (`context.shard` is its number) unless
+    a `context` is passed - a `certstream.state.SharedContext` to share state between the workers - and
+    runs its own copy of any pipeline options (batch_callback, queue_size, matcher, fields...). Everything else is
+    handled on the receive side like `listen_for_events`.
+    """
+    shards = shards or multiprocessing.cpu_count()
+    pipeline_options = dict((name, kwargs.pop(name)) for name in PIPELINE_OPTIONS if name in kwargs)
+    if pipeline_options.get('sink') is not None:
+        # The workers are forked without the sinks' writer threads, and the receive side only has the raw frames
+        raise ValueError("Sinks aren't supported with listen_sharded, write to them from your message_callback instead")
+    context = kwargs.pop('context', None)
+    if kwargs.pop('lazy', None) is not None:
+        # The receive side always handles frames lazily, and the workers get them decoded
+        certstream_logger.warning("listen_sharded ignores lazy, frames are only decoded in the workers")
+
+    connections = []
+    processes = []
+    for shard in range(shards):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_shard_worker,
+            args=(shard, receiver, message_callback, decoder, pipeline_options, context),
+            name="certstream-shard-{}".format(shard),
+        )
+        process.daemon = True
+        process.start()
+        receiver.close()
+        connections.append(sender)
+        processes.append(process)
+
+    router = ShardRouter(connections, shard_key=shard_key)
+    # Gaps are tracked on the receive side, backfilled certificates are routed like the others
+    stages = []
+    kwargs['gaps'], callback = _attach_gaps(kwargs.get('gaps'), router, stages, kwargs.get('positions'), lazy=True, metrics=kwargs.get('metrics'))
+
+    try:
+        _run_forever(callback, url, stages, skip_heartbeats=skip_heartbeats, decoder=decoder, lazy=True, **kwargs)
+    except KeyboardInterrupt:
+        certstream_logger.info("Kill command received, exiting!!")
+    finally:
+        _close_stages(stages)
+        for connection in connections:
+            try:
+                connection.send_bytes(b"")
+                connection.close()
+            except (IOError, OSError):
+                pass
+        for process in processes:
+            process.join(10)
+
+certstream_logger = logging.getLogger('certstream')
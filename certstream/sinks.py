@@ -0,0 +1,349 @@
+"""
+Bulk writers for getting the stream into storage at line rate. Every sink queues frames (or projected records) on a
+bounded queue, and background writer threads hand them to the destination in batches, retrying failed batches with
+backoff. When the destination can't keep up the queue fills and putting a frame blocks, which pushes back on the
+receive loop the same way `overflow='block'` does, rather than buffering without bound.
+
+Sinks are message callbacks (and batch callbacks through `write_batch`), or can be passed as `sink` to
+`listen_for_events` alongside your own callback.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from collections import deque
+
+from .backoff import Backoff, RETRY_BACKOFF, retry
+from .capture import Recorder
+from .decode import LazyFrame
+from .httppool import HTTPConnectionPool
+from .records import Projection
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def serialize(record):
+    """
+    Returns JSON bytes for a frame, lazy frame (its raw bytes, as received) or record from `fields`.
+    """
+    if isinstance(record, LazyFrame):
+        raw = record.raw
+        return raw.encode('utf-8') if isinstance(raw, str) else bytes(raw)
+    if hasattr(record, '_asdict'):
+        record = record._asdict()
+    if orjson is not None:
+        return orjson.dumps(record)
+    return json.dumps(record).encode('utf-8')
+
+class Sink(object):
+    """
+    Base class for the sinks, subclasses implement `send(records)` to write out one batch (raising to have it
+    retried) and optionally `close_writer()`, which is called once the last writer thread stops. Both are called
+    from the writer threads.
+
+    Batches hold up to `batch_size` records, and are sent at the latest `batch_interval` seconds after their first
+    record was queued. Up to `queue_size` records are queued, after which putting one blocks until there's room -
+    `blocked` counts how often that happened, and `pressure` is how full the queue is (0 to 1). A failed batch is
+    retried up to `retries` times with `backoff` between attempts (a Backoff, or a number of seconds), and then
+    passed to `on_failure(records, exception)`, or logged and dropped without one. `writers` threads send batches
+    concurrently, for destinations which can take more than one at a time.
+    """
+    def __init__(self, batch_size=1000, batch_interval=1.0, queue_size=10000, writers=1, retries=5, backoff=None, on_failure=None):
+        if queue_size < batch_size:
+            raise ValueError("queue_size must be at least batch_size")
+
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.queue_size = queue_size
+        self.retries = retries
+        self.backoff = Backoff.from_value(backoff if backoff is not None else RETRY_BACKOFF)
+        self.on_failure = on_failure
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.flushing = 0
+        self.in_flight = 0
+        self.oldest = None
+
+        self.written = 0
+        self.failed = 0
+        self.retried = 0
+        self.blocked = 0
+
+        self.threads = []
+        self.active_writers = writers
+        for i in range(writers):
+            thread = threading.Thread(target=self._write_forever, name="certstream-{}-{}".format(type(self).__name__.lower(), i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    @property
+    def pressure(self):
+        return len(self.queue) / float(self.queue_size)
+
+    def __call__(self, record, context=None):
+        with self.condition:
+            if self.closed:
+                raise ValueError("{} is closed".format(type(self).__name__))
+
+            if len(self.queue) >= self.queue_size:
+                self.blocked += 1
+                while len(self.queue) >= self.queue_size and not self.closed:
+                    self.condition.wait()
+
+            self.queue.append(record)
+            # Wake the writers for a new batch's deadline, and for a full batch
+            if len(self.queue) == 1:
+                self.oldest = time.time()
+                self.condition.notify_all()
+            elif len(self.queue) >= self.batch_size:
+                self.condition.notify_all()
+
+    def write_batch(self, records, context=None):
+        for record in records:
+            self(record, context)
+
+    def send(self, records):
+        raise NotImplementedError()
+
+    def close_writer(self):
+        pass
+
+    def flush(self):
+        """
+        Sends everything queued so far, waiting until it's written.
+        """
+        with self.condition:
+            self.flushing += 1
+            self.condition.notify_all()
+            try:
+                while (self.queue or self.in_flight) and self.threads_alive():
+                    self.condition.wait(0.1)
+            finally:
+                self.flushing -= 1
+
+    def close(self):
+        """
+        Writes out everything queued and stops the writers.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def threads_alive(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def _next_batch(self):
+        with self.condition:
+            while True:
+                if self.queue:
+                    if len(self.queue) >= self.batch_size or self.closed or self.flushing:
+                        break
+                    remaining = self.oldest + self.batch_interval - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                elif self.closed:
+                    return None
+                else:
+                    self.condition.wait()
+
+            count = min(self.batch_size, len(self.queue))
+            batch = [self.queue.popleft() for _ in range(count)]
+            self.oldest = time.time() if self.queue else None
+            self.in_flight += 1
+            self.condition.notify_all()
+            return batch
+
+    def _write_forever(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                try:
+                    self._send_with_retries(batch)
+                finally:
+                    with self.condition:
+                        self.in_flight -= 1
+                        self.condition.notify_all()
+        finally:
+            with self.condition:
+                self.active_writers -= 1
+                last = self.active_writers == 0
+            try:
+                if last:
+                    self.close_writer()
+            except Exception as ex:
+                certstream_logger.exception("Error closing {} - {}".format(type(self).__name__, ex))
+
+    def _send_with_retries(self, batch):
+        def _on_retry(ex, delay):
+            self.retried += 1
+            certstream_logger.warning("{} failed to write a batch of {}, retrying in {:.1f} seconds - {}".format(type(self).__name__, len(batch), delay, ex))
+
+        try:
+            retry(lambda: self.send(batch), self.retries, self.backoff, on_retry=_on_retry)
+        except Exception as ex:
+            self.failed += len(batch)
+            if self.on_failure is not None:
+                self.on_failure(batch, ex)
+            else:
+                certstream_logger.error("{} dropped a batch of {} after {} attempts - {}".format(type(self).__name__, len(batch), self.retries + 1, ex))
+            return
+        self.written += len(batch)
+
+class RotatingFileSink(Sink):
+    """
+    Writes to rotating segment files in `directory` through a `certstream.capture.Recorder` (same `format`,
+    `compression`, `segment_size` and `segment_seconds`, and the same index, so they can be replayed), flushing
+    after every batch. Files aren't idempotent, so failed batches aren't retried unless `retries` is set.
+    """
+    def __init__(self, directory, format='jsonl', compression='gzip', segment_size=256 * 1024 * 1024, segment_seconds=3600, retries=0, **kwargs):
+        self.recorder = Recorder(directory, format=format, compression=compression, segment_size=segment_size, segment_seconds=segment_seconds)
+        super(RotatingFileSink, self).__init__(retries=retries, **kwargs)
+
+    def send(self, records):
+        self.recorder.write_batch(records)
+        self.recorder.flush()
+
+    def close_writer(self):
+        self.recorder.close()
+
+class SQLiteSink(Sink):
+    """
+    Bulk inserts certificate updates into `table` of the SQLite database at `path`, one row per certificate with a
+    column per entry of `fields` (as for `listen_for_events`, dots become underscores). Lists and dicts are stored
+    as JSON. The table is created if it doesn't exist; other messages are skipped. Inserts for a batch happen in a
+    single transaction, and the database is put in WAL mode so readers don't block the writer.
+    """
+    DEFAULT_FIELDS = ('seen', 'cert_index', 'source.url', 'fingerprint', 'not_before', 'not_after', 'all_domains')
+
+    def __init__(self, path, table='certificates', fields=DEFAULT_FIELDS, **kwargs):
+        kwargs['writers'] = 1
+        self.path = path
+        self.table = table
+        self.projection = Projection(list(fields))
+        self.columns = self.projection.record._fields
+        self.connection = None
+        super(SQLiteSink, self).__init__(**kwargs)
+
+    def _connect(self):
+        # Opened on the writer thread, which is the only one using it
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(self.table, ", ".join(self.columns)))
+        connection.commit()
+        return connection
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, (list, dict, tuple)):
+            return json.dumps(value)
+        return value
+
+    def send(self, records):
+        if self.connection is None:
+            self.connection = self._connect()
+
+        rows = []
+        for record in records:
+            if not hasattr(record, '_fields'):
+                record = self.projection(record)
+                if record is None:
+                    continue
+            rows.append(tuple(self._value(getattr(record, column, None)) for column in self.columns))
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO {} ({}) VALUES ({})".format(self.table, ", ".join(self.columns), ", ".join("?" * len(self.columns))),
+                rows,
+            )
+
+    def close_writer(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class KafkaSink(Sink):
+    """
+    Produces every record as JSON to `topic` through `producer`, which can be a kafka-python `KafkaProducer`
+    (`send`) or a confluent-kafka `Producer` (`produce`), or anything with either method and a `flush`. `key` is an
+    optional callable returning the message key for a record. Each batch is flushed before it counts as written, so
+    delivery errors get the batch retried.
+    """
+    def __init__(self, producer, topic, key=None, **kwargs):
+        self.producer = producer
+        self.topic = topic
+        self.key = key
+        super(KafkaSink, self).__init__(**kwargs)
+
+    def send(self, records):
+        producer = self.producer
+        produce = getattr(producer, 'produce', None)
+
+        for record in records:
+            value = serialize(record)
+            key = self.key(record) if self.key is not None else None
+            if isinstance(key, str):
+                key = key.encode('utf-8')
+
+            if produce is None:
+                producer.send(self.topic, value=value, key=key)
+                continue
+
+            try:
+                produce(self.topic, value=value, key=key)
+            except BufferError:
+                # confluent-kafka's local queue is full, let it deliver some first
+                producer.poll(1)
+                produce(self.topic, value=value, key=key)
+
+        remaining = producer.flush()
+        if remaining:
+            raise IOError("{} messages were still undelivered after flushing".format(remaining))
+
+class HTTPSink(Sink):
+    """
+    POSTs each batch to `url` as newline delimited JSON (or a JSON array with `json_array=True`), reusing keep-alive
+    connections from a `certstream.httppool.HTTPConnectionPool` (up to `writers` of them end up open). Anything but
+    a 2xx response gets the batch retried.
+    """
+    def __init__(self, url, headers=None, json_array=False, timeout=30, **kwargs):
+        if urlsplit(url).scheme not in ('http', 'https'):
+            raise ValueError("HTTPSink needs an http:// or https:// url")
+
+        self.url = url
+        self.json_array = json_array
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json' if json_array else 'application/x-ndjson'}
+        self.headers.update(headers or {})
+        self.pool = HTTPConnectionPool(timeout=timeout)
+        super(HTTPSink, self).__init__(**kwargs)
+
+    def send(self, records):
+        if self.json_array:
+            body = b"[" + b",".join(serialize(record) for record in records) + b"]"
+        else:
+            body = b"\n".join(serialize(record) for record in records) + b"\n"
+
+        status, content = self.pool.post(self.url, body, headers=self.headers)
+        if not 200 <= status < 300:
+            raise IOError("HTTP {} from {} - {}".format(status, self.url, content[:200]))
+
+    def close_writer(self):
+        self.pool.close()
+
+certstream_logger = logging.getLogger('certstream')
@@ -0,0 +1,240 @@
+"""
+State backends which can be passed as `context` to `listen_for_events` in place of the default Context, a plain dict
+created for every call and shared by its connections. They all allow attribute access (`context.counter`, None when
+missing) as well as item access.
+
+- `ThreadLocalContext` gives every thread its own dict, so callbacks running in a thread worker pool never contend.
+- `SharedContext` is shared between processes (process workers, or separate consumers) through a manager process.
+- `SQLiteContext` is an in-memory dict which is checkpointed to a SQLite database and reloaded from it on start, so
+  warm state survives restarts.
+"""
+import logging
+import multiprocessing
+import pickle
+import sqlite3
+import threading
+
+from .core import Context
+
+class ThreadLocalContext(object):
+    """
+    A separate Context per thread - no locks, and nothing shared between the threads. `contexts()` returns every
+    thread's Context, e.g. to merge per worker counters for a report.
+    """
+    __slots__ = ('_local', '_contexts', '_lock')
+
+    def __init__(self):
+        object.__setattr__(self, '_local', threading.local())
+        object.__setattr__(self, '_contexts', [])
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    @property
+    def current(self):
+        try:
+            return self._local.context
+        except AttributeError:
+            context = self._local.context = Context()
+            with self._lock:
+                self._contexts.append(context)
+            return context
+
+    def contexts(self):
+        with self._lock:
+            return list(self._contexts)
+
+    def __getattr__(self, name):
+        return self.current.get(name)
+
+    def __setattr__(self, name, value):
+        self.current[name] = value
+
+    def __delattr__(self, name):
+        del self.current[name]
+
+    def __getitem__(self, key):
+        return self.current[key]
+
+    def __setitem__(self, key, value):
+        self.current[key] = value
+
+    def __delitem__(self, key):
+        del self.current[key]
+
+    def __contains__(self, key):
+        return key in self.current
+
+    def __iter__(self):
+        return iter(self.current)
+
+    def __len__(self):
+        return len(self.current)
+
+    def get(self, key, default=None):
+        return self.current.get(key, default)
+
+    def setdefault(self, key, default=None):
+        return self.current.setdefault(key, default)
+
+    def pop(self, key, *default):
+        return self.current.pop(key, *default)
+
+    def update(self, *args, **kwargs):
+        self.current.update(*args, **kwargs)
+
+class SharedContext(object):
+    """
+    Context shared between processes, held by a `multiprocessing.Manager` (a new one unless `manager` is passed).
+    Every access is a round trip to the manager process, so keep it to state which really has to be shared. Values
+    are copied in and out - changing a list you read from it doesn't change the shared one, assign it back or use
+    `update_value`, which runs under the shared `lock`:
+
+        context.update_value('seen', lambda seen: (seen or 0) + 1)
+
+    It can be pickled, so it can be handed to process workers (`worker_type='process'`). It's no place for state
+    touched on every frame though, as each of those accesses pays for the round trip - count in a process local
+    Context and merge into it now and then.
+    """
+    def __init__(self, manager=None):
+        if manager is None:
+            manager = multiprocessing.Manager()
+        object.__setattr__(self, '_manager', manager)
+        object.__setattr__(self, '_dict', manager.dict())
+        object.__setattr__(self, 'lock', manager.Lock())
+
+    def __getstate__(self):
+        # The manager itself stays with the process which started it, the proxies reconnect to it
+        return self._dict, self.lock
+
+    def __setstate__(self, state):
+        object.__setattr__(self, '_manager', None)
+        object.__setattr__(self, '_dict', state[0])
+        object.__setattr__(self, 'lock', state[1])
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._dict.get(name)
+
+    def __setattr__(self, name, value):
+        self._dict[name] = value
+
+    def __delattr__(self, name):
+        del self._dict[name]
+
+    def __getitem__(self, key):
+        return self._dict[key]
+
+    def __setitem__(self, key, value):
+        self._dict[key] = value
+
+    def __delitem__(self, key):
+        del self._dict[key]
+
+    def __contains__(self, key):
+        return key in self._dict
+
+    def __iter__(self):
+        return iter(self._dict.keys())
+
+    def __len__(self):
+        return len(self._dict)
+
+    def get(self, key, default=None):
+        return self._dict.get(key, default)
+
+    def setdefault(self, key, default=None):
+        return self._dict.setdefault(key, default)
+
+    def pop(self, key, *default):
+        return self._dict.pop(key, *default)
+
+    def update(self, *args, **kwargs):
+        self._dict.update(*args, **kwargs)
+
+    def update_value(self, key, function, default=None):
+        """
+        Atomically replaces the value of `key` with `function(value)`, returning the new value.
+        """
+        with self.lock:
+            value = function(self._dict.get(key, default))
+            self._dict[key] = value
+            return value
+
+    def increment(self, key, amount=1):
+        return self.update_value(key, lambda value: value + amount, 0)
+
+class SQLiteContext(Context):
+    """
+    Context which is checkpointed to the SQLite database at `path` every `checkpoint_interval` seconds (from a
+    background thread), whenever the connection drops and on shutdown, and reloaded from it when created. It's a
+    plain dict otherwise, so reads and writes cost nothing extra. Values have to be picklable.
+
+    Checkpoints copy the dict and pickle the copy, so state mutated while a checkpoint runs is simply picked up by
+    the next one. Call `checkpoint()` yourself to save at a point you know is consistent.
+    """
+    def __init__(self, path, checkpoint_interval=60, table='context'):
+        super(SQLiteContext, self).__init__()
+        object.__setattr__(self, '_path', path)
+        object.__setattr__(self, '_table', table)
+        object.__setattr__(self, '_db_lock', threading.Lock())
+        object.__setattr__(self, '_stopped', threading.Event())
+        object.__setattr__(self, '_connection', sqlite3.connect(path, check_same_thread=False))
+
+        self._connection.execute("CREATE TABLE IF NOT EXISTS {} (key BLOB PRIMARY KEY, value BLOB)".format(table))
+        self._connection.commit()
+        self._load()
+
+        if checkpoint_interval:
+            thread = threading.Thread(target=self._checkpoint_every, args=(checkpoint_interval,), name="certstream-checkpoint")
+            thread.daemon = True
+            thread.start()
+
+    def _load(self):
+        with self._db_lock:
+            rows = self._connection.execute("SELECT key, value FROM {}".format(self._table)).fetchall()
+
+        for key, value in rows:
+            try:
+                dict.__setitem__(self, pickle.loads(key), pickle.loads(value))
+            except Exception as ex:
+                certstream_logger.warning("Couldn't load a context value from {} - {}".format(self._path, ex))
+
+    def checkpoint(self):
+        """
+        Writes the whole context to the database in a single transaction. Returns False if it changed while being
+        saved, in which case the previous checkpoint is kept.
+        """
+        try:
+            rows = [
+                (pickle.dumps(key, pickle.HIGHEST_PROTOCOL), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+                for key, value in list(dict.items(self))
+            ]
+        except RuntimeError as ex:
+            certstream_logger.debug("Context changed during checkpoint, retrying later - {}".format(ex))
+            return False
+
+        with self._db_lock:
+            with self._connection:
+                self._connection.execute("DELETE FROM {}".format(self._table))
+                self._connection.executemany("INSERT INTO {} (key, value) VALUES (?, ?)".format(self._table), rows)
+        return True
+
+    def _checkpoint_every(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.checkpoint()
+            except Exception as ex:
+                certstream_logger.exception("Error checkpointing context to {} - {}".format(self._path, ex))
+
+    def flush(self):
+        self.checkpoint()
+
+    def close(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self.checkpoint()
+        with self._db_lock:
+            self._connection.close()
+
+certstream_logger = logging.getLogger('certstream')
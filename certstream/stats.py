@@ -0,0 +1,340 @@
+import array
+import hashlib
+import logging
+import math
+import struct
+import threading
+import time
+
+from collections import deque
+
+from .match import normalize_domain, registered_domain
+
+def _hash64(key):
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return struct.unpack('<Q', hashlib.blake2b(key, digest_size=8).digest())[0]
+
+class CountMinSketch(object):
+    """
+    Approximate counts of any number of keys in `width * depth` counters. Estimates are never too low, and too high
+    by at most about `2 / width` of the total count with probability `1 - 0.5 ** depth`.
+    """
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = array.array('L', [0]) * (width * depth)
+        self.total = 0
+
+    def _indexes(self, key):
+        hashed = _hash64(key)
+        first, second = hashed & 0xffffffff, hashed >> 32
+        width = self.width
+        return [row * width + (first + row * second) % width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        table = self.table
+        for index in self._indexes(key):
+            table[index] += count
+        self.total += count
+
+    def estimate(self, key):
+        table = self.table
+        return min(table[index] for index in self._indexes(key))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Only sketches of the same size can be merged")
+        table = self.table
+        for index, count in enumerate(other.table):
+            if count:
+                table[index] += count
+        self.total += other.total
+
+class SpaceSaving(object):
+    """
+    Top-K counter (the Space-Saving algorithm) tracking at most `capacity` keys. Counts are exact while there are
+    no more keys than that; past it the least counted key is replaced, and any key counted more than
+    `total / capacity` times is guaranteed to be tracked. Keys are kept in buckets by count, so adding is O(1).
+    """
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.buckets = {}
+        self.min_count = 0
+        self.total = 0
+
+    def _move(self, key, old, new):
+        self.buckets.setdefault(new, set()).add(key)
+        self.counts[key] = new
+        if old:
+            self._discard(key, old, new)
+
+    def _discard(self, key, old, new):
+        bucket = self.buckets[old]
+        bucket.discard(key)
+        if not bucket:
+            del self.buckets[old]
+            if old == self.min_count:
+                # Counts only go up by one while streaming, so the new count is the smallest left
+                self.min_count = new if new == old + 1 else min(self.buckets)
+
+    def add(self, key, count=1):
+        self.total += count
+        current = self.counts.get(key)
+        if current is not None:
+            self._move(key, current, current + count)
+            return
+
+        if len(self.counts) < self.capacity:
+            self.errors[key] = 0
+            if not self.min_count or count < self.min_count:
+                self.min_count = count
+            self._move(key, 0, count)
+            return
+
+        # Full, take over the least counted key along with its count as our error
+        floor = self.min_count
+        victim = next(iter(self.buckets[floor]))
+        del self.counts[victim]
+        del self.errors[victim]
+        self.errors[key] = floor
+        self._move(key, 0, floor + count)
+        self._discard(victim, floor, floor + count)
+
+    def top(self, n=None):
+        """
+        Returns up to `n` (key, count) pairs, highest count first.
+        """
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return items if n is None else items[:n]
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.add(key, count)
+
+    def __len__(self):
+        return len(self.counts)
+
+class HyperLogLog(object):
+    """
+    Distinct count estimate in `2 ** precision` bytes, with a standard error of about `1.04 / sqrt(2 ** precision)`
+    (0.8% at the default precision of 14, in 16KB).
+    """
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, key):
+        hashed = _hash64(key)
+        index = hashed >> (64 - self.precision)
+        rest = (hashed << self.precision) & 0xffffffffffffffff
+        rank = (64 - self.precision + 1) if not rest else (64 - rest.bit_length() + 1)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = size * math.log(float(size) / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Only HyperLogLogs of the same precision can be merged")
+        registers = self.registers
+        for index, register in enumerate(other.registers):
+            if register > registers[index]:
+                registers[index] = register
+
+def _issuer(leaf_cert):
+    issuer = leaf_cert.get('issuer') or {}
+    return issuer.get('O') or issuer.get('CN') or 'unknown'
+
+class WindowStats(object):
+    """
+    Aggregates for a single window: counts per log, issuer and TLD, top registered domains, point estimates for any
+    registered domain and distinct domain/certificate counts. Memory is fixed by the sketch sizes, however many
+    frames go in.
+    """
+    def __init__(self, start, end, top_k=100, label_capacity=1000, sketch_width=2048, sketch_depth=4, precision=14):
+        self.start = start
+        self.end = end
+        self.top_k = top_k
+        self.certificates = 0
+        self.heartbeats = 0
+        self.domain_count = 0
+        self.logs = SpaceSaving(label_capacity)
+        self.issuers = SpaceSaving(label_capacity)
+        self.tlds = SpaceSaving(label_capacity)
+        self.domains = SpaceSaving(top_k * 10)
+        self.domain_sketch = CountMinSketch(sketch_width, sketch_depth)
+        self.distinct_domains = HyperLogLog(precision)
+        self.distinct_certificates = HyperLogLog(precision)
+
+    def add(self, frame):
+        message_type = frame.get('message_type')
+        if message_type == 'heartbeat':
+            self.heartbeats += 1
+            return
+        if message_type != 'certificate_update':
+            return
+
+        data = frame['data']
+        leaf_cert = data['leaf_cert']
+        self.certificates += 1
+        self.logs.add(data['source']['url'])
+        self.issuers.add(_issuer(leaf_cert))
+        self.distinct_certificates.add(leaf_cert.get('fingerprint') or "{}:{}".format(data['source']['url'], data['cert_index']))
+
+        registered = set()
+        for domain in leaf_cert['all_domains']:
+            domain = normalize_domain(domain)
+            self.domain_count += 1
+            self.distinct_domains.add(domain)
+            self.tlds.add(domain.rsplit('.', 1)[-1])
+            registered.add(registered_domain(domain))
+
+        for domain in registered:
+            self.domains.add(domain)
+            self.domain_sketch.add(domain)
+
+    def merge(self, other):
+        self.start = min(self.start, other.start)
+        self.end = max(self.end, other.end)
+        self.certificates += other.certificates
+        self.heartbeats += other.heartbeats
+        self.domain_count += other.domain_count
+        for name in ('logs', 'issuers', 'tlds', 'domains', 'domain_sketch', 'distinct_domains', 'distinct_certificates'):
+            getattr(self, name).merge(getattr(other, name))
+
+    def estimate(self, domain):
+        """
+        Approximate number of certificates for a registered domain in this window.
+        """
+        return self.domain_sketch.estimate(registered_domain(domain))
+
+    def snapshot(self):
+        return {
+            'start': self.start,
+            'end': self.end,
+            'certificates': self.certificates,
+            'heartbeats': self.heartbeats,
+            'domains': self.domain_count,
+            'logs': dict(self.logs.top()),
+            'issuers': dict(self.issuers.top()),
+            'tlds': dict(self.tlds.top()),
+            'top_domains': self.domains.top(self.top_k),
+            'distinct_domains': self.distinct_domains.count(),
+            'distinct_certificates': self.distinct_certificates.count(),
+        }
+
+class StreamStats(object):
+    """
+    Windowed analytics over the stream, usable directly as a `message_callback` (or fed with `add`). Without a
+    `slide` the windows are tumbling, `window` seconds each. With one they're sliding: every `slide` seconds you get
+    the last `window` seconds, kept as `window / slide` panes which are merged on demand, so memory stays constant.
+
+    `on_window(snapshot)` is called as each window closes - windows close when a frame arrives after their end, so
+    keep heartbeats on (`skip_heartbeats=False`) for them to close on time in a quiet stream. `snapshot()` returns
+    the current (partial) window at any time. Times are when frames arrive, or with `event_time` their `seen` time,
+    which is what you want when replaying a recording.
+    """
+    def __init__(self, window=60, slide=None, on_window=None, event_time=False, top_k=100, label_capacity=1000,
+                 sketch_width=2048, sketch_depth=4, precision=14):
+        slide = slide or window
+        if window % slide:
+            raise ValueError("window must be a multiple of slide")
+
+        self.window = window
+        self.slide = slide
+        self.panes = int(window // slide)
+        self.on_window = on_window
+        self.event_time = event_time
+        self.options = dict(top_k=top_k, label_capacity=label_capacity, sketch_width=sketch_width, sketch_depth=sketch_depth, precision=precision)
+        self.history = deque(maxlen=self.panes)
+        self.current = None
+        self.lock = threading.Lock()
+
+    def _new_pane(self, now):
+        start = now - (now % self.slide)
+        return WindowStats(start, start + self.slide, **self.options)
+
+    def _frame_time(self, frame):
+        if self.event_time and frame.get('message_type') == 'certificate_update':
+            return frame['data']['seen']
+        return time.time()
+
+    def _advance(self, now):
+        # Closes every pane which ended before `now`, emitting a window for each one
+        emitted = []
+        while self.current is not None and now >= self.current.end:
+            self.history.append(self.current)
+            emitted.append(self._merged(self.history, self.current.end).snapshot())
+            end = self.current.end
+            self.current = self._new_pane(end) if now < end + self.slide else None
+        if self.current is None:
+            self.current = self._new_pane(now)
+        return emitted
+
+    def _merged(self, panes, end):
+        # Panes from before a gap in the stream can still be in the history, they're past the window
+        merged = WindowStats(end - self.window, end, **self.options)
+        for pane in panes:
+            if pane.start >= end - self.window:
+                merged.merge(pane)
+        return merged
+
+    def add(self, frame, now=None):
+        now = self._frame_time(frame) if now is None else now
+        with self.lock:
+            emitted = self._advance(now)
+            self.current.add(frame)
+        self._emit(emitted)
+
+    def __call__(self, frame, context):
+        self.add(frame)
+
+    def snapshot(self):
+        """
+        The window in progress - everything since the last window closed for tumbling windows, the last `window`
+        seconds (including the current pane) for sliding ones.
+        """
+        with self.lock:
+            emitted = [] if self.event_time and self.current is not None else self._advance(time.time())
+            merged = self._merged(list(self.history) + [self.current], self.current.end)
+        self._emit(emitted)
+        return merged.snapshot()
+
+    def _emit(self, snapshots):
+        if self.on_window is None:
+            return
+        for snapshot in snapshots:
+            try:
+                self.on_window(snapshot)
+            except Exception as ex:
+                certstream_logger.exception("Error in on_window callback - {}".format(ex))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Emits the window in progress.
+        """
+        with self.lock:
+            if self.current is None:
+                return
+            self.history.append(self.current)
+            emitted = [self._merged(self.history, self.current.end).snapshot()]
+            self.current = None
+        self._emit(emitted)
+
+certstream_logger = logging.getLogger('certstream')
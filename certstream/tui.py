@@ -0,0 +1,271 @@
+"""
+Terminal viewer behind `certstream --tui`, meant to be left running for days. Certificates go into a fixed-size ring
+buffer (the listener thread only appends to it), the screen is redrawn at most `fps` times a second whatever the rate
+of the stream, rows are only rendered while visible and the JSON pane only for the selected certificate.
+
+Keys: up/down/page up/page down to scroll, f or home to follow the newest certificate again, q to quit.
+"""
+import json
+import logging
+import threading
+import time
+
+from collections import deque
+
+import certstream
+from certstream.decode import get_decoder
+
+try:
+    import urwid
+except ImportError:
+    urwid = None
+
+class FeedModel(object):
+    """
+    Ring buffer of the last `size` certificate updates, filled by the listener thread. Certificates are numbered in
+    arrival order, the newest being `total - 1` and the oldest still held `first`.
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self.frames = deque(maxlen=size)
+        self.total = 0
+        self.heartbeats = 0
+        self.last_heartbeat = None
+        self.state = 'connecting'
+        self.lock = threading.Lock()
+
+    def __call__(self, frame, context=None):
+        message_type = frame.get('message_type')
+        if message_type == 'certificate_update':
+            with self.lock:
+                self.frames.append(frame)
+                self.total += 1
+        elif message_type == 'heartbeat':
+            self.heartbeats += 1
+            self.last_heartbeat = time.time()
+
+    def on_state_change(self, state, client):
+        self.state = state
+
+    def snapshot(self):
+        """
+        Returns (first, frames) - the number of the oldest certificate held and a list of them, oldest first.
+        """
+        with self.lock:
+            return self.total - len(self.frames), list(self.frames)
+
+def summary(data):
+    return u"[{}] {} - {}".format(data.get('cert_index'), data['source']['url'], data['leaf_cert']['subject'].get('CN'))
+
+PALETTE = [
+    ('body', 'light green', 'black'),
+    ('header', 'white,bold', 'black'),
+    ('selected', 'black', 'light green'),
+    ('heartbeat', 'light red', 'black'),
+    ('footer', 'white', 'dark gray'),
+]
+
+BANNER = u"""
+   _____          _    _____ _
+  / ____|        | |  / ____| |
+ | |     ___ _ __| |_| (___ | |_ _ __ ___  __ _ _ __ ___
+ | |    / _ \\ '__| __|\\___ \\| __| '__/ _ \\/ _` | '_ ` _ \\
+ | |___|  __/ |  | |_ ____) | |_| | |  __/ (_| | | | | | |
+  \\_____\\___|_|   \\__|_____/ \\__|_|  \\___|\\__,_|_| |_| |_|
+
+Waiting for certificates from {}
+"""
+
+if urwid is not None:
+    class _Row(urwid.Text):
+        _selectable = True
+
+        def keypress(self, size, key):
+            return key
+
+    class FeedWalker(urwid.ListWalker):
+        """
+        List walker over a snapshot of a FeedModel, newest certificate first. Positions are certificate numbers, so the
+        selection stays on the same certificate as new ones arrive, until it falls out of the buffer. Row widgets are
+        only built for the rows urwid asks for, and dropped once their certificate is evicted.
+        """
+        def __init__(self, model, decode):
+            self.model = model
+            self.decode = decode
+            self.first = 0
+            self.frames = []
+            self.focus = None
+            self.follow = True
+            self.rows = {}
+
+        @property
+        def newest(self):
+            return self.first + len(self.frames) - 1
+
+        def refresh(self):
+            """
+            Takes a new snapshot of the model, returning True if it changed.
+            """
+            first, frames = self.model.snapshot()
+            if first == self.first and len(frames) == len(self.frames):
+                return False
+
+            self.first, self.frames = first, frames
+            for position in [position for position in self.rows if position < first]:
+                del self.rows[position]
+
+            if self.follow or self.focus is None:
+                self.focus = self.newest
+            elif self.focus < first:
+                self.focus = first
+            self._modified()
+            return True
+
+        def frame(self, position):
+            if position is None or not 0 <= position - self.first < len(self.frames):
+                return None
+            return self.frames[position - self.first]
+
+        def _row(self, position):
+            row = self.rows.get(position)
+            if row is None:
+                frame = self.frame(position)
+                if frame is None:
+                    return None
+                # Decoded for display only, the buffer keeps the raw frame
+                row = self.rows[position] = urwid.AttrMap(_Row(summary(self.decode(frame.raw)['data']), wrap='clip'), None, focus_map='selected')
+            return row
+
+        def get_focus(self):
+            if self.focus is None:
+                return None, None
+            return self._row(self.focus), self.focus
+
+        def set_focus(self, position):
+            self.focus = position
+            self.follow = position == self.newest
+            self._modified()
+
+        def get_next(self, position):
+            # Older certificates are further down
+            if position - 1 < self.first:
+                return None, None
+            return self._row(position - 1), position - 1
+
+        def get_prev(self, position):
+            if position + 1 > self.newest:
+                return None, None
+            return self._row(position + 1), position + 1
+
+    class _StatusHandler(logging.Handler):
+        """
+        Keeps the last warning logged while the viewer owns the screen, to show in the footer instead of on stderr.
+        """
+        def __init__(self):
+            super(_StatusHandler, self).__init__(logging.WARNING)
+            self.message = None
+
+        def emit(self, record):
+            self.message = record.getMessage()
+
+class FeedViewer(object):
+    """
+    Full screen viewer for `url`. Holds the last `size` certificates, and redraws at most `fps` times a second.
+    """
+    def __init__(self, url, size=1000, fps=10, decoder=None, **kwargs):
+        if urwid is None:
+            raise ImportError("The terminal viewer needs urwid, install it with `pip install certstream[tui]`")
+
+        self.url = url
+        self.interval = 1.0 / fps
+        self.model = FeedModel(size)
+        self.decode = get_decoder(decoder)
+        self.listen_options = kwargs
+        self.stop_event = threading.Event()
+
+        self.walker = FeedWalker(self.model, self.decode)
+        self.detail = urwid.Text(u"")
+        self.detail_position = None
+        self.counter = urwid.Text(u"", align='right')
+        self.status = urwid.Text(u"")
+        self.status_handler = _StatusHandler()
+        self.started = False
+        self._rate_total = 0
+        self._rate_time = time.time()
+        self._rate = 0.0
+
+        self.body = urwid.Columns([
+            urwid.LineBox(urwid.ListBox(self.walker), title=u"Certificates"),
+            urwid.LineBox(urwid.ListBox(urwid.SimpleFocusListWalker([self.detail])), title=u"Leaf certificate"),
+        ])
+        self.frame = urwid.Frame(
+            urwid.Filler(urwid.Text(BANNER.format(url), align='center')),
+            footer=urwid.AttrMap(urwid.Columns([self.status, ('pack', self.counter)]), 'footer'),
+        )
+        self.loop = urwid.MainLoop(urwid.AttrMap(self.frame, 'body'), palette=PALETTE, unhandled_input=self._on_input)
+
+    def _on_input(self, key):
+        if key in ('q', 'Q'):
+            raise urwid.ExitMainLoop()
+        if key in ('f', 'F', 'home') and self.walker.frames:
+            self.walker.set_focus(self.walker.newest)
+
+    def _tick(self, loop=None, user_data=None):
+        # All the screen updates happen here, so a burst of certificates costs one redraw
+        if self.walker.refresh() and not self.started:
+            self.started = True
+            self.frame.body = self.body
+
+        if self.walker.focus != self.detail_position:
+            self.detail_position = self.walker.focus
+            frame = self.walker.frame(self.detail_position)
+            if frame is not None:
+                self.detail.set_text(json.dumps(self.decode(frame.raw)['data']['leaf_cert'], indent=4))
+
+        self._update_footer()
+        self.loop.set_alarm_in(self.interval, self._tick)
+
+    def _update_footer(self):
+        now = time.time()
+        if now - self._rate_time >= 1:
+            self._rate = (self.model.total - self._rate_total) / (now - self._rate_time)
+            self._rate_total, self._rate_time = self.model.total, now
+
+        status = [u" {} | {} | {:.0f}/s ".format(self.url, self.model.state, self._rate)]
+        if self.model.last_heartbeat is not None:
+            status.append(('heartbeat', u"\u2764 {:.0f}s ago ".format(now - self.model.last_heartbeat)))
+        if self.status_handler.message:
+            status.append(u"| {}".format(self.status_handler.message))
+        self.status.set_text(status)
+
+        walker = self.walker
+        if walker.focus is None:
+            self.counter.set_text(u" 0/{} ".format(self.model.total))
+        else:
+            self.counter.set_text(u" {}/{}{} ".format(walker.newest - walker.focus + 1, len(walker.frames), u"" if walker.follow else u" (f to follow)"))
+
+    def _listen(self):
+        certstream.listen_for_events(
+            self.model, self.url, skip_heartbeats=False, lazy=True, stop_event=self.stop_event,
+            on_state_change=self.model.on_state_change, **self.listen_options
+        )
+
+    def run(self):
+        # Log records would scribble over the screen, the last warning goes in the footer instead
+        handlers, propagate = certstream_logger.handlers, certstream_logger.propagate
+        certstream_logger.handlers, certstream_logger.propagate = [self.status_handler], False
+
+        thread = threading.Thread(target=self._listen, name="certstream-tui")
+        thread.daemon = True
+        thread.start()
+        try:
+            self._tick()
+            self.loop.run()
+        finally:
+            self.stop_event.set()
+            certstream_logger.handlers, certstream_logger.propagate = handlers, propagate
+
+def run(url, size=1000, fps=10, **kwargs):
+    FeedViewer(url, size=size, fps=fps, **kwargs).run()
+
+certstream_logger = logging.getLogger('certstream')
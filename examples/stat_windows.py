@@ -1,40 +1,27 @@
+import logging
 import time
-from collections import deque
 
 import certstream
-
-import logging
+from certstream.stats import StreamStats
 
 logger = logging.getLogger('stat_counter')
 
 NUM_MINUTES = 1
 INTERVAL = NUM_MINUTES * 60
 
-def callback(message, context):
-    if not context.get('edge'):
-        context.edge = time.time() + INTERVAL
-        context.counter = deque()
-        context.heartbeats = deque()
-
-    if message['message_type'] != "heartbeat":
-        context.counter.append(message)
-    else:
-        context.heartbeats.append(message)
-
-    if time.time() > context['edge']:
-        logger.info(
-            "Edge has been broken, writing out. {} results for the last {} minute/s ({} heartbeats)".format(
-                len(context.counter),
-                NUM_MINUTES,
-                len(context.heartbeats)
-            )
+def on_window(snapshot):
+    logger.info(
+        "Edge has been broken, writing out. {} results for the last {} minute/s ({} heartbeats, ~{} distinct domains)".format(
+            snapshot['certificates'],
+            NUM_MINUTES,
+            snapshot['heartbeats'],
+            snapshot['distinct_domains'],
         )
+    )
 
-        with open('/tmp/out.csv', 'a') as f:
-            f.write("{},{}\n".format(time.time(), len(context['counter'])))
+    with open('/tmp/out.csv', 'a') as f:
+        f.write("{},{}\n".format(time.time(), snapshot['certificates']))
 
-        context.counter.clear()
-        context.heartbeats.clear()
-        context.edge = time.time() + INTERVAL
+stats = StreamStats(window=INTERVAL, on_window=on_window)
 
-certstream.listen_for_events(callback, url='wss://certstream.calidog.io/', skip_heartbeats=False)
\ No newline at end of file
+certstream.listen_for_events(stats, url='wss://certstream.calidog.io/', skip_heartbeats=False)
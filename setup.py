@@ -1,11 +1,16 @@
 from setuptools import setup
 import os
+import re
 
 here = os.path.abspath(os.path.dirname(__file__))
 
 with open('requirements.txt') as f:
     dependencies = f.read().splitlines()
 
+# Read rather than imported, importing the package needs its dependencies
+with open(os.path.join(here, 'certstream', '__init__.py')) as f:
+    version = re.search(r'^__version__ = "([^"]+)"', f.read(), re.M).group(1)
+
 long_description = """
 Certstream is a library to connect to the certstream network (certstream.calidog.io). 
 
@@ -14,19 +19,26 @@ It supports automatic reconnection when networks issues occur, and should be sta
 
 setup(
     name='certstream',
-    version="1.12",
+    version=version,
     url='https://github.com/CaliDog/certstream-python/',
     author='Ryan Sears',
     install_requires=dependencies,
     setup_requires=dependencies,
+    extras_require={
+        'aio': ['websockets'],
+        'fast': ['orjson'],
+        'x509': ['cryptography'],
+        'tui': ['urwid'],
+    },
     author_email='ryan@calidog.io',
     description='CertStream is a library for receiving certificate transparency list updates in real time.',
     long_description=long_description,
-    packages=['certstream',],
+    packages=['certstream', 'certstream.bench'],
     include_package_data=True,
     entry_points={
         'console_scripts': [
             'certstream = certstream.cli:main',
+            'certstream-relay = certstream.relay:main',
         ],
     },
     license = "MIT",
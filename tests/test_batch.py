@@ -0,0 +1,72 @@
+import threading
+import time
+
+from certstream.batch import Batcher
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_batches_by_size_then_interval():
+    batches = []
+    batcher = Batcher(lambda frames, context: batches.append((list(frames), context)), batch_size=10, batch_interval=0.2)
+    for i in range(25):
+        batcher(i, 'context')
+    assert [frames for frames, _ in batches] == [list(range(10)), list(range(10, 20))]
+
+    assert _wait_for(lambda: len(batches) == 3)
+    assert batches[2] == (list(range(20, 25)), 'context')
+    batcher.close()
+
+def test_close_flushes_pending_frames():
+    batches = []
+    batcher = Batcher(lambda frames, context: batches.append(frames), batch_size=100, batch_interval=60)
+    batcher(1, None)
+    batcher(2, None)
+    batcher.close()
+    assert batches == [[1, 2]]
+    assert not batcher.thread.is_alive()
+
+def test_callback_errors_dont_stop_batching():
+    batches = []
+
+    def _callback(frames, context):
+        batches.append(frames)
+        if len(batches) < 3:
+            raise RuntimeError("broken")
+
+    batcher = Batcher(_callback, batch_size=2, batch_interval=0.1)
+    # Raised on the receive thread by a full batch, then on the timer thread
+    batcher(1, None)
+    batcher(2, None)
+    batcher(3, None)
+    assert _wait_for(lambda: len(batches) == 2)
+    batcher(4, None)
+    assert _wait_for(lambda: len(batches) == 3)
+    assert batches == [[1, 2], [3], [4]]
+    assert batcher.thread.is_alive()
+    batcher.close()
+
+def test_batches_are_delivered_one_at_a_time():
+    active = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def _callback(frames, context):
+        with lock:
+            active.append(1)
+            overlaps.append(len(active))
+        time.sleep(0.005)
+        with lock:
+            active.pop()
+
+    batcher = Batcher(_callback, batch_size=3, batch_interval=0.001)
+    threads = [threading.Thread(target=lambda: [batcher(i, None) for i in range(50)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+    assert max(overlaps) == 1
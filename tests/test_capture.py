@@ -0,0 +1,120 @@
+import json
+import os
+
+import pytest
+
+from certstream.bench.frames import HEARTBEAT, synthetic_frames
+from certstream.capture import COMPRESSIONS, FORMATS, Recorder, find_segments, read_index, read_segment, replay
+from certstream.decode import LazyFrame
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def _frames(count=200):
+    frames = []
+    for i, frame in enumerate(synthetic_frames(count, seed=5)):
+        frame['data']['seen'] = 1700000000.0 + i
+        frames.append(frame)
+        if i % 25 == 0:
+            frames.append(dict(HEARTBEAT, timestamp=1700000000.0 + i))
+    return frames
+
+def _record(directory, frames, **kwargs):
+    recorder = Recorder(str(directory), **kwargs)
+    for frame in frames:
+        recorder(frame)
+    recorder.close()
+    return recorder
+
+def _replay(path, **kwargs):
+    replayed = []
+    replay(lambda frame, context: replayed.append(frame), str(path), **kwargs)
+    return replayed
+
+@pytest.mark.parametrize('format', FORMATS)
+@pytest.mark.parametrize('compression', [None, 'gzip', 'zstd'])
+@pytest.mark.parametrize('lazy', [False, True])
+def test_round_trip(tmpdir, format, compression, lazy):
+    if compression == 'zstd' and zstandard is None:
+        pytest.skip("zstandard isn't installed")
+
+    frames = _frames()
+    # Lazy frames are written out as the bytes they were received as
+    recorded = [LazyFrame(json.dumps(frame).encode('utf-8')) for frame in frames] if lazy else frames
+    _record(tmpdir, recorded, format=format, compression=compression, segment_size=20000)
+
+    segments = find_segments(str(tmpdir))
+    assert len(segments) > 1
+    assert all(segment.endswith('.' + format + COMPRESSIONS[compression]) for segment in segments)
+    assert sum(entry['frames'] for entry in read_index(str(tmpdir))) == len(frames)
+
+    replayed = _replay(tmpdir, skip_heartbeats=False, lazy=lazy)
+    assert [frame.to_dict() if lazy else frame for frame in replayed] == frames
+    if lazy:
+        assert all(isinstance(frame, LazyFrame) for frame in replayed)
+
+def test_index_describes_each_segment(tmpdir):
+    frames = _frames()
+    updates = [frame for frame in frames if frame['message_type'] == 'certificate_update']
+    recorder = _record(tmpdir, [LazyFrame(json.dumps(frame).encode('utf-8')) for frame in frames], segment_size=10 ** 9)
+
+    entry, = read_index(str(tmpdir))
+    assert entry['file'] == os.path.basename(recorder.path)
+    assert entry['frames'] == len(frames)
+    assert entry['first_seen'] == min(frame['data']['seen'] for frame in updates)
+    assert entry['last_seen'] == max(frame['data']['seen'] for frame in updates)
+
+    logs = {}
+    for frame in updates:
+        indexes = logs.setdefault(frame['data']['source']['url'], [])
+        indexes.append(frame['data']['cert_index'])
+    assert entry['logs'] == dict((url, [min(indexes), max(indexes)]) for url, indexes in logs.items())
+
+def test_find_segments_skips_by_time_and_index(tmpdir):
+    frames = [frame for frame in _frames(400) if frame['message_type'] == 'certificate_update']
+    _record(tmpdir, frames, segment_size=20000)
+    entries = read_index(str(tmpdir))
+    assert len(entries) > 2
+
+    middle = entries[1]
+    found = find_segments(str(tmpdir), start=middle['first_seen'], end=middle['last_seen'])
+    assert [os.path.basename(segment) for segment in found] == [middle['file']]
+
+    url, (first, last) = sorted(middle['logs'].items())[0]
+    found = [os.path.basename(segment) for segment in find_segments(str(tmpdir), log_url=url, cert_index=first)]
+    assert middle['file'] in found
+    assert find_segments(str(tmpdir), log_url='ct.example.com/unknown/') == []
+
+def test_replay_time_range(tmpdir):
+    frames = _frames()
+    _record(tmpdir, frames)
+    start, end = 1700000050.0, 1700000099.0
+
+    expected = [frame for frame in frames if frame['message_type'] == 'certificate_update' and start <= frame['data']['seen'] <= end]
+    assert _replay(tmpdir, start=start, end=end) == expected
+
+    replayed = _replay(tmpdir, start=start, end=end, lazy=True)
+    # Filtering by time doesn't need the frames decoded
+    assert not any(frame.decoded for frame in replayed)
+    assert [frame.to_dict() for frame in replayed] == expected
+
+def test_replay_skips_heartbeats_by_default(tmpdir):
+    frames = _frames()
+    _record(tmpdir, frames)
+    replayed = _replay(tmpdir)
+    assert len(replayed) == len([frame for frame in frames if frame['message_type'] != 'heartbeat']) < len(frames)
+
+def test_truncated_segment_is_read_up_to_where_it_stops(tmpdir):
+    frames = _frames()
+    recorder = _record(tmpdir, frames, compression='gzip')
+    with open(recorder.path, 'rb') as f:
+        data = f.read()
+    with open(recorder.path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+
+    raws = list(read_segment(recorder.path))
+    assert 0 < len(raws) < len(frames)
+    # Only the last line can be cut short
+    assert [json.loads(raw) for raw in raws[:-1]] == frames[:len(raws) - 1]
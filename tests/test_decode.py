@@ -0,0 +1,83 @@
+import json
+import pickle
+
+import pytest
+
+from certstream.bench.fakectlog import FakeCTLog
+from certstream.bench.frames import HEARTBEAT, synthetic_frames
+from certstream.decode import SNIFFED_FIELDS, LazyFrame, get_decoder, sniff_field, sniff_message_type
+from certstream.gaps import entry_to_frame
+
+def _layouts():
+    frames = list(synthetic_frames(200, seed=13))
+    log = FakeCTLog(size=20)
+    try:
+        frames += [entry_to_frame({'url': 'ct.example.com/2024/', 'name': 'Example'}, i, log.entry(i), log.url) for i in range(20)]
+    finally:
+        log.stop()
+
+    no_domains = json.loads(json.dumps(frames[0]))
+    no_domains['data']['leaf_cert']['all_domains'] = []
+    escaped = json.loads(json.dumps(frames[1]))
+    escaped['data']['source'] = {'name': 'A "quoted" log', 'url': u'ct.exämple.com/\\log/'}
+    # The source, index and seen time ahead of the certificates, and the chain's fingerprints before the leaf's
+    reordered = {'message_type': 'certificate_update', 'data': {
+        'source': {'url': 'ct.example.com/', 'name': 'Example'}, 'cert_index': 5, 'seen': 1.5,
+        'chain': [{'fingerprint': 'CHAIN'}], 'leaf_cert': {'fingerprint': 'LEAF', 'all_domains': ['example.com']},
+    }}
+    frames += [no_domains, escaped, reordered]
+
+    raws = []
+    for frame in frames:
+        raws.append(json.dumps(frame).encode('utf-8'))
+        raws.append(json.dumps(frame, separators=(',', ':')).encode('utf-8'))
+    return raws
+
+@pytest.mark.parametrize('field', sorted(SNIFFED_FIELDS))
+def test_sniffed_fields_match_the_decoded_frame(field):
+    for raw in _layouts():
+        decoded = SNIFFED_FIELDS[field](json.loads(raw))
+        sniffed = sniff_field(raw, field)
+        # None means the caller has to decode the frame after all
+        assert sniffed is None or sniffed == decoded, raw
+        assert LazyFrame(raw).sniff(field) == decoded
+
+def test_sniffing_doesnt_decode():
+    raw = json.dumps(next(iter(synthetic_frames(1, seed=14)))).encode('utf-8')
+    frame = LazyFrame(raw)
+    for field in SNIFFED_FIELDS:
+        assert frame.sniff(field) is not None
+    assert frame['message_type'] == 'certificate_update'
+    assert not frame.decoded
+
+    frame['data']
+    assert frame.decoded
+
+def test_sniff_unknown_field():
+    with pytest.raises(ValueError):
+        sniff_field(b'{}', 'issuer')
+
+def test_sniff_message_type():
+    heartbeat = json.dumps(HEARTBEAT)
+    assert sniff_message_type(heartbeat) == 'heartbeat'
+    assert sniff_message_type(heartbeat.encode('utf-8')) == 'heartbeat'
+    # The top level key is the last one, whatever the certificate holds
+    assert sniff_message_type(b'{"data": {"message_type": "nested"}, "message_type": "certificate_update"}') == 'certificate_update'
+    assert sniff_message_type(b'{}') is None
+
+def test_lazy_frame_mapping_and_pickling():
+    frame_dict = next(iter(synthetic_frames(1, seed=15)))
+    frame = LazyFrame(json.dumps(frame_dict))
+    assert dict(frame) == frame_dict and len(frame) == len(frame_dict)
+    assert frame.get('missing', 'default') == 'default'
+
+    unpickled = pickle.loads(pickle.dumps(LazyFrame(json.dumps(frame_dict).encode('utf-8'))))
+    assert not unpickled.decoded
+    assert unpickled.to_dict() == frame_dict
+
+def test_get_decoder():
+    assert get_decoder('json') is json.loads
+    assert get_decoder(len) is len
+    assert get_decoder(None)(b'{"a": 1}') == {'a': 1}
+    with pytest.raises(ValueError):
+        get_decoder('yaml')
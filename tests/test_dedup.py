@@ -0,0 +1,73 @@
+import collections
+import threading
+import time
+
+from certstream.bench.frames import HEARTBEAT, synthetic_frames
+from certstream.bench.replay import ReplayServer
+from certstream.dedup import Deduplicator, SeenSet
+from certstream.multi import listen_for_events_multi
+
+def test_seen_set_expires_keys():
+    seen = SeenSet(ttl=10)
+    assert seen.add('a', now=0)
+    assert not seen.add('a', now=5)
+    # Seeing it again doesn't extend its ttl without refresh
+    assert seen.add('a', now=10)
+
+    refreshed = SeenSet(ttl=10)
+    refreshed.add('a', now=0)
+    assert not refreshed.add('a', now=8, refresh=True)
+    assert not refreshed.add('a', now=15, refresh=True)
+    assert refreshed.add('a', now=26)
+
+def test_seen_set_evicts_the_oldest_keys():
+    seen = SeenSet(max_size=3, ttl=100)
+    for i, key in enumerate('abcd'):
+        seen.add(key, now=i)
+    assert [key for key, _ in seen.items()] == ['b', 'c', 'd']
+    assert seen.add('a', now=5)
+
+def test_seen_set_update_merges_in_expiry_order():
+    seen = SeenSet(max_size=3, ttl=100)
+    seen.add('a', now=0)
+    seen.update([('b', 50), ('a', 200), ('c', 30), ('old', 1)], now=10)
+    assert seen.items() == [('c', 30), ('b', 50), ('a', 200)]
+
+def test_deduplicator_keys():
+    frames = list(synthetic_frames(50, seed=9))
+    for key in ('fingerprint', 'index', lambda frame: frame['data']['leaf_cert']['all_domains'][0]):
+        dedup = Deduplicator(key=key)
+        assert all(dedup(frame) for frame in frames)
+        assert not any(dedup(frame) for frame in frames)
+        assert dedup.duplicates == len(frames)
+        assert dedup(HEARTBEAT) and dedup(HEARTBEAT)
+
+def test_multi_delivers_each_certificate_once():
+    frames = list(synthetic_frames(400, seed=10))
+    # Mirrors sending the same certificates, one of them a few at a time
+    servers = [ReplayServer(frames).start(), ReplayServer(frames, rate=2000).start()]
+    delivered = collections.Counter()
+    stop = threading.Event()
+
+    def _callback(frame, context):
+        delivered[frame['data']['leaf_cert']['fingerprint']] += 1
+
+    def _watch():
+        deadline = time.time() + 30
+        while len(delivered) < len(frames) and time.time() < deadline:
+            time.sleep(0.05)
+        # Give the slower mirror time to send its copies too
+        time.sleep(0.3)
+        stop.set()
+
+    watcher = threading.Thread(target=_watch)
+    watcher.start()
+    try:
+        listen_for_events_multi(_callback, [server.url for server in servers], stop_event=stop, backoff=60, setup_logger=False)
+    finally:
+        watcher.join()
+        for server in servers:
+            server.stop()
+
+    assert len(delivered) == len(frames)
+    assert set(delivered.values()) == {1}
@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+from certstream.batch import Batcher
+from certstream.core import _build_pipeline, _close_stages, _flush_stages
+from certstream.dispatch import Dispatcher
+
+def _record(frame, context):
+    pass
+
+def test_every_frame_is_dispatched_once():
+    received = []
+    lock = threading.Lock()
+
+    def _callback(frame, context):
+        with lock:
+            received.append(frame)
+
+    dispatcher = Dispatcher(_callback, queue_size=10, workers=4)
+    for i in range(1000):
+        dispatcher(i, None)
+    dispatcher.close()
+
+    assert sorted(received) == list(range(1000))
+    assert dispatcher.counters() == {'depth': 0, 'max_depth': dispatcher.max_depth, 'enqueued': 1000, 'dispatched': 1000, 'dropped': 0}
+    assert dispatcher.max_depth <= 10
+
+@pytest.mark.parametrize('overflow,kept', [('drop-newest', [0, 1, 2]), ('drop-oldest', [0, 4, 5])])
+def test_overflow_policies(overflow, kept):
+    gate = threading.Event()
+    received = []
+
+    def _callback(frame, context):
+        gate.wait()
+        received.append(frame)
+
+    dispatcher = Dispatcher(_callback, queue_size=2, workers=1, overflow=overflow)
+    dispatcher(0, None)
+    # The worker is stuck on the first frame, the rest queue up or get dropped
+    time.sleep(0.1)
+    for i in range(1, 6):
+        dispatcher(i, None)
+    gate.set()
+    dispatcher.close()
+
+    assert received == kept
+    assert dispatcher.dropped == 3
+
+def test_producer_blocked_on_close_drops_its_frame():
+    gate = threading.Event()
+    received = []
+
+    def _callback(frame, context):
+        gate.wait()
+        received.append(frame)
+
+    dispatcher = Dispatcher(_callback, queue_size=1, workers=1)
+    dispatcher(0, None)
+    time.sleep(0.1)
+    dispatcher(1, None)
+    producer = threading.Thread(target=dispatcher, args=(2, None))
+    producer.start()
+    time.sleep(0.1)
+
+    closer = threading.Thread(target=dispatcher.close)
+    closer.start()
+    time.sleep(0.1)
+    gate.set()
+    closer.join(5)
+    producer.join(5)
+
+    assert received == [0, 1]
+    assert dispatcher.dropped == 1
+
+def test_flush_waits_for_queued_frames():
+    batches = []
+    callback, stages = _build_pipeline(None, batch_callback=lambda frames, context: batches.append(list(frames)),
+                                       batch_size=1000, batch_interval=60, queue_size=100, workers=2)
+    dispatcher = [stage for stage in stages if isinstance(stage, Dispatcher)][0]
+    batcher = [stage for stage in stages if isinstance(stage, Batcher)][0]
+    deliver = dispatcher.message_callback
+
+    def _slow(frame, context):
+        time.sleep(0.002)
+        deliver(frame, context)
+    dispatcher.message_callback = _slow
+
+    for i in range(100):
+        callback(i, None)
+    # Flushed outermost first, so the batcher sees everything the queue held
+    assert stages.index(dispatcher) < stages.index(batcher)
+    _flush_stages(stages)
+    assert sorted(frame for batch in batches for frame in batch) == list(range(100))
+    _close_stages(stages)
+
+def test_process_workers_need_a_picklable_callback_unless_forked(monkeypatch):
+    import multiprocessing
+    monkeypatch.setattr(multiprocessing, 'get_start_method', lambda *args, **kwargs: 'spawn')
+    with pytest.raises(ValueError):
+        Dispatcher(lambda frame, context: None, worker_type='process')
+
+def test_invalid_options():
+    with pytest.raises(ValueError):
+        Dispatcher(_record, overflow='drop-everything')
+    with pytest.raises(ValueError):
+        Dispatcher(_record, worker_type='fiber')
+    with pytest.raises(ValueError):
+        Dispatcher(_record, queue_size=0)
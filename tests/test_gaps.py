@@ -0,0 +1,105 @@
+import collections
+import threading
+import time
+
+import certstream
+
+from certstream.bench.fakectlog import FakeCTLog
+from certstream.bench.replay import ReplayServer
+from certstream.gaps import Backfiller, SequenceTracker, entry_to_frame, parse_entry
+
+def test_tracker_records_and_fills_gaps():
+    gaps = []
+    tracker = SequenceTracker(on_gap=lambda url, start, end: gaps.append((url, start, end)))
+
+    for index in (1, 2, 5, 6, 10):
+        assert tracker.observe('log', index)
+    assert gaps == [('log', 3, 4), ('log', 7, 9)]
+    assert tracker.missing == {'log': [(3, 4), (7, 9)]}
+    assert tracker.outstanding == 5
+    assert tracker.is_missing('log', 4, 7) and not tracker.is_missing('log', 5, 6)
+
+    # Late certificates fill their gap once, anything else before the position is a duplicate
+    assert tracker.observe('log', 8)
+    assert not tracker.observe('log', 8)
+    assert not tracker.observe('log', 6)
+    assert tracker.missing == {'log': [(3, 4), (7, 7), (9, 9)]}
+    assert (tracker.gaps, tracker.missed, tracker.recovered, tracker.duplicates) == (2, 5, 1, 2)
+
+    for index in (3, 4, 7, 9):
+        assert tracker.fill('log', index)
+    assert tracker.missing == {} and tracker.outstanding == 0
+
+def test_tracker_keeps_logs_apart_and_resumes_from_positions():
+    tracker = SequenceTracker(positions={'a': 10})
+    assert tracker.observe('b', 100)
+    assert tracker.observe('a', 12)
+    assert tracker.missing == {'a': [(11, 11)]}
+    assert tracker.positions == {'a': 12, 'b': 100}
+
+def test_tracker_gives_up_on_the_oldest_ranges():
+    tracker = SequenceTracker(max_ranges=2)
+    for index in (0, 2, 4, 6):
+        tracker.observe('log', index)
+    assert tracker.missing == {'log': [(3, 3), (5, 5)]}
+    assert tracker.abandoned == 1
+
+def test_parse_entry_matches_the_log():
+    log = FakeCTLog(size=10)
+    try:
+        for index in (0, 1):
+            update_type, leaf, chain, timestamp = parse_entry(log.entry(index))
+            assert update_type == ('PrecertLogEntry' if index % 2 else 'X509LogEntry')
+            assert len(chain) == 1
+            assert timestamp == log.start_time + index
+
+            frame = entry_to_frame({'url': 'ct.example/', 'name': 'Example'}, index, log.entry(index), log.url)
+            domains = frame['data']['leaf_cert']['all_domains']
+            assert domains[1] == 'www.' + domains[0]
+            assert frame['data']['cert_index'] == index and frame['data']['backfilled']
+    finally:
+        log.stop()
+
+def _listen_until(callback, url, done, timeout=30, **kwargs):
+    stop = threading.Event()
+
+    def _watch():
+        deadline = time.time() + timeout
+        while not done() and time.time() < deadline:
+            time.sleep(0.05)
+        stop.set()
+
+    watcher = threading.Thread(target=_watch)
+    watcher.start()
+    certstream.listen_for_events(callback, url, stop_event=stop, setup_logger=False, **kwargs)
+    watcher.join()
+
+def test_backfill_delivers_every_entry_exactly_once():
+    log = FakeCTLog(size=1500, max_entries=100, fail_every=7).start()
+    frames = log.frames(drop=0.05, seed=1)
+    assert len(frames) < log.size
+    # Every connection replays the whole stream, so reconnects deliver every certificate again as well
+    server = ReplayServer(frames, count=len(frames)).start()
+
+    delivered = collections.Counter()
+    backfilled = set()
+
+    def _callback(frame, context):
+        delivered[frame['data']['cert_index']] += 1
+        if frame['data'].get('backfilled'):
+            backfilled.add(frame['data']['cert_index'])
+
+    backfiller = Backfiller(delay=0.1, backoff=0.05, log_url=lambda source: log.url)
+    tracker = SequenceTracker(backfill=backfiller)
+    try:
+        _listen_until(_callback, server.url, lambda: len(delivered) == log.size and tracker.outstanding == 0,
+                      gaps=tracker, backoff=0.1)
+    finally:
+        server.stop()
+        log.stop()
+
+    assert sorted(delivered) == list(range(log.size))
+    assert set(delivered.values()) == {1}
+    assert backfilled == set(range(log.size)) - set(frame['data']['cert_index'] for frame in frames)
+    assert backfiller.retried > 0
+    assert tracker.missing == {}
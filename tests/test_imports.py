@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+from certstream.bench.imports import BUDGETS, _loaded, measure
+
+# Shared CI machines are slower and noisier than a laptop, raise this rather than the budgets themselves
+SCALE = float(os.environ.get('CERTSTREAM_IMPORT_BUDGET_SCALE', '2'))
+
+@pytest.mark.parametrize('module,budget,forbidden', BUDGETS, ids=[module for module, _, _ in BUDGETS])
+def test_import_budget(module, budget, forbidden):
+    elapsed, modules = measure(module, runs=3)
+    assert [name for name in forbidden if _loaded(modules, name)] == []
+    assert elapsed * 1000 <= budget * SCALE, "importing {} took {:.1f}ms".format(module, elapsed * 1000)
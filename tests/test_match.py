@@ -0,0 +1,79 @@
+import random
+import re
+
+import pytest
+
+from certstream.bench.frames import synthetic_frames
+from certstream.match import Matcher, _AhoCorasick, normalize_domain, split_domain
+
+def _kinds(matcher, domains):
+    return sorted((match.domain, match.kind, match.pattern) for match in matcher.match_domains(domains))
+
+def test_pattern_kinds():
+    matcher = Matcher(exact=['paypal.com'], suffixes=['.bank', 'example.org'], registrable=['amazon'], substrings=['login'])
+    assert _kinds(matcher, ['PayPal.com.']) == [('paypal.com', 'exact', 'paypal.com')]
+    assert _kinds(matcher, ['*.a.b.bank']) == [('a.b.bank', 'suffix', 'bank')]
+    assert _kinds(matcher, ['www.example.org']) == [('www.example.org', 'suffix', 'example.org')]
+    # Suffixes only match on label boundaries
+    assert _kinds(matcher, ['notexample.org', 'bank.com']) == []
+    assert _kinds(matcher, ['smile.amazon.co.uk']) == [('smile.amazon.co.uk', 'registrable', 'amazon')]
+    assert _kinds(matcher, ['a.com', 'secure-login.b.com']) == [('secure-login.b.com', 'substring', 'login')]
+    assert len(matcher.match_domains(['paypal.com', 'login.bank'], first=True)) == 1
+
+def test_matcher_as_a_filter():
+    matcher = Matcher(suffixes=['.example.com'])
+    frame = {'message_type': 'certificate_update', 'data': {'leaf_cert': {'all_domains': ['a.example.com']}}}
+    assert matcher(frame)
+    frame['data']['leaf_cert']['all_domains'] = ['a.example.net']
+    assert not matcher(frame)
+    assert matcher({'message_type': 'heartbeat'})
+
+@pytest.mark.parametrize('words', [['he', 'she', 'his', 'hers'], ['a', 'ab', 'abc', 'bc', 'c'], ['login', 'log', 'gin']])
+def test_pure_python_aho_corasick(words):
+    rng = random.Random(16)
+    automaton = _AhoCorasick(words)
+    for _ in range(200):
+        text = "".join(rng.choice('abcehilnorsg') for _ in range(30))
+        expected = sorted((start + len(word) - 1, word) for word in words for start in range(len(text)) if text.startswith(word, start))
+        assert sorted(automaton.iter(text)) == expected
+
+REGEXES = [
+    r'^paypal',
+    r'bank$',
+    r'\d{4}',
+    r'^(www|mail)\.',
+    r'(ab)\1',
+    r'(?P<word>[a-z]+)-(?P=word)',
+    r'\Aapple',
+    r'com\Z',
+    r'(?i)PAYPAL',
+    r'^(w)?(?(1)ww|mail)',
+]
+
+@pytest.mark.parametrize('pattern', REGEXES)
+def test_regexes_match_like_on_their_own(pattern):
+    regex = re.compile(pattern)
+    domains = [
+        'paypal.com', 'www.paypal-login.com', 'mybank', 'a.bank.com', 'x2024.example.com', 'mail.example.com',
+        'abab.net', 'login-login.com', 'apple.com', 'green-apple.io', 'PAYPAL.example', 'b.org',
+    ]
+    # Combined with other patterns, so the joined prefilter is used
+    matcher = Matcher(regexes=[regex, r'^nothing-matches-this$'])
+    for domain in domains:
+        expected = bool(regex.search(normalize_domain(domain)))
+        hits = [match for match in matcher.match_domains(['unrelated.example', domain]) if match.pattern == pattern]
+        assert bool(hits) == expected, domain
+
+def test_regexes_across_a_stream():
+    frames = list(synthetic_frames(500, seed=17))
+    regexes = [re.compile(pattern) for pattern in (r'^[a-m]', r'\.(net|org)$', r'([a-z])\1', r'(?i)TEST', r'\Ashop')]
+    matcher = Matcher(regexes=regexes)
+    for frame in frames:
+        domains = [normalize_domain(domain) for domain in frame['data']['leaf_cert']['all_domains']]
+        expected = sorted((domain, regex.pattern) for domain in domains for regex in regexes if regex.search(domain))
+        assert sorted((match.domain, match.pattern) for match in matcher.match_frame(frame)) == expected
+
+def test_split_domain():
+    assert split_domain('login.example.co.uk') == ('login', 'example', 'co.uk')
+    assert split_domain('*.www.Example.COM') == ('www', 'example', 'com')
+    assert split_domain('localhost') == ('', 'localhost', '')
@@ -0,0 +1,115 @@
+import os
+import pickle
+import time
+
+import pytest
+
+from certstream.bench.frames import HEARTBEAT
+from certstream.novelty import NoveltyFilter, RotatingBloomFilter
+
+def _frame(*domains):
+    return {
+        'message_type': 'certificate_update',
+        'data': {'leaf_cert': {'all_domains': list(domains), 'fingerprint': ":".join(domains)}},
+    }
+
+def test_bloom_filter_remembers_for_the_window():
+    start = time.time()
+    bloom = RotatingBloomFilter(memory=64 * 1024, window=300, slices=4)
+    assert bloom.add('a', now=start)
+    assert not bloom.add('a', now=start + 10)
+    assert 'a' in bloom and 'b' not in bloom
+
+    # Never forgotten within the window, even without refreshes
+    assert not bloom.add('a', now=start + 299, refresh=False)
+    # Forgotten once the slice holding it is rotated out
+    assert bloom.add('a', now=start + 401)
+
+def test_bloom_filter_refresh_keeps_keys():
+    start = time.time()
+    bloom = RotatingBloomFilter(memory=64 * 1024, window=300, slices=4)
+    for seconds in range(0, 1000, 100):
+        assert bloom.add('kept', now=start + seconds) == (seconds == 0)
+    assert bloom.add('dropped', now=start + 1000)
+    assert bloom.add('dropped', now=start + 2000)
+
+def test_bloom_filter_error_rate():
+    bloom = RotatingBloomFilter(memory=64 * 1024, window=3600, error_rate=0.01)
+    for i in range(5000):
+        bloom.add("seen{}".format(i))
+    false_positives = sum("unseen{}".format(i) in bloom for i in range(20000))
+    assert false_positives < 20000 * 0.01 * 2
+    assert bloom.early_rotations == 0
+
+def test_bloom_filter_rotates_early_when_full():
+    bloom = RotatingBloomFilter(memory=1024, window=3600, error_rate=0.01)
+    for i in range(bloom.capacity * 2):
+        bloom.add("key{}".format(i))
+    assert bloom.early_rotations >= 1
+    assert max(bloom.counts) <= bloom.capacity
+
+def test_bloom_filter_state_round_trip():
+    bloom = RotatingBloomFilter(memory=4096, window=300)
+    for i in range(100):
+        bloom.add("key{}".format(i))
+
+    restored = RotatingBloomFilter(memory=4096, window=300)
+    restored.restore(bloom.state())
+    assert all("key{}".format(i) in restored for i in range(100))
+    assert len(restored) == 100
+
+    with pytest.raises(ValueError):
+        RotatingBloomFilter(memory=8192, window=300).restore(bloom.state())
+
+@pytest.mark.parametrize('mode', ['lru', 'bloom'])
+def test_novelty_filter(mode):
+    novelty = NoveltyFilter(mode=mode, memory=64 * 1024)
+    assert novelty(_frame('a.example.com', 'b.example.com'))
+    assert not novelty(_frame('B.example.com.'))
+    assert novelty(_frame('b.example.com', 'c.example.com'))
+    assert novelty(HEARTBEAT)
+    assert novelty.repeats == 1
+
+def test_registered_domain_keys():
+    novelty = NoveltyFilter(key='registered_domain')
+    assert novelty(_frame('www.example.co.uk'))
+    assert not novelty(_frame('mail.example.co.uk'))
+    assert novelty(_frame('example.com'))
+    assert novelty.new_keys(_frame('a.example.org', 'b.example.org')) == ['example.org']
+
+@pytest.mark.parametrize('mode', ['lru', 'bloom'])
+def test_novelty_persists_across_restarts(tmpdir, mode):
+    path = str(tmpdir.join('seen.pickle'))
+    novelty = NoveltyFilter(mode=mode, memory=64 * 1024, path=path)
+    assert novelty(_frame('a.example.com'))
+    novelty.close()
+    assert os.path.exists(path) and not os.path.exists(path + '.tmp')
+
+    restarted = NoveltyFilter(mode=mode, memory=64 * 1024, path=path)
+    assert not restarted(_frame('a.example.com'))
+    assert restarted(_frame('b.example.com'))
+
+def test_novelty_state_from_another_mode_is_ignored(tmpdir):
+    path = str(tmpdir.join('seen.pickle'))
+    novelty = NoveltyFilter(mode='lru', path=path)
+    novelty(_frame('a.example.com'))
+    novelty.close()
+
+    restarted = NoveltyFilter(mode='bloom', memory=64 * 1024, path=path)
+    assert restarted(_frame('a.example.com'))
+
+def test_novelty_saves_in_the_background(tmpdir):
+    path = str(tmpdir.join('seen.pickle'))
+    novelty = NoveltyFilter(path=path, save_interval=0.05)
+    novelty(_frame('a.example.com'))
+
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                if [key for key, _ in pickle.load(f)['items']] == ['a.example.com']:
+                    break
+        time.sleep(0.02)
+    else:
+        pytest.fail("The novelty state wasn't saved")
+    novelty.close()
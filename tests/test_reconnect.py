@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+import certstream
+
+from certstream.backoff import Backoff, retry
+from certstream.bench.frames import synthetic_frames
+from certstream.bench.replay import ReplayServer
+from certstream.core import _domains_only_url
+
+def test_backoff_grows_and_caps():
+    backoff = Backoff(first=1, initial=2, factor=2, maximum=10, jitter=False)
+    assert [backoff.next_delay() for _ in range(6)] == [1, 2, 4, 8, 10, 10]
+
+def test_backoff_resets_after_a_long_connection():
+    backoff = Backoff(first=1, initial=2, maximum=60, reset_after=30, jitter=False)
+    backoff.next_delay()
+    backoff.next_delay()
+    assert backoff.next_delay(uptime=5) == 4
+    assert backoff.next_delay(uptime=31) == 1
+
+def test_backoff_jitter_stays_in_range():
+    backoff = Backoff(first=1, initial=2, maximum=8)
+    delays = [backoff.next_delay() for _ in range(200)]
+    assert all(0 <= delay <= 8 for delay in delays)
+    assert len(set(delays)) > 100
+
+def test_backoff_from_value():
+    fixed = Backoff.from_value(5)
+    assert [fixed.next_delay(uptime=100) for _ in range(3)] == [5, 5, 5]
+    backoff = Backoff()
+    assert Backoff.from_value(backoff) is backoff
+    assert isinstance(Backoff.from_value(None), Backoff)
+
+def test_retry():
+    calls = []
+    retried = []
+
+    def _flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise IOError("try again")
+        return 'done'
+
+    assert retry(_flaky, retries=5, backoff=0, on_retry=lambda ex, delay: retried.append(str(ex))) == 'done'
+    assert retried == ["try again", "try again"]
+
+    def _failing():
+        raise IOError("down")
+
+    with pytest.raises(IOError):
+        retry(_failing, retries=2, backoff=0)
+    with pytest.raises(IOError):
+        retry(_failing, retries=100, backoff=10, give_up=lambda: True)
+
+def test_domains_only_url():
+    assert _domains_only_url('wss://certstream.calidog.io') == 'wss://certstream.calidog.io/domains-only'
+    assert _domains_only_url('ws://127.0.0.1:4000/') == 'ws://127.0.0.1:4000/domains-only'
+    assert _domains_only_url('ws://relay:4000/?suffix=.bank') == 'ws://relay:4000/domains-only?suffix=.bank'
+
+def test_reconnects_and_tracks_positions():
+    frames = list(synthetic_frames(20, seed=18))
+    # Each connection is closed after the frames are sent, so the client keeps reconnecting
+    server = ReplayServer(frames).start()
+    states = []
+    contexts = set()
+    positions = {}
+    stop = threading.Event()
+
+    def _callback(frame, context):
+        context.received = (context.received or 0) + 1
+        contexts.add(id(context))
+
+    def _on_state_change(state, client):
+        states.append(state)
+        if states.count('disconnected') == 3:
+            stop.set()
+
+    try:
+        certstream.listen_for_events(_callback, server.url, backoff=0.05, positions=positions, on_state_change=_on_state_change,
+                                     stop_event=stop, setup_logger=False)
+    finally:
+        server.stop()
+
+    assert states == ['connecting', 'connected', 'disconnected'] * 3
+    # One context for the whole call, kept across reconnects
+    assert len(contexts) == 1
+    expected = {}
+    for frame in frames:
+        url = frame['data']['source']['url']
+        expected[url] = max(expected.get(url, 0), frame['data']['cert_index'])
+    assert positions == expected
+
+def test_stop_event_closes_the_connection():
+    server = ReplayServer(list(synthetic_frames(10, seed=19)), count=10 ** 9, rate=50).start()
+    stop = threading.Event()
+    received = []
+    timer = threading.Timer(0.5, stop.set)
+    timer.start()
+    started = time.time()
+    try:
+        certstream.listen_for_events(lambda frame, context: received.append(frame), server.url, stop_event=stop, setup_logger=False)
+    finally:
+        timer.cancel()
+        server.stop()
+
+    assert received
+    assert time.time() - started < 5
+    # The thread watching the event goes away with the loop
+    deadline = time.time() + 2
+    while any(thread.name == 'certstream-stop' for thread in threading.enumerate()) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not any(thread.name == 'certstream-stop' for thread in threading.enumerate())
+
+def test_contexts_are_not_shared_between_calls():
+    server = ReplayServer(list(synthetic_frames(5, seed=20))).start()
+    contexts = []
+    try:
+        for _ in range(2):
+            stop = threading.Event()
+
+            def _callback(frame, context):
+                contexts.append(context)
+                stop.set()
+
+            certstream.listen_for_events(_callback, server.url, stop_event=stop, setup_logger=False)
+    finally:
+        server.stop()
+
+    assert contexts[0] is not contexts[-1]
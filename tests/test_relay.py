@@ -0,0 +1,154 @@
+import json
+import threading
+import time
+
+import websocket
+
+from certstream.bench.frames import HEARTBEAT, synthetic_frames
+from certstream.bench.replay import ReplayServer
+from certstream.decode import LazyFrame
+from certstream.relay import Relay, Subscriber, subscriber_filter
+
+try:
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    from urlparse import parse_qs, urlsplit
+
+class _Connection(object):
+    """
+    Stands in for a subscriber's websocket connection, keeping what's sent to it. Sending blocks while `blocked`
+    isn't set.
+    """
+    def __init__(self, path='/'):
+        self.path = path
+        self.address = ('127.0.0.1', 5000)
+        self.sent = []
+        self.blocked = threading.Event()
+        self.blocked.set()
+        self.aborted = False
+        self.closed = False
+        self.on_close = None
+
+    @property
+    def route(self):
+        return urlsplit(self.path).path
+
+    @property
+    def query(self):
+        return parse_qs(urlsplit(self.path).query)
+
+    def send_raw(self, data):
+        self.blocked.wait()
+        self.sent.append(data)
+
+    def abort(self):
+        self.aborted = True
+        self.blocked.set()
+
+    def close(self, code=1000):
+        self.closed = True
+
+def _payload(frame):
+    # Unmasked server frames, as built by certstream.server.encode_frame
+    length = frame[1] & 0x7f
+    if length == 126:
+        return frame[4:]
+    if length == 127:
+        return frame[10:]
+    return frame[2:]
+
+def _messages(connection):
+    return [json.loads(_payload(frame)) for frame in connection.sent]
+
+def _frame(domains, log='ct.example.com/log/'):
+    frame = next(iter(synthetic_frames(1, seed=11)))
+    frame['data']['leaf_cert']['all_domains'] = domains
+    frame['data']['source']['url'] = log
+    return frame
+
+def _lazy(frame):
+    return LazyFrame(json.dumps(frame).encode('utf-8'))
+
+def test_subscriber_filter():
+    assert subscriber_filter({}) is None
+
+    accepts = subscriber_filter(parse_qs('suffix=.bank&contains=paypal&domain=example.org'))
+    assert accepts(_frame(['login.mybank.bank']))
+    assert accepts(_frame(['paypal-secure.example.com']))
+    assert accepts(_frame(['www.example.com', 'example.org']))
+    assert not accepts(_frame(['notabank.com', 'example.org.evil.com']))
+
+    by_log = subscriber_filter(parse_qs('log=ct.example.com/a/&suffix=.com'))
+    assert by_log(_frame(['example.com'], log='ct.example.com/a/'))
+    assert not by_log(_frame(['example.com'], log='ct.example.com/b/'))
+    assert not by_log(_frame(['example.org'], log='ct.example.com/a/'))
+
+def test_broadcast_filters_and_encodes_once():
+    relay = Relay('ws://127.0.0.1:1/', port=0)
+    connections = [_Connection('/'), _Connection('/domains-only'), _Connection('/?suffix=.org'), _Connection('/nowhere')]
+    for connection in connections:
+        relay._on_connect(connection)
+    assert connections[3].closed and len(relay.subscribers) == 3
+
+    frames = [_lazy(_frame(['a.example.com'])), _lazy(_frame(['b.example.org'])), LazyFrame(json.dumps(HEARTBEAT).encode('utf-8'))]
+    for frame in frames:
+        relay.broadcast(frame)
+    time.sleep(0.2)
+
+    full, domains_only, filtered = [_messages(connection) for connection in connections[:3]]
+    assert full == [frame.to_dict() for frame in frames]
+    assert domains_only == [
+        {'message_type': 'dns_entries', 'data': ['a.example.com']},
+        {'message_type': 'dns_entries', 'data': ['b.example.org']},
+        HEARTBEAT,
+    ]
+    assert filtered == [frames[1].to_dict(), HEARTBEAT]
+    # Full frames are passed on as they were received
+    assert connections[0].sent[0].endswith(frames[0].raw)
+    relay.stop()
+
+def test_frames_are_only_decoded_when_needed():
+    relay = Relay('ws://127.0.0.1:1/', port=0)
+    relay._on_connect(_Connection('/'))
+    frame = _lazy(_frame(['a.example.com']))
+    relay.broadcast(frame)
+    assert not frame.decoded
+    relay.stop()
+
+def test_slow_subscriber_is_evicted():
+    connection = _Connection()
+    connection.blocked.clear()
+    subscriber = Subscriber(connection, buffer_size=5)
+
+    # The first frame is taken by the sender, which is then stuck sending it
+    assert subscriber.push(b'first')
+    time.sleep(0.1)
+    assert all(subscriber.push(b'frame') for _ in range(5))
+    assert not subscriber.push(b'one too many')
+    assert subscriber.evicted and connection.aborted
+
+    subscriber.thread.join(5)
+    assert connection.closed
+
+def test_relay_end_to_end():
+    frames = list(synthetic_frames(200, seed=12))
+    upstream = ReplayServer(frames, count=len(frames), rate=1000).start()
+    stop = threading.Event()
+    relay = Relay(upstream.url, port=0, stop_event=stop, backoff=60, setup_logger=False)
+    # Subscribers connect before the upstream connection is opened, so they see the whole stream
+    relay.server.start()
+    subscriber = websocket.create_connection(relay.server.url + '/domains-only', timeout=10)
+    while not relay.subscribers:
+        time.sleep(0.01)
+
+    runner = threading.Thread(target=relay.run)
+    runner.start()
+    try:
+        received = [json.loads(subscriber.recv()) for _ in frames]
+    finally:
+        subscriber.close()
+        stop.set()
+        runner.join(10)
+        upstream.stop()
+
+    assert received == [{'message_type': 'dns_entries', 'data': frame['data']['leaf_cert']['all_domains']} for frame in frames]
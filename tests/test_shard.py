@@ -0,0 +1,119 @@
+import functools
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from certstream.bench.frames import HEARTBEAT, synthetic_frames
+from certstream.bench.replay import ReplayServer
+from certstream.decode import LazyFrame
+from certstream.match import registered_domain
+from certstream.shard import SHARD_KEYS, ShardRouter, listen_sharded
+
+class _Connection(object):
+    def __init__(self):
+        self.sent = []
+
+    def send_bytes(self, raw):
+        self.sent.append(raw)
+
+def _raw_frames(count=500):
+    return [json.dumps(frame).encode('utf-8') for frame in synthetic_frames(count, seed=7)]
+
+def _route(raws, shards=4, shard_key='registered_domain'):
+    connections = [_Connection() for _ in range(shards)]
+    router = ShardRouter(connections, shard_key=shard_key)
+    frames = [LazyFrame(raw) for raw in raws]
+    for frame in frames:
+        router(frame, None)
+    return router, connections, frames
+
+@pytest.mark.parametrize('shard_key', sorted(SHARD_KEYS))
+def test_every_key_goes_to_one_shard(shard_key):
+    decoded_key = {
+        'registered_domain': lambda frame: registered_domain(frame['data']['leaf_cert']['all_domains'][0]),
+        'domain': lambda frame: frame['data']['leaf_cert']['all_domains'][0],
+        'log': lambda frame: frame['data']['source']['url'],
+        'fingerprint': lambda frame: frame['data']['leaf_cert']['fingerprint'],
+    }[shard_key]
+    raws = _raw_frames()
+    router, connections, frames = _route(raws, shard_key=shard_key)
+
+    owners = {}
+    for shard, connection in enumerate(connections):
+        for raw in connection.sent:
+            owners.setdefault(decoded_key(json.loads(raw)), set()).add(shard)
+    assert all(len(shards) == 1 for shards in owners.values())
+    assert sorted(raw for connection in connections for raw in connection.sent) == sorted(raws)
+    assert sum(router.routed) == len(raws)
+    # The keys are read from the raw frames
+    assert not any(frame.decoded for frame in frames)
+
+def test_shards_are_stable_and_spread():
+    raws = _raw_frames(2000)
+    first = [len(connection.sent) for connection in _route(raws)[1]]
+    second = [len(connection.sent) for connection in _route(raws)[1]]
+    assert first == second
+    assert min(first) > len(raws) / 4 * 0.5
+
+def test_heartbeats_go_to_every_shard():
+    heartbeat = json.dumps(HEARTBEAT).encode('utf-8')
+    router, connections, _ = _route([heartbeat], shards=3)
+    assert [connection.sent for connection in connections] == [[heartbeat]] * 3
+    assert router.routed == [0, 0, 0]
+
+def test_callable_shard_key():
+    raws = _raw_frames(100)
+    _, connections, frames = _route(raws, shards=3, shard_key=lambda frame: frame['data']['cert_index'] % 5)
+    owners = {}
+    for shard, connection in enumerate(connections):
+        for raw in connection.sent:
+            owners.setdefault(json.loads(raw)['data']['cert_index'] % 5, set()).add(shard)
+    assert len(owners) == 5 and all(len(shards) == 1 for shards in owners.values())
+    # Reading more than sniff() offers decodes the frame
+    assert all(frame.decoded for frame in frames)
+
+def test_sinks_are_refused():
+    with pytest.raises(ValueError):
+        listen_sharded(lambda frame, context: None, 'ws://127.0.0.1:1/', sink=object())
+
+def _record_frame(directory, frame, context):
+    with open(os.path.join(directory, "shard-{}".format(context.shard)), 'a') as f:
+        f.write("{} {}\n".format(frame['data']['cert_index'], registered_domain(frame['data']['leaf_cert']['all_domains'][0])))
+
+def test_listen_sharded(tmpdir):
+    frames = list(synthetic_frames(300, seed=8))
+    server = ReplayServer(frames, count=len(frames)).start()
+    directory = str(tmpdir)
+
+    def _received():
+        return sum(len(open(os.path.join(directory, name)).readlines()) for name in os.listdir(directory))
+
+    stop = threading.Event()
+
+    def _watch():
+        deadline = time.time() + 30
+        while _received() < len(frames) and time.time() < deadline:
+            time.sleep(0.05)
+        stop.set()
+
+    watcher = threading.Thread(target=_watch)
+    watcher.start()
+    try:
+        listen_sharded(functools.partial(_record_frame, directory), server.url, shards=3, stop_event=stop, backoff=60)
+    finally:
+        watcher.join()
+        server.stop()
+
+    owners = {}
+    indexes = []
+    for name in os.listdir(directory):
+        for line in open(os.path.join(directory, name)):
+            index, domain = line.split()
+            indexes.append(int(index))
+            owners.setdefault(domain, set()).add(name)
+    assert sorted(indexes) == sorted(frame['data']['cert_index'] for frame in frames)
+    assert all(len(names) == 1 for names in owners.values())
+    assert len(os.listdir(directory)) == 3
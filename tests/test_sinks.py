@@ -0,0 +1,183 @@
+import json
+import sqlite3
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import pytest
+
+from certstream.bench.frames import synthetic_frames
+from certstream.capture import replay
+from certstream.core import _build_pipeline, _close_stages
+from certstream.decode import LazyFrame
+from certstream.sinks import HTTPSink, KafkaSink, RotatingFileSink, Sink, SQLiteSink, serialize
+
+class _ListSink(Sink):
+    def __init__(self, fail=0, delay=0, **kwargs):
+        self.batches = []
+        self.attempts = 0
+        self.fail = fail
+        self.delay = delay
+        super(_ListSink, self).__init__(**kwargs)
+
+    def send(self, records):
+        self.attempts += 1
+        time.sleep(self.delay)
+        if self.attempts <= self.fail:
+            raise IOError("unavailable")
+        self.batches.append(list(records))
+
+def test_batches_and_close():
+    sink = _ListSink(batch_size=10, batch_interval=60)
+    for i in range(25):
+        sink(i)
+    sink.close()
+    assert [len(batch) for batch in sink.batches] == [10, 10, 5]
+    assert sink.written == 25
+    with pytest.raises(ValueError):
+        sink(26)
+
+def test_flush_waits_for_the_writers():
+    sink = _ListSink(batch_size=100, batch_interval=60, delay=0.05)
+    for i in range(5):
+        sink(i)
+    sink.flush()
+    assert sink.batches == [[0, 1, 2, 3, 4]]
+    sink.close()
+
+def test_failed_batches_are_retried_then_handed_over():
+    sink = _ListSink(fail=2, batch_size=10, backoff=0)
+    for i in range(10):
+        sink(i)
+    sink.close()
+    assert sink.batches == [list(range(10))] and sink.retried == 2
+
+    failures = []
+    sink = _ListSink(fail=100, batch_size=10, retries=1, backoff=0, on_failure=lambda records, ex: failures.append((records, str(ex))))
+    for i in range(10):
+        sink(i)
+    sink.close()
+    assert failures == [(list(range(10)), "unavailable")]
+    assert sink.failed == 10 and sink.written == 0
+
+def test_a_full_queue_pushes_back():
+    sink = _ListSink(batch_size=5, queue_size=10, delay=0.05)
+    started = time.time()
+    for i in range(50):
+        sink(i)
+    # 50 records through a queue of 10 written 5 at a time
+    assert time.time() - started > 0.2
+    assert sink.blocked > 0
+    sink.close()
+    assert sorted(record for batch in sink.batches for record in batch) == list(range(50))
+
+def test_serialize():
+    frame = {'message_type': 'heartbeat'}
+    assert json.loads(serialize(frame)) == frame
+    assert serialize(LazyFrame(b'{"message_type": "heartbeat"}')) == b'{"message_type": "heartbeat"}'
+
+def test_sqlite_sink(tmpdir):
+    path = str(tmpdir.join('certs.db'))
+    frames = list(synthetic_frames(50, seed=21))
+    sink = SQLiteSink(path, fields=['cert_index', 'source.url', 'all_domains'], batch_size=20)
+    for frame in frames:
+        sink(frame)
+    sink({'message_type': 'heartbeat'})
+    sink.close()
+
+    rows = sqlite3.connect(path).execute("SELECT cert_index, source_url, all_domains FROM certificates ORDER BY rowid").fetchall()
+    assert rows == [
+        (frame['data']['cert_index'], frame['data']['source']['url'], json.dumps(frame['data']['leaf_cert']['all_domains']))
+        for frame in frames
+    ]
+
+def test_rotating_file_sink_replays(tmpdir):
+    frames = list(synthetic_frames(50, seed=22))
+    sink = RotatingFileSink(str(tmpdir), compression=None, batch_size=20)
+    for frame in frames:
+        sink(frame)
+    sink.close()
+
+    replayed = []
+    replay(lambda frame, context: replayed.append(frame), str(tmpdir))
+    assert replayed == frames
+
+def test_kafka_sink():
+    class _Producer(object):
+        def __init__(self):
+            self.sent = []
+
+        def send(self, topic, value, key):
+            self.sent.append((topic, json.loads(value), key))
+
+        def flush(self):
+            return 0
+
+    producer = _Producer()
+    sink = KafkaSink(producer, 'certs', key=lambda record: str(record['n']), batch_size=5)
+    for n in range(12):
+        sink({'n': n})
+    sink.close()
+    assert producer.sent == [('certs', {'n': n}, str(n).encode('utf-8')) for n in range(12)]
+
+def test_http_sink_retries_failed_posts():
+    received = []
+    requests = []
+    lock = threading.Lock()
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            with lock:
+                requests.append(self.path)
+                status = 500 if len(requests) % 3 == 0 else 200
+                if status == 200:
+                    received.extend(json.loads(line)['n'] for line in body.splitlines())
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    class _Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = _Server(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        sink = HTTPSink('http://127.0.0.1:{}/ingest?source=test'.format(server.server_address[1]), batch_size=50, writers=3, backoff=0.01)
+        for n in range(1000):
+            sink({'n': n})
+        sink.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert sorted(received) == list(range(1000))
+    assert sink.retried > 0 and sink.failed == 0
+    assert set(requests) == {'/ingest?source=test'}
+    # Keep-alive connections are reused
+    assert sink.pool.requests == len(requests)
+
+def test_sinks_in_the_pipeline():
+    frames = list(synthetic_frames(20, seed=23))
+    received = []
+    sink = _ListSink(batch_size=100, batch_interval=60)
+    callback, stages = _build_pipeline(lambda frame, context: received.append(frame), sink=sink, queue_size=10)
+    for frame in frames:
+        callback(frame, None)
+    _close_stages(stages)
+
+    assert received == frames
+    assert sink.batches == [frames]
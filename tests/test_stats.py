@@ -0,0 +1,138 @@
+import random
+
+from collections import Counter
+
+from certstream.stats import CountMinSketch, HyperLogLog, SpaceSaving, StreamStats
+
+def _check_invariants(counter):
+    # Every tracked key is in exactly the bucket of its count, and min_count is the smallest bucket
+    assert len(counter) <= counter.capacity
+    assert sum(len(bucket) for bucket in counter.buckets.values()) == len(counter.counts)
+    for count, bucket in counter.buckets.items():
+        assert bucket
+        for key in bucket:
+            assert counter.counts[key] == count
+    if counter.counts:
+        assert counter.min_count == min(counter.buckets)
+    assert set(counter.errors) == set(counter.counts)
+
+def _zipf_stream(length, keys, seed):
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(keys)]
+    return rng.choices(["key{}".format(rank) for rank in range(keys)], weights, k=length)
+
+def test_space_saving_is_exact_below_capacity():
+    counter = SpaceSaving(capacity=100)
+    stream = _zipf_stream(5000, 50, seed=1)
+    for key in stream:
+        counter.add(key)
+        _check_invariants(counter)
+
+    assert dict(counter.counts) == dict(Counter(stream))
+    assert all(error == 0 for error in counter.errors.values())
+
+def test_space_saving_invariants_when_full():
+    counter = SpaceSaving(capacity=50)
+    stream = _zipf_stream(20000, 2000, seed=2)
+    for i, key in enumerate(stream):
+        counter.add(key)
+        if i % 97 == 0:
+            _check_invariants(counter)
+    _check_invariants(counter)
+
+    true_counts = Counter(stream)
+    # Counts always add up to the stream length once full, and never under count
+    assert sum(counter.counts.values()) == counter.total == len(stream)
+    for key, count in counter.counts.items():
+        assert count - counter.errors[key] <= true_counts[key] <= count
+    # Anything counted more than total / capacity times is guaranteed to be tracked
+    for key, count in true_counts.items():
+        if count > len(stream) / counter.capacity:
+            assert key in counter.counts
+
+def test_space_saving_weighted_adds_and_merge():
+    left, right = SpaceSaving(capacity=20), SpaceSaving(capacity=20)
+    rng = random.Random(3)
+    for _ in range(2000):
+        left.add("key{}".format(rng.randrange(60)), rng.randrange(1, 5))
+        right.add("key{}".format(rng.randrange(60)), rng.randrange(1, 5))
+    _check_invariants(left)
+    _check_invariants(right)
+
+    total = left.total + right.total
+    left.merge(right)
+    _check_invariants(left)
+    assert left.total == total
+
+def test_space_saving_top():
+    counter = SpaceSaving(capacity=10)
+    for key, count in (('a', 5), ('b', 3), ('c', 8)):
+        for _ in range(count):
+            counter.add(key)
+    assert counter.top() == [('c', 8), ('a', 5), ('b', 3)]
+    assert counter.top(1) == [('c', 8)]
+
+def test_count_min_never_under_estimates():
+    sketch = CountMinSketch(width=256, depth=4)
+    stream = _zipf_stream(20000, 3000, seed=4)
+    for key in stream:
+        sketch.add(key)
+
+    errors = 0
+    for key, count in Counter(stream).items():
+        estimate = sketch.estimate(key)
+        assert estimate >= count
+        errors += estimate - count > 2.0 / sketch.width * sketch.total
+    # Out of bounds with probability 0.5 ** depth at most
+    assert errors <= 3000 * 0.5 ** sketch.depth
+
+def test_count_min_merge():
+    left, right, both = CountMinSketch(64, 3), CountMinSketch(64, 3), CountMinSketch(64, 3)
+    for i in range(500):
+        (left if i % 2 else right).add("key{}".format(i % 37))
+        both.add("key{}".format(i % 37))
+    left.merge(right)
+    assert left.table == both.table
+    assert left.total == both.total == 500
+
+def test_hyperloglog_accuracy_and_merge():
+    left, right = HyperLogLog(precision=12), HyperLogLog(precision=12)
+    for i in range(20000):
+        left.add("left{}".format(i))
+        right.add("right{}".format(i))
+    # Standard error is 1.6% at this precision
+    assert abs(left.count() - 20000) < 20000 * 0.05
+
+    left.merge(right)
+    assert abs(left.count() - 40000) < 40000 * 0.05
+
+def test_hyperloglog_small_counts():
+    counter = HyperLogLog()
+    for i in range(100):
+        counter.add("key{}".format(i % 50))
+    assert counter.count() == 50
+
+def _frame(domain, seen):
+    return {
+        'message_type': 'certificate_update',
+        'data': {
+            'seen': seen,
+            'cert_index': 0,
+            'source': {'url': 'ct.example.com/log/', 'name': 'Example'},
+            'leaf_cert': {'all_domains': [domain], 'fingerprint': domain, 'issuer': {'O': "Let's Encrypt"}},
+        },
+    }
+
+def test_stream_stats_sliding_windows():
+    windows = []
+    stats = StreamStats(window=60, slide=20, on_window=windows.append, event_time=True)
+    for second in range(0, 120):
+        stats.add(_frame("host{}.example.com".format(second % 7), float(second)))
+    stats.add({'message_type': 'heartbeat'}, now=120.0)
+
+    ends = [window['end'] for window in windows]
+    assert ends == [20, 40, 60, 80, 100, 120]
+    # Once warmed up, each window holds its last 60 seconds
+    assert [window['certificates'] for window in windows] == [20, 40, 60, 60, 60, 60]
+    assert windows[-1]['top_domains'] == [('example.com', 60)]
+    assert windows[-1]['distinct_domains'] == 7